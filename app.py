@@ -1,6 +1,40 @@
+from contextlib import asynccontextmanager
 from shiny import App
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Mount, Route
 from ui import app_ui
-from server import server
+from server import server, use_jobs
+from instrumentation import metrics
+from data import load_in_background
+from tasks import PREWARM, pool
+from jobs import JobQueue
 
 
-app = App(app_ui, server)
+async def metrics_endpoint(request):
+    return PlainTextResponse(metrics.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # the page is served right away; sessions fill their dataset selects
+    # once this load finishes
+    load_in_background()
+    # resume jobs a previous run left queued or running
+    jobs = JobQueue(pool)
+    use_jobs(jobs)
+    jobs.start()
+    if PREWARM:
+        pool.prewarm()
+    yield
+
+
+shiny_app = App(app_ui, server)
+
+app = Starlette(
+    routes=[
+        Route("/metrics", metrics_endpoint),
+        Mount("/", app=shiny_app),
+    ],
+    lifespan=lifespan,
+)
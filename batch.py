@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from bulk import BULK_EXTENSIONS
+from cache import SIMILARITY_VERSION, _write_json, source_signature
+from exports import EXPORT_FORMATS, export_filename, iter_export
+from similarity import METRICS
+from views import SIMILARITY_METRICS
+
+
+OUTPUT_DIR = 'results'
+MANIFEST = 'manifest.json'
+
+
+def _write_export(frame, path, fmt):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as fh:
+        for part in iter_export(frame, fmt):
+            fh.write(part)
+    os.replace(tmp, path)
+
+
+def _significance_columns(result, pvalue_col):
+    columns = {}
+    if result['pvalues'] is not None:
+        columns.update({pvalue_col: result['pvalues'], 'FDR': result['fdr']})
+    columns.update(result.get('bootstrap') or {})
+    return columns or None
+
+
+def similarity_output(dataset, path, fmt, pvalues=False, metric='distance_correlation', bootstrap=False):
+    """
+    Worker: CCLE × tumor ranking of one dataset, written in long format.
+    """
+    from tasks import similarity_job
+    from views import ResultView
+
+    start = time.perf_counter()
+    result = similarity_job(dataset, pvalues, metric, bootstrap)
+    label, ascending = SIMILARITY_METRICS[metric]
+    frame = ResultView.from_matrix(
+        result['matrix'], 'CCLE', 'Primary Tumor', label,
+        extra=_significance_columns(result, 'P-value'), ascending=ascending
+    ).frame
+    _write_export(frame, path, fmt)
+    return {'rows': len(frame), 'seconds': time.perf_counter() - start}
+
+
+def cross_modal_output(dataset, bulk_path, path, fmt, frozen=False, pvalues=False, metric='distance_correlation',
+                       top_k=None):
+    """
+    Worker: bulk × pseudo-bulk ranking of one bulk file against one dataset
+    (only the top_k matches of each bulk sample when set, streamed without
+    building the full matrix).
+    """
+    from tasks import cross_modal_job
+    from views import ResultView
+
+    start = time.perf_counter()
+    result = cross_modal_job(dataset, bulk_path, frozen=frozen, significance=pvalues, metric=metric, top_k=top_k)
+    label, ascending = SIMILARITY_METRICS[metric]
+    if top_k:
+        frame = result['top']
+    else:
+        frame = ResultView.from_matrix(
+            result['matrix'], 'Bulk_Sample', 'Pseudo_Centroid', label.replace(' ', '_'),
+            extra=_significance_columns(result, 'P_value'), ascending=ascending
+        ).frame
+    frame['sample_type'] = frame['Pseudo_Centroid'].map(result['sample_types'])
+    _write_export(frame, path, fmt)
+    return {'rows': len(frame), 'seconds': time.perf_counter() - start}
+
+
+def bulk_files(directory):
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(tuple(BULK_EXTENSIONS))
+    )
+
+
+def _bulk_stem(path):
+    name = os.path.basename(path)
+    for ext in sorted(BULK_EXTENSIONS, key=len, reverse=True):
+        if name.lower().endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+
+def plan(datasets, out_dir, fmt, source, bulk_dir=None, frozen=False, pvalues=False, cells=False, bootstrap=False,
+         metric='distance_correlation', top_k=None):
+    """
+    Every output of a run: {output key: (worker, args, output path, inputs signature)}.
+    Keys are output paths relative to out_dir, so runs in different formats
+    are tracked side by side.
+    """
+    jobs = {}
+    source_sig = source_signature(source)
+    for dataset in datasets:
+        path = os.path.join(out_dir, 'similarity', export_filename(dataset, fmt))
+        inputs = {
+            'source': source_sig, 'version': SIMILARITY_VERSION, 'format': fmt,
+            'pvalues': pvalues, 'bootstrap': bootstrap
+        }
+        if metric != 'distance_correlation':
+            inputs['metric'] = metric
+        jobs[os.path.relpath(path, out_dir)] = (
+            similarity_output, (dataset, path, fmt, pvalues, metric, bootstrap), path, inputs
+        )
+
+        if cells:
+            path = os.path.join(out_dir, 'cell_mmd', export_filename(dataset, fmt))
+            inputs = {'source': source_sig, 'version': SIMILARITY_VERSION, 'format': fmt, 'metric': 'mmd'}
+            jobs[os.path.relpath(path, out_dir)] = (similarity_output, (dataset, path, fmt, False, 'mmd'), path, inputs)
+
+        for bulk_path in (bulk_files(bulk_dir) if bulk_dir else []):
+            path = os.path.join(out_dir, 'cross_modal', dataset, export_filename(_bulk_stem(bulk_path), fmt))
+            inputs = {
+                'source': source_sig, 'bulk': source_signature(bulk_path),
+                'frozen': frozen, 'version': SIMILARITY_VERSION, 'format': fmt, 'pvalues': pvalues
+            }
+            if metric != 'distance_correlation':
+                inputs['metric'] = metric
+            if top_k:
+                inputs['top_k'] = top_k
+            jobs[os.path.relpath(path, out_dir)] = (
+                cross_modal_output, (dataset, bulk_path, path, fmt, frozen, pvalues, metric, top_k), path, inputs
+            )
+    return jobs
+
+
+def load_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST)
+    if os.path.exists(path):
+        with open(path) as fh:
+            return json.load(fh)
+    return {'outputs': {}}
+
+
+def run(datasets=None, out_dir=OUTPUT_DIR, fmt='parquet', bulk_dir=None, workers=None, frozen=False, force=False,
+        pvalues=False, cells=False, bootstrap=False, metric='distance_correlation', top_k=None):
+    """
+    Compute and write every output that is missing or out of date.
+
+    An output is up to date when the manifest records it with the same
+    inputs (source data and bulk file signatures, parameters, format) and
+    its file still exists. The manifest is rewritten after each finished
+    output, so an interrupted run resumes where it stopped.
+
+    Returns:
+        the manifest.
+    """
+    from data import SOURCE_PATH, sc_samples
+    from tasks import MAX_WORKERS
+
+    datasets = list(datasets or sc_samples.keys())
+    jobs = plan(datasets, out_dir, fmt, SOURCE_PATH, bulk_dir, frozen, pvalues, cells, bootstrap, metric, top_k)
+    manifest = load_manifest(out_dir)
+    manifest_path = os.path.join(out_dir, MANIFEST)
+
+    pending = {}
+    for key, (fn, args, path, inputs) in jobs.items():
+        done = manifest['outputs'].get(key)
+        if not force and done and done['inputs'] == inputs and os.path.exists(path):
+            print(f"up to date  {key}")
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pending[key] = (fn, args, path, inputs)
+
+    manifest['started'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    failures = 0
+    with ProcessPoolExecutor(max_workers=workers or MAX_WORKERS) as executor:
+        futures = {executor.submit(fn, *args): key for key, (fn, args, _, _) in pending.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            _, _, path, inputs = pending[key]
+            try:
+                stats = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"failed      {key}: {e}")
+                continue
+            manifest['outputs'][key] = {
+                'inputs': inputs,
+                'finished': time.strftime('%Y-%m-%dT%H:%M:%S'), **stats
+            }
+            _write_json(manifest_path, manifest)
+            print(f"done        {key} ({stats['rows']} rows, {stats['seconds']:.1f}s)")
+
+    manifest['finished'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    manifest['failures'] = failures
+    os.makedirs(out_dir, exist_ok=True)
+    _write_json(manifest_path, manifest)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute similarity rankings for every dataset without the web app.")
+    parser.add_argument('datasets', nargs='*', help="datasets to run (default: all)")
+    parser.add_argument('--out', default=OUTPUT_DIR, help="output directory")
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='parquet')
+    parser.add_argument('--bulk-dir', help="also run cross-modal integration for every bulk file in this directory")
+    parser.add_argument('--frozen', action='store_true', help="map bulk samples onto a frozen Harmony reference")
+    parser.add_argument('--pvalues', action='store_true', help="add permutation p-value and FDR columns")
+    parser.add_argument('--bootstrap', action='store_true', help="add bootstrap CI and rank probability columns")
+    parser.add_argument('--metric', choices=list(METRICS), default='distance_correlation',
+                        help="centroid similarity metric (similarity.py)")
+    parser.add_argument('--top-k', type=int,
+                        help="cross-modal: write only the best TOP_K centroids per bulk sample (bounded memory)")
+    parser.add_argument('--cells', action='store_true', help="also write cell-level MMD rankings (mmd.py)")
+    parser.add_argument('--workers', type=int, help="worker processes (default: CACAIO_MAX_WORKERS)")
+    parser.add_argument('--force', action='store_true', help="recompute outputs that are up to date")
+    args = parser.parse_args()
+    if args.top_k and args.pvalues and args.bulk_dir:
+        parser.error("--top-k cannot be combined with --pvalues for cross-modal outputs")
+
+    manifest = run(
+        args.datasets, args.out, args.format, args.bulk_dir, args.workers, args.frozen, args.force, args.pvalues,
+        args.cells, args.bootstrap, args.metric, args.top_k
+    )
+    raise SystemExit(1 if manifest['failures'] else 0)
@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from synthetic import make_bulk, make_embedding, make_gene_sets, make_reference
+
+
+SCALES = {
+    'small':  {'cells': 5_000,   'samples': 60,  'pcs': 50, 'genes': 2_000, 'bulk': 20},
+    'medium': {'cells': 50_000,  'samples': 300, 'pcs': 50, 'genes': 3_000, 'bulk': 100},
+    'large':  {'cells': 250_000, 'samples': 900, 'pcs': 50, 'genes': 4_000, 'bulk': 500},
+}
+
+BASELINE_PATH = 'benchmark_baseline.json'
+STARTUP_BUDGET = {'import_seconds': 1.5, 'first_response_seconds': 3.0}
+
+
+def measure(fn, repeat=3):
+    """
+    Best wall time over `repeat` runs and the tracemalloc peak of one run.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(times), 'peak_mb': peak / 2**20}
+
+
+def build_cases(scale, seed=0):
+    """
+    {name: zero-argument callable} for every function in functions.py.
+    """
+    import tempfile
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import enrichment
+    import functions as f
+    import heatmap
+    from views import ResultView
+    from exports import iter_export
+    from embedding import Embedding
+    from nearest import CentroidIndex
+    from significance import permutation_pvalues
+    import similarity
+    import mmd
+    import bootstrap
+
+    emb = make_embedding(scale['cells'], scale['samples'], scale['pcs'], seed=seed)
+    compact = Embedding.from_frame(emb)
+    scaler, pca, hv_genes = make_reference(scale['genes'], scale['pcs'], seed=seed)
+    bulk = make_bulk(scale['bulk'], hv_genes, seed=seed)
+
+    centroid_df, _ = f.compare_centroids_distance_correlation_from_df(emb)
+    pseudo_h, bulk_h = f.cross_modal_harmony_embeddings_from_df(emb, bulk, scaler, pca, hv_genes)
+    dc_matrix, _ = f.compute_distance_correlation_matrix(pseudo_h, bulk_h)
+    sample_types = pd.Series(
+        np.where(pseudo_h.index.str.startswith('CL'), 'cell_line', 'primary_tumor'),
+        index=pseudo_h.index
+    )
+
+    index = CentroidIndex.from_store(compact)
+    query_sample = index.centroids.index[0]
+    similarity_view = ResultView.from_matrix(centroid_df, 'CCLE', 'Primary Tumor', 'Distance Correlation')
+    centroids = compact.centroids()
+    ccle_centroids = centroids[compact.is_cell_line].values
+    tumor_centroids = centroids[~compact.is_cell_line].values
+
+    gene_set_root = tempfile.mkdtemp(prefix='cacaio-bench-')
+    enrichment.save_library('BENCH', make_gene_sets(hv_genes, seed=seed), gene_set_root)
+    query = hv_genes[:300]
+    enrichment_df = enrichment.enrich(query, 'BENCH', gene_set_root)
+
+    metric_cases = {
+        f'similarity {metric} {np.dtype(dtype).name}':
+            lambda metric=metric, dtype=dtype: similarity.similarity_matrix(ccle_centroids, tumor_centroids, metric, dtype)
+        for metric in similarity.METRICS for dtype in (np.float64, np.float32)
+    }
+
+    def plotted(fn):
+        def run():
+            fn()
+            plt.close('all')
+        return run
+
+    return {
+        'compare_centroids_distance_correlation_from_df':
+            lambda: f.compare_centroids_distance_correlation_from_df(emb),
+        'Embedding.from_frame': lambda: Embedding.from_frame(emb),
+        'compare_centroids_distance_correlation_from_df (Embedding)':
+            lambda: f.compare_centroids_distance_correlation_from_df(compact),
+        'CentroidIndex (build)': lambda: CentroidIndex.from_store(compact),
+        'CentroidIndex.query (k=10)': lambda: index.query(query_sample, 10),
+        'CentroidIndex.brute_force (k=10)': lambda: index.brute_force(query_sample, 10),
+        'distance_correlation_matrix (centroids)':
+            lambda: similarity.distance_correlation_matrix(ccle_centroids, tumor_centroids),
+        **metric_cases,
+        'dcor loop (centroids)': lambda: similarity.dcor_loop(ccle_centroids, tumor_centroids),
+        'permutation_pvalues (centroids)': lambda: permutation_pvalues(ccle_centroids, tumor_centroids),
+        'cell_mmd_matrix (all cells)': lambda: mmd.cell_mmd_matrix(compact, max_cells=int(compact.counts.max())),
+        'cell_mmd_matrix (200 cells per sample)': lambda: mmd.cell_mmd_matrix(compact, max_cells=200),
+        'bootstrap_replicates (50)': lambda: bootstrap.bootstrap_replicates(compact, 50),
+        'convert_to_long_format': lambda: f.convert_to_long_format(centroid_df),
+        'plot_correlation_heatmap': plotted(lambda: f.plot_correlation_heatmap(centroid_df)),
+        'render_heatmap': lambda: heatmap.render_heatmap(centroid_df),
+        'render_heatmap (clustered)': lambda: heatmap.render_heatmap(centroid_df, cluster=True),
+        'cross_modal_harmony_embeddings_from_df':
+            lambda: f.cross_modal_harmony_embeddings_from_df(emb, bulk, scaler, pca, hv_genes),
+        'compute_distance_correlation_matrix': lambda: f.compute_distance_correlation_matrix(pseudo_h, bulk_h),
+        'iter_top_distance_correlations':
+            lambda: list(f.iter_top_distance_correlations(pseudo_h, bulk_h, k=5)),
+        'convert_cross_modal_to_long': lambda: f.convert_cross_modal_to_long(dc_matrix),
+        'ResultView.from_matrix':
+            lambda: ResultView.from_matrix(centroid_df, 'CCLE', 'Primary Tumor', 'Distance Correlation'),
+        'ResultView.page (filtered, resorted)': lambda: similarity_view.page(
+            page=1, filters={'CCLE': centroid_df.index[0]}, sort='Primary Tumor', descending=False
+        ),
+        'plot_top_combinations':
+            plotted(lambda: f.plot_top_combinations(dc_matrix, 'all', sample_types, top_n=5)),
+        'iter_export (csv.gz)': lambda: sum(map(len, iter_export(similarity_view.frame, 'csv.gz'))),
+        'iter_export (parquet)': lambda: sum(map(len, iter_export(similarity_view.frame, 'parquet'))),
+        'enrich (local gene sets)': lambda: enrichment.enrich(query, 'BENCH', gene_set_root),
+        'create_horizontal_barplot': plotted(lambda: f.create_horizontal_barplot(enrichment_df)),
+    }
+
+
+def run(scale, repeat=3, only=None, seed=0):
+    results = {}
+    for name, fn in build_cases(scale, seed).items():
+        if only and not any(o in name for o in only):
+            continue
+        results[name] = measure(fn, repeat)
+        print(f"{name:<50} {results[name]['seconds']:>9.4f}s {results[name]['peak_mb']:>9.1f} MB")
+    return results
+
+
+def measure_startup(app_dir='.', repeat=3, port=8799, timeout=60.0):
+    """
+    Best over `repeat` fresh interpreters of the seconds to `import app` and
+    the seconds from launching uvicorn to the first successful page load,
+    run from app_dir (where the data files are).
+    """
+    import subprocess
+    import urllib.request
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), env.get('PYTHONPATH')]))
+    code = "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"
+
+    imports, responses = [], []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], cwd=app_dir, env=env, capture_output=True, text=True, check=True)
+        imports.append(float(out.stdout.strip().splitlines()[-1]))
+
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'app:app', '--port', str(port)],
+            cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            while True:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                        if response.status == 200:
+                            break
+                except OSError:
+                    pass
+                if time.perf_counter() - start > timeout or server.poll() is not None:
+                    raise RuntimeError(f"app did not respond within {timeout:.0f}s")
+                time.sleep(0.02)
+            responses.append(time.perf_counter() - start)
+        finally:
+            server.terminate()
+            server.wait()
+    return {'import_seconds': min(imports), 'first_response_seconds': min(responses)}
+
+
+def compare(results, baseline, time_threshold=1.25, memory_threshold=1.25, min_delta=0.005):
+    """
+    Names of benchmarks slower / hungrier than baseline by more than the thresholds.
+    Time differences under min_delta seconds are treated as noise.
+    """
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if (res['seconds'] > base['seconds'] * time_threshold
+                and res['seconds'] - base['seconds'] > min_delta):
+            regressions.append(f"{name}: {res['seconds']:.4f}s vs baseline {base['seconds']:.4f}s")
+        if res['peak_mb'] > base['peak_mb'] * memory_threshold:
+            regressions.append(f"{name}: {res['peak_mb']:.1f} MB vs baseline {base['peak_mb']:.1f} MB")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark functions.py on synthetic data (offline, CPU only).")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    for key in ('cells', 'samples', 'pcs', 'genes', 'bulk'):
+        parser.add_argument(f'--{key}', type=int, help=f"override the number of {key}")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='*', help="run only benchmarks whose name contains one of these")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--time-threshold', type=float, default=1.25)
+    parser.add_argument('--memory-threshold', type=float, default=1.25)
+    parser.add_argument('--min-delta', type=float, default=0.005, help="ignore time differences below this (s)")
+    parser.add_argument('--startup', action='store_true',
+                        help="measure app import time and time to first response against their budgets instead")
+    parser.add_argument('--app-dir', default='.', help="directory to start the app from (--startup)")
+    parser.add_argument('--import-budget', type=float, default=STARTUP_BUDGET['import_seconds'])
+    parser.add_argument('--response-budget', type=float, default=STARTUP_BUDGET['first_response_seconds'])
+    args = parser.parse_args()
+
+    if args.startup:
+        startup = measure_startup(args.app_dir, args.repeat)
+        over = []
+        for name, budget in (('import_seconds', args.import_budget), ('first_response_seconds', args.response_budget)):
+            print(f"{name:<50} {startup[name]:>9.4f}s (budget {budget:.2f}s)")
+            if startup[name] > budget:
+                over.append(f"{name}: {startup[name]:.2f}s over budget {budget:.2f}s")
+        for line in over:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if over else 0)
+
+    scale = dict(SCALES[args.scale])
+    for key in scale:
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+
+    results = run(scale, args.repeat, args.only, args.seed)
+    scale_key = json.dumps(scale, sort_keys=True)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baselines = json.load(fh)
+
+    if args.save_baseline:
+        baselines[scale_key] = {'machine': platform.platform(), 'python': platform.python_version(), 'results': results}
+        with open(args.baseline, 'w') as fh:
+            json.dump(baselines, fh, indent=1, sort_keys=True)
+        print(f"baseline saved to {args.baseline}")
+    elif scale_key in baselines:
+        regressions = compare(
+            results, baselines[scale_key]['results'],
+            args.time_threshold, args.memory_threshold, args.min_delta
+        )
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
+    else:
+        print(f"no baseline for this scale in {args.baseline}; run with --save-baseline to create one")
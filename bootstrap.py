@@ -0,0 +1,168 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from significance import _half_vectors
+
+
+N_REPLICATES = int(os.environ.get('CACAIO_BOOTSTRAP_REPLICATES', 200))
+# worker processes for the replicates; by default as many as the task pool's workers
+N_JOBS = int(os.environ.get(
+    'CACAIO_BOOTSTRAP_JOBS', os.environ.get('CACAIO_MAX_WORKERS', min(4, os.cpu_count() or 1))
+))
+TOP_K = 5
+BATCH_SIZE = 16
+
+
+def _bootstrap_centroids(pcs, offsets, seeds):
+    """
+    Centroids of every sample for each replicate seed: cells are resampled
+    with replacement within their sample, i.e. each cell gets a multinomial
+    weight, and all samples' weighted sums come from one small product
+    per sample shared by the replicates of the batch.
+
+    Returns:
+        array (len(seeds), n_samples, n_pcs)
+    """
+    counts = np.diff(offsets)
+    sample_of = np.repeat(np.arange(len(counts)), counts)
+    weights = np.empty((len(seeds), len(pcs)), dtype=np.float32)
+    for r, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+        picks = offsets[sample_of] + (rng.random(len(pcs)) * counts[sample_of]).astype(np.int64)
+        weights[r] = np.bincount(picks, minlength=len(pcs))
+
+    out = np.empty((len(seeds), len(counts), pcs.shape[1]))
+    for i in range(len(counts)):
+        out[:, i] = weights[:, offsets[i]:offsets[i + 1]] @ pcs[offsets[i]:offsets[i + 1]]
+    return out / counts[None, :, None]
+
+
+def _batched_distance_correlation(X, Y):
+    """
+    Distance correlation matrices of a batch: X (b, n_x, p), Y (b, n_y, p)
+    -> (b, n_x, n_y), each replicate against itself only.
+    """
+    b, n_x, p = X.shape
+    A = _half_vectors(X.reshape(-1, p)).reshape(b, n_x, -1)
+    B = _half_vectors(Y.reshape(-1, p)).reshape(b, Y.shape[1], -1)
+    dcov = np.matmul(A, B.transpose(0, 2, 1))
+    denom = np.sqrt(np.einsum('bij,bij->bi', A, A)[:, :, None] * np.einsum('bij,bij->bi', B, B)[:, None, :])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dcor_sqr = np.where(denom > 0, dcov / denom, 0.0)
+    return np.sqrt(np.clip(dcor_sqr, 0.0, None))
+
+
+def replicate_matrices(pcs, offsets, is_cell_line, seeds, batch_size=BATCH_SIZE):
+    """
+    CCLE × tumor distance correlation matrix of each replicate seed, as
+    float32 (len(seeds), n_ccle, n_tumor). Module-level so process workers
+    can run a share of the seeds.
+    """
+    out = np.empty((len(seeds), int(is_cell_line.sum()), int((~is_cell_line).sum())), dtype=np.float32)
+    for start in range(0, len(seeds), batch_size):
+        centroids = _bootstrap_centroids(pcs, offsets, seeds[start:start + batch_size])
+        out[start:start + batch_size] = _batched_distance_correlation(
+            centroids[:, is_cell_line], centroids[:, ~is_cell_line]
+        )
+    return out
+
+
+def bootstrap_replicates(emb, n_replicates=N_REPLICATES, seed=0, n_jobs=N_JOBS, batch_size=BATCH_SIZE):
+    """
+    Bootstrap replicates of the CCLE × tumor distance correlation matrix of
+    an embedding.Embedding.
+
+    Replicate r uses its own child of SeedSequence(seed), so the resampling
+    does not depend on n_jobs or batch_size (values agree up to float32
+    rounding). With n_jobs > 1 the replicates are split across worker
+    processes.
+
+    Returns:
+        float32 array (n_replicates, n_ccle, n_tumor).
+    """
+    seeds = np.random.SeedSequence(seed).spawn(n_replicates)
+    args = (emb.pcs, emb.offsets, emb.is_cell_line)
+    if n_jobs <= 1:
+        return replicate_matrices(*args, seeds, batch_size)
+
+    shares = [list(s) for s in np.array_split(np.array(seeds, dtype=object), n_jobs) if len(s)]
+    # forking a process that already loaded threaded libraries (numba, dcor)
+    # can leave it hanging at exit, so start the workers from a clean server
+    context = multiprocessing.get_context('forkserver')
+    with ProcessPoolExecutor(max_workers=len(shares), mp_context=context) as executor:
+        parts = list(executor.map(replicate_matrices, *zip(*[(*args, s, batch_size) for s in shares])))
+    return np.concatenate(parts)
+
+
+def stat_names(top_k=TOP_K):
+    return ['CI_Low', 'CI_High', 'Mean_Rank', 'P_Rank_1', f'P_Top_{top_k}']
+
+
+def summarize(replicates, index, columns, alpha=0.05, top_k=TOP_K):
+    """
+    Per-pair bootstrap statistics as CCLE × tumor matrices.
+
+    Cell lines are ranked within each tumor (rank 1 = highest distance
+    correlation) in every replicate.
+
+    Returns:
+        {name: DataFrame} for the stat_names(top_k): CI_Low, CI_High
+        (percentile interval at alpha / 2, 1 - alpha / 2), Mean_Rank,
+        P_Rank_1 and P_Top_{top_k}.
+    """
+    low, high = np.quantile(replicates, [alpha / 2, 1 - alpha / 2], axis=0)
+    order = np.argsort(-replicates, axis=1, kind='stable')
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(1, replicates.shape[1] + 1)[None, :, None], axis=1)
+
+    stats = [low, high, ranks.mean(axis=0), (ranks == 1).mean(axis=0), (ranks <= top_k).mean(axis=0)]
+    return {
+        name: pd.DataFrame(values, index=index, columns=columns)
+        for name, values in zip(stat_names(top_k), stats)
+    }
+
+
+def bootstrap_summary(emb, n_replicates=N_REPLICATES, seed=0, n_jobs=N_JOBS, alpha=0.05, top_k=TOP_K,
+                      progress=None):
+    """
+    bootstrap_replicates followed by summarize, labelled like the matrix of
+    compare_centroids_distance_correlation_from_df.
+    """
+    from instrumentation import stage
+
+    with stage(progress, 'bootstrap'):
+        replicates = bootstrap_replicates(emb, n_replicates, seed, n_jobs)
+        return summarize(
+            replicates, emb.samples[emb.is_cell_line], emb.samples[~emb.is_cell_line], alpha, top_k
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bootstrap CIs and rank probabilities of a dataset's CCLE × tumor ranking.")
+    parser.add_argument('dataset', nargs='?', help="dataset name (default: the first one)")
+    parser.add_argument('--key', default='df_pca_harmony')
+    parser.add_argument('--replicates', type=int, default=N_REPLICATES)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--top', type=int, default=10, help="rows to print")
+    args = parser.parse_args()
+
+    from data import sc_samples
+    from embedding import Embedding
+    from functions import convert_to_long_format, compare_centroids_distance_correlation_from_df
+
+    name = args.dataset or next(iter(sc_samples))
+    emb = Embedding.from_frame(sc_samples[name][args.key])
+    matrix, _ = compare_centroids_distance_correlation_from_df(emb)
+
+    start = time.perf_counter()
+    stats = bootstrap_summary(emb, args.replicates, args.seed, args.jobs)
+    print(f"{name}: {args.replicates} replicates of {matrix.shape[0]} × {matrix.shape[1]} pairs "
+          f"in {time.perf_counter() - start:.2f}s")
+    print(convert_to_long_format(matrix, extra=stats).head(args.top).to_string(index=False, float_format='%.3f'))
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+from constants import BULK_EXTENSIONS
+
+
+def bulk_format(name):
+    """
+    'parquet', 'tsv' or 'csv' from a file name (gzip is handled by pandas).
+    """
+    name = name.lower()
+    if name.endswith(('.parquet', '.pq')):
+        return 'parquet'
+    if name.endswith(('.tsv', '.tsv.gz', '.txt', '.txt.gz')):
+        return 'tsv'
+    return 'csv'
+
+
+def _compression(name):
+    return 'gzip' if name.lower().endswith('.gz') else None
+
+
+def iter_bulk_chunks(path, hvg_genes, name=None, chunksize=256):
+    """
+    Read a samples × genes bulk matrix in row chunks, keeping only HVG columns.
+
+    Only the HVG columns present in the file are parsed (as float32); the
+    first column is the sample index. Each chunk is reindexed to hvg_genes
+    with missing genes set to 0, the same as bulk_df.reindex(columns=hvg_genes,
+    fill_value=0) on the full matrix.
+
+    Args:
+        path: file to read (csv, tsv, optionally gzipped, or parquet).
+        hvg_genes: genes expected by the scaler/PCA, in order.
+        name: original file name, used to detect the format (uploads are
+            stored under temporary names); defaults to path.
+        chunksize: number of samples per chunk.
+
+    Yields:
+        DataFrame chunks (samples × hvg_genes, float32).
+    """
+    name = name or str(path)
+    fmt = bulk_format(name)
+
+    if fmt == 'parquet':
+        yield from _iter_parquet(path, hvg_genes, chunksize)
+        return
+
+    sep = '\t' if fmt == 'tsv' else ','
+    compression = _compression(name)
+    header = pd.read_csv(path, sep=sep, nrows=0, compression=compression).columns
+    wanted = set(hvg_genes)
+    positions = [0] + [i for i, col in enumerate(header) if i > 0 and col in wanted]
+
+    reader = pd.read_csv(
+        path,
+        sep=sep,
+        compression=compression,
+        usecols=positions,
+        index_col=0,
+        dtype={header[i]: np.float32 for i in positions[1:]},
+        chunksize=chunksize
+    )
+    for chunk in reader:
+        yield chunk.reindex(columns=hvg_genes, fill_value=0).astype(np.float32, copy=False)
+
+
+def _iter_parquet(path, hvg_genes, chunksize):
+    import pyarrow.parquet as pq
+
+    pf = pq.ParquetFile(path)
+    names = pf.schema_arrow.names
+    metadata = pf.schema_arrow.pandas_metadata or {}
+    index_cols = [c for c in metadata.get('index_columns', []) if isinstance(c, str)]
+    index_col = index_cols[0] if index_cols else names[0]
+
+    wanted = set(hvg_genes)
+    columns = [index_col] + [c for c in names if c != index_col and c in wanted]
+
+    for batch in pf.iter_batches(batch_size=chunksize, columns=columns):
+        chunk = batch.to_pandas(ignore_metadata=True).set_index(index_col)
+        chunk.index.name = None
+        yield chunk.reindex(columns=hvg_genes, fill_value=0).astype(np.float32, copy=False)
+
+
+def project_bulk_file(path, scaler, pca, hvg_genes, name=None, n_pcs=50, chunksize=256):
+    """
+    Stream a bulk file through scaler and PCA chunk by chunk.
+
+    Only one chunk of the expression matrix is in memory at a time; the result
+    is the small samples × PCs projection.
+
+    Returns:
+        DataFrame (samples × PC1..PCn).
+    """
+    pc_cols = [f"PC{i+1}" for i in range(n_pcs)]
+    parts, index = [], []
+    for chunk in iter_bulk_chunks(path, hvg_genes, name=name, chunksize=chunksize):
+        parts.append(pca.transform(scaler.transform(chunk.to_numpy(dtype=np.float64)))[:, :n_pcs])
+        index.extend(chunk.index)
+    values = np.vstack(parts) if parts else np.zeros((0, n_pcs))
+    return pd.DataFrame(values, index=pd.Index(index), columns=pc_cols)
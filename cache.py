@@ -0,0 +1,461 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# the file the datasets are loaded from (pickle or store manifest), so the
+# cache is invalidated by the same file the app reads
+from data import SOURCE_PATH
+
+
+CACHE_DIR = os.environ.get('CACAIO_CACHE_DIR', 'cache')
+
+# disk budget of each ResultCache (enrichment results, heatmaps)
+RESULT_CACHE_BYTES = int(os.environ.get('CACAIO_RESULT_CACHE_BYTES', 512 << 20))
+
+# Bump when the similarity computation changes so old entries are not reused.
+SIMILARITY_VERSION = 2
+
+
+def source_signature(path):
+    """
+    Cheap signature (size + mtime) of the file the embeddings were loaded from.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return {'path': os.path.abspath(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def embedding_fingerprint(df, sample_col='sample', dataset_col='dataset'):
+    """
+    Content hash of a cell-level embedding: PC values plus sample/dataset labels.
+    """
+    if hasattr(df, 'fingerprint'):
+        return df.fingerprint()
+    pc_cols = [c for c in df.columns if c.startswith('PC')]
+    h = hashlib.sha256()
+    h.update(json.dumps(pc_cols).encode())
+    h.update(np.ascontiguousarray(df[pc_cols].to_numpy(dtype=np.float64)).tobytes())
+    for col in (sample_col, dataset_col):
+        h.update(pd.util.hash_array(df[col].astype(str).to_numpy()).tobytes())
+    return h.hexdigest()
+
+
+def _write_json(path, payload):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as fh:
+        json.dump(payload, fh, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+class SimilarityCache:
+    """
+    On-disk cache of CCLE × tumor similarity matrices.
+
+    Each entry is an .npz file (values, row and column labels) listed in
+    manifest.json. Keys hash the embedding content and the parameters used.
+    The manifest also records the signature of the source pickle: when
+    sc_samples.pkl changes, every entry is dropped on the next open.
+
+    For centroid metrics the latest matrix of each dataset is also kept as a
+    "base" (bases/, not dropped with the entries) together with the centroid
+    sums and counts it was computed from. When a dataset changes, only the
+    rows and columns of samples whose cells changed are recomputed from it
+    (functions.update_centroid_similarity).
+    """
+
+    def __init__(self, root=None, source=SOURCE_PATH):
+        self.root = os.path.join(root or CACHE_DIR, 'similarity')
+        self.manifest_path = os.path.join(self.root, 'manifest.json')
+        self.bases_root = os.path.join(self.root, 'bases')
+        self.source = source_signature(source)
+        self._fingerprints = {}
+        os.makedirs(self.bases_root, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        manifest = None
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as fh:
+                manifest = json.load(fh)
+        if manifest is None or manifest.get('source') != self.source:
+            if manifest is not None:
+                for entry in manifest.get('entries', {}).values():
+                    path = os.path.join(self.root, entry['file'])
+                    if os.path.exists(path):
+                        os.remove(path)
+            manifest = {'source': self.source, 'entries': {}}
+            _write_json(self.manifest_path, manifest)
+        return manifest
+
+    def fingerprint(self, name, df, sample_col='sample', dataset_col='dataset'):
+        """
+        Embedding fingerprint, memoized per dataset so the same frame is
+        hashed only once. The memo holds a weak reference to the frame it
+        hashed: any other frame (even one reusing a collected frame's id())
+        is hashed again.
+        """
+        memo_key = (name, sample_col, dataset_col)
+        memo = self._fingerprints.get(memo_key)
+        if memo is None or memo[0]() is not df:
+            memo = (weakref.ref(df), embedding_fingerprint(df, sample_col, dataset_col))
+            self._fingerprints[memo_key] = memo
+        return memo[1]
+
+    @staticmethod
+    def key(fingerprint, params):
+        payload = json.dumps(
+            {'fingerprint': fingerprint, 'params': params, 'version': SIMILARITY_VERSION},
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        path = os.path.join(self.root, f"{key}.npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as npz:
+            return pd.DataFrame(npz['values'], index=npz['index'], columns=npz['columns'])
+
+    def put(self, key, matrix, name=None):
+        fname = f"{key}.npz"
+        tmp = os.path.join(self.root, f"{key}.{os.getpid()}.tmp.npz")
+        np.savez(
+            tmp,
+            values=matrix.to_numpy(dtype=np.float64),
+            index=np.asarray(matrix.index.astype(str), dtype=str),
+            columns=np.asarray(matrix.columns.astype(str), dtype=str)
+        )
+        os.replace(tmp, os.path.join(self.root, fname))
+        # Merge with what other processes may have written since we opened it.
+        with open(self.manifest_path) as fh:
+            on_disk = json.load(fh)
+        if on_disk.get('source') == self.source:
+            self.manifest['entries'].update(on_disk.get('entries', {}))
+        self.manifest['entries'][key] = {'dataset': name, 'file': fname, 'shape': list(matrix.shape)}
+        _write_json(self.manifest_path, self.manifest)
+
+    def _base_path(self, name, params):
+        return os.path.join(self.bases_root, f"{self.key({'dataset': name}, params)}.npz")
+
+    def get_base(self, name, params):
+        """
+        (matrix, CentroidStore) of the last centroid matrix computed for this
+        dataset and parameters, or None.
+        """
+        from centroids import CentroidStore
+
+        path = self._base_path(name, params)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as npz:
+            matrix = pd.DataFrame(npz['values'], index=npz['index'], columns=npz['columns'])
+            store = CentroidStore(npz['pc_cols'].tolist(), params['sample_col'], params['dataset_col'])
+            store.samples = npz['samples'].tolist()
+            store._row = {s: i for i, s in enumerate(store.samples)}
+            store.sums = npz['sums']
+            store.counts = npz['counts']
+            store.datasets = dict(zip(store.samples, npz['datasets'].tolist()))
+        return matrix, store
+
+    def put_base(self, name, params, matrix, store):
+        path = self._base_path(name, params)
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp,
+            values=matrix.to_numpy(dtype=np.float64),
+            index=np.asarray(matrix.index.astype(str), dtype=str),
+            columns=np.asarray(matrix.columns.astype(str), dtype=str),
+            pc_cols=np.asarray(store.pc_cols, dtype=str),
+            samples=np.asarray([str(s) for s in store.samples], dtype=str),
+            sums=store.sums,
+            counts=store.counts,
+            datasets=np.asarray([str(store.datasets[s]) for s in store.samples], dtype=str)
+        )
+        os.replace(tmp, path)
+
+    def _centroid_similarity(self, name, store, params, progress=None):
+        """
+        Centroid matrix for `store`, updated from the dataset's base when
+        there is one: samples whose sums, counts or dataset label differ
+        (or that are new) are recomputed, removed samples are dropped.
+        """
+        from functions import compare_centroids_distance_correlation_from_store, update_centroid_similarity
+
+        metric = params['metric']
+        base = self.get_base(name, params)
+        if base is not None and base[1].pc_cols == [str(c) for c in store.pc_cols]:
+            matrix, old = base
+            changed = [
+                s for s in store.samples
+                if str(s) not in old._row or old.datasets[str(s)] != str(store.datasets[s])
+                or old.counts[old._row[str(s)]] != store.counts[store._row[s]]
+                or not np.array_equal(old.sums[old._row[str(s)]], store.sums[store._row[s]])
+            ]
+            matrix, _ = update_centroid_similarity(matrix, store, changed, progress=progress, metric=metric)
+        else:
+            matrix, _ = compare_centroids_distance_correlation_from_store(store, progress=progress, metric=metric)
+        self.put_base(name, params, matrix, store)
+        return matrix
+
+    def similarity(self, name, df, sample_col='sample', dataset_col='dataset', metric='distance_correlation',
+                   progress=None):
+        """
+        CCLE × tumor matrix for one dataset, from cache if present: a
+        similarity.METRICS metric between centroids (distance correlation by
+        default), or with metric='mmd' the cell-level MMD of mmd.py.
+        """
+        from instrumentation import stage
+
+        params = {'sample_col': sample_col, 'dataset_col': dataset_col, 'metric': metric}
+        if metric != 'mmd':
+            from similarity import DTYPE
+            if DTYPE != np.float64:
+                params['dtype'] = DTYPE.name
+        if metric == 'mmd':
+            from mmd import N_FEATURES, TIME_BUDGET
+            params.update(n_features=N_FEATURES, budget=TIME_BUDGET)
+        with stage(progress, 'cache_lookup'):
+            key = self.key(self.fingerprint(name, df, sample_col, dataset_col), params)
+            matrix = self.get(key)
+        if matrix is None and metric == 'mmd':
+            from embedding import Embedding
+            from mmd import cell_mmd_matrix
+
+            if not isinstance(df, Embedding):
+                df = Embedding.from_frame(df, sample_col, dataset_col)
+            matrix, _ = cell_mmd_matrix(df, progress=progress)
+            self.put(key, matrix, name)
+        elif matrix is None:
+            from centroids import CentroidStore
+            from embedding import Embedding
+
+            with stage(progress, 'centroids'):
+                if isinstance(df, Embedding):
+                    store = CentroidStore.from_embedding(df)
+                else:
+                    store = CentroidStore.from_frame(df, sample_col, dataset_col)
+            matrix = self._centroid_similarity(name, store, params, progress=progress)
+            self.put(key, matrix, name)
+        else:
+            matrix.index.name = matrix.columns.name = sample_col
+        return matrix
+
+
+    def significance(self, name, df, matrix, sample_col='sample', dataset_col='dataset', progress=None):
+        """
+        Permutation p-value and FDR matrices for a similarity() matrix of the
+        same dataset, from cache if present.
+        """
+        from instrumentation import stage
+        from significance import MAX_PERMUTATIONS, STOP_AFTER, fdr_matrix, significance_matrices
+
+        params = {
+            'sample_col': sample_col, 'dataset_col': dataset_col, 'metric': 'distance_correlation_pvalue',
+            'max_permutations': MAX_PERMUTATIONS, 'stop_after': STOP_AFTER
+        }
+        with stage(progress, 'cache_lookup'):
+            key = self.key(self.fingerprint(name, df, sample_col, dataset_col), params)
+            pvalues = self.get(key)
+        if pvalues is not None:
+            pvalues.index.name = pvalues.columns.name = sample_col
+            return pvalues, fdr_matrix(pvalues)
+
+        from centroids import CentroidStore
+        from embedding import Embedding
+
+        with stage(progress, 'centroids'):
+            if isinstance(df, Embedding):
+                store = CentroidStore.from_embedding(df)
+            else:
+                store = CentroidStore.from_frame(df, sample_col, dataset_col)
+        pvalues, fdr = significance_matrices(
+            matrix, store.centroids(matrix.index).values, store.centroids(matrix.columns).values, progress=progress
+        )
+        self.put(key, pvalues, name)
+        return pvalues, fdr
+
+
+    def bootstrap(self, name, df, sample_col='sample', dataset_col='dataset', progress=None):
+        """
+        Bootstrap CI and rank probability matrices (bootstrap.bootstrap_summary)
+        for one dataset, from cache if present.
+        """
+        from instrumentation import stage
+        from bootstrap import N_REPLICATES, TOP_K, bootstrap_summary, stat_names
+
+        params = {
+            'sample_col': sample_col, 'dataset_col': dataset_col, 'metric': 'distance_correlation_bootstrap',
+            'replicates': N_REPLICATES, 'top_k': TOP_K
+        }
+        with stage(progress, 'cache_lookup'):
+            fingerprint = self.fingerprint(name, df, sample_col, dataset_col)
+            stats = {s: self.get(self.key(fingerprint, {**params, 'stat': s})) for s in stat_names(TOP_K)}
+        if all(m is not None for m in stats.values()):
+            for m in stats.values():
+                m.index.name = m.columns.name = sample_col
+            return stats
+
+        from embedding import Embedding
+
+        if not isinstance(df, Embedding):
+            df = Embedding.from_frame(df, sample_col, dataset_col)
+        stats = bootstrap_summary(df, progress=progress)
+        for s, matrix in stats.items():
+            self.put(self.key(fingerprint, {**params, 'stat': s}), matrix, name)
+        return stats
+
+
+def enrichment_key(gene_list, libraries, engine='enrichr', sources=(), organism='human'):
+    """
+    Cache key of an enrichment request: sorted unique genes + sorted libraries,
+    the engine that runs it ('local' or 'enrichr') and the signature of each
+    local library file in sources, so a rebuilt library is not served old results.
+    """
+    if isinstance(libraries, str):
+        libraries = [libraries]
+    payload = json.dumps({
+        'genes': sorted({str(g) for g in gene_list}), 'libraries': sorted(libraries), 'engine': engine,
+        'sources': sorted((source_signature(path) for path in sources), key=lambda s: json.dumps(s, sort_keys=True)),
+        'organism': organism
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache for deterministic results: a size-bounded in-process LRU
+    backed by pickles on disk. The disk tier is kept under max_bytes by
+    deleting the least recently used files. Thread-safe; hit/miss counters
+    in stats().
+    """
+
+    def __init__(self, name, max_items=128, root=None, max_bytes=RESULT_CACHE_BYTES):
+        self.root = os.path.join(root or CACHE_DIR, name)
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.pkl")
+
+    def _remember(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.memory_hits += 1
+                return self._items[key]
+        path = self._path(key)
+        if os.path.exists(path):
+            value = pd.read_pickle(path)
+            try:
+                # mtime is the disk tier's recency
+                os.utime(path)
+            except OSError:
+                pass
+            with self._lock:
+                self.disk_hits += 1
+                self._remember(key, value)
+            return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = f"{self._path(key)}.{os.getpid()}.tmp"
+        pd.to_pickle(value, tmp)
+        os.replace(tmp, self._path(key))
+        with self._lock:
+            self._remember(key, value)
+        if self.max_bytes is not None:
+            self._evict()
+
+    def _evict(self):
+        """
+        Delete the least recently used files until the disk tier fits in max_bytes.
+        """
+        files = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.pkl'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime_ns, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._items),
+                'max_items': self.max_items
+            }
+
+
+def warm(source=SOURCE_PATH, root=None, datasets=None):
+    """
+    Fill the similarity cache for every dataset in the source pickle or store
+    (its directory or manifest).
+    """
+    from store import MANIFEST, open_store
+
+    if os.path.basename(source) == MANIFEST:
+        source = os.path.dirname(source)
+    if os.path.isdir(source):
+        sc_samples = open_store(source)
+        source = os.path.join(source, MANIFEST)
+    else:
+        import joblib
+        sc_samples = joblib.load(source)
+    from embedding import Embedding
+
+    cache = SimilarityCache(root, source)
+    for name in datasets or list(sc_samples.keys()):
+        # same representation as tasks.similarity_job, so the keys match
+        cache.similarity(name, Embedding.from_frame(sc_samples[name]['df_pca_harmony']))
+        print(f"cached {name}")
+    return cache
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute CCLE × tumor similarity matrices.")
+    parser.add_argument('--source', default=SOURCE_PATH,
+                        help="path to sc_samples.pkl or a converted store directory (default: the one data.py loads)")
+    parser.add_argument('--cache-dir', default=None, help="cache root (default: $CACAIO_CACHE_DIR or ./cache)")
+    parser.add_argument('datasets', nargs='*', help="datasets to warm (default: all)")
+    args = parser.parse_args()
+    warm(args.source, args.cache_dir, args.datasets)
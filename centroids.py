@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+
+class CentroidStore:
+    """
+    Per-sample sufficient statistics (PC sums and cell counts) of a cell-level
+    embedding, so centroids are available without regrouping every cell.
+
+    append() folds new cells into the sums and reports which samples changed,
+    which is all the similarity matrix needs to be updated incrementally.
+    """
+
+    def __init__(self, pc_cols, sample_col='sample', dataset_col='dataset'):
+        self.pc_cols = list(pc_cols)
+        self.sample_col = sample_col
+        self.dataset_col = dataset_col
+        self.samples = []
+        self._row = {}
+        self.sums = np.zeros((0, len(self.pc_cols)))
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.datasets = {}
+
+    @classmethod
+    def from_frame(cls, df, sample_col='sample', dataset_col='dataset', pc_cols=None):
+        if pc_cols is None:
+            pc_cols = [c for c in df.columns if c.startswith('PC')]
+        store = cls(pc_cols, sample_col, dataset_col)
+        store.append(df)
+        return store
+
+    @classmethod
+    def from_embedding(cls, emb):
+        """
+        Store of an embedding.Embedding, from its contiguous sample groups.
+        """
+        store = cls(emb.pc_cols, emb.sample_col, emb.dataset_col)
+        store.samples = list(emb.samples)
+        store._row = {s: i for i, s in enumerate(store.samples)}
+        store.sums = emb.sums()
+        store.counts = emb.counts.astype(np.int64)
+        store.datasets = dict(zip(store.samples, emb.datasets))
+        return store
+
+    def append(self, df):
+        """
+        Add cells (rows of df) to the store.
+
+        Returns:
+            list of the samples whose centroid changed (new samples included).
+        """
+        grouped = df.groupby(self.sample_col, observed=True)
+        sums = grouped[self.pc_cols].sum()
+        counts = grouped.size()
+        first_ds = grouped[self.dataset_col].first()
+
+        new = [s for s in sums.index if s not in self._row]
+        if new:
+            for s in new:
+                self._row[s] = len(self.samples)
+                self.samples.append(s)
+            self.sums = np.vstack([self.sums, np.zeros((len(new), len(self.pc_cols)))])
+            self.counts = np.concatenate([self.counts, np.zeros(len(new), dtype=np.int64)])
+
+        rows = np.array([self._row[s] for s in sums.index], dtype=np.int64)
+        self.sums[rows] += sums.to_numpy(dtype=np.float64)
+        self.counts[rows] += counts.reindex(sums.index).to_numpy()
+        for s in new:
+            self.datasets[s] = first_ds[s]
+        return list(sums.index)
+
+    def centroids(self, samples=None):
+        """
+        Centroids (mean PC vectors) as a samples × PCs DataFrame.
+        """
+        if samples is None:
+            rows = np.arange(len(self.samples))
+            index = self.samples
+        else:
+            rows = np.array([self._row[s] for s in samples], dtype=np.int64)
+            index = list(samples)
+        values = self.sums[rows] / self.counts[rows, None]
+        return pd.DataFrame(values, index=pd.Index(index, name=self.sample_col), columns=self.pc_cols)
+
+    def sample_to_dataset(self):
+        return pd.Series(self.datasets, name=self.dataset_col)[self.samples]
+
+    def split(self, samples=None):
+        """
+        (CCLE samples, tumor samples) among `samples` (default: all), in store order.
+        """
+        samples = self.samples if samples is None else samples
+        ccle = [s for s in samples if self.datasets[s] == 'CCLE']
+        tumor = [s for s in samples if self.datasets[s] != 'CCLE']
+        return ccle, tumor
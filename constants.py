@@ -0,0 +1,14 @@
+# Values shared by ui.py and the modules that implement them. This module
+# imports nothing, so building the page does not load pandas or scipy.
+
+BULK_EXTENSIONS = [".csv", ".csv.gz", ".tsv", ".tsv.gz", ".txt", ".txt.gz", ".parquet"]
+
+RESULT_COLUMNS = ['Term', 'Overlap', 'P-value', 'Combined Score', 'Adjusted P-value']
+
+PAGE_SIZES = [25, 50, 100, 500]
+
+EXPORT_FORMATS = {
+    'csv': ("CSV", '.csv', 'text/csv'),
+    'csv.gz': ("CSV (gzip)", '.csv.gz', 'application/gzip'),
+    'parquet': ("Parquet", '.parquet', 'application/vnd.apache.parquet'),
+}
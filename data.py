@@ -1,8 +1,93 @@
-import joblib
-import gseapy as gp
+import os
+import threading
 
-sc_samples = joblib.load('sc_samples.pkl')
+from store import MANIFEST
 
-degs = joblib.load('degs.pkl')
+STORE_PATH = os.environ.get('CACAIO_SC_STORE', 'sc_store')
 
-libraries = gp.get_library_name(organism="Human")
+if os.path.exists(os.path.join(STORE_PATH, MANIFEST)):
+    SOURCE_PATH = os.path.join(STORE_PATH, MANIFEST)
+else:
+    SOURCE_PATH = 'sc_samples.pkl'
+
+DEGS_PATH = 'degs.pkl'
+
+
+# sc_samples, degs and libraries are loaded on first access (module
+# __getattr__), so `from data import sc_samples` still works but importing
+# this module is cheap. load_in_background() starts loading right away
+# without blocking the caller.
+
+def _load_samples():
+    if SOURCE_PATH != 'sc_samples.pkl':
+        from store import open_store
+
+        return open_store(STORE_PATH)
+    import joblib
+
+    return joblib.load(SOURCE_PATH)
+
+
+def _load_degs():
+    import joblib
+
+    return joblib.load(DEGS_PATH)
+
+
+def _load_libraries():
+    from enrichment import list_libraries
+
+    libraries = list_libraries()
+    if not libraries:
+        import gseapy as gp
+
+        libraries = gp.get_library_name(organism="Human")
+    return libraries
+
+
+_LOADERS = {'sc_samples': _load_samples, 'degs': _load_degs, 'libraries': _load_libraries}
+_loaded = {}
+_locks = {}
+
+
+def _reset_locks():
+    _locks.update({name: threading.Lock() for name in _LOADERS})
+
+
+_reset_locks()
+# a pool worker forked during a background load must not inherit held locks
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks)
+
+
+def load(name=None):
+    """
+    Load one of sc_samples / degs / libraries (or all of them, as a dict)
+    if not loaded yet. Thread-safe: concurrent callers wait for a single load.
+    """
+    if name is None:
+        return {n: load(n) for n in _LOADERS}
+    if name not in _loaded:
+        with _locks[name]:
+            if name not in _loaded:
+                _loaded[name] = _LOADERS[name]()
+    return _loaded[name]
+
+
+def loaded():
+    return len(_loaded) == len(_LOADERS)
+
+
+def load_in_background():
+    """
+    Start loading everything in a daemon thread; returns the thread.
+    """
+    thread = threading.Thread(target=load, name='cacaio-data', daemon=True)
+    thread.start()
+    return thread
+
+
+def __getattr__(name):
+    if name in _LOADERS:
+        return load(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
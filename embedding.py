@@ -0,0 +1,117 @@
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+
+class Embedding:
+    """
+    Cell-level embedding held as plain arrays instead of a DataFrame.
+
+    PCs are one C-contiguous float32 matrix with the cells of each sample
+    stored together; sample i owns rows offsets[i]:offsets[i + 1]. Samples
+    are integer codes into `samples`, and each sample's dataset and type
+    (cell_line / primary_tumor) are looked up once at construction, so
+    per-request code never regroups or copies the cells.
+    """
+
+    def __init__(self, pcs, pc_cols, samples, offsets, datasets, sample_col='sample', dataset_col='dataset'):
+        self.pcs = pcs
+        self.pc_cols = list(pc_cols)
+        self.samples = pd.Index(samples, name=sample_col)
+        self.offsets = offsets
+        self.datasets = np.asarray(datasets, dtype=object)
+        self.sample_col = sample_col
+        self.dataset_col = dataset_col
+        self.is_cell_line = self.datasets == 'CCLE'
+
+    @classmethod
+    def from_frame(cls, df, sample_col='sample', dataset_col='dataset', pc_cols=None, dtype=np.float32):
+        if pc_cols is None:
+            pc_cols = [c for c in df.columns if c.startswith('PC')]
+        samples = df[sample_col]
+        if isinstance(samples.dtype, pd.CategoricalDtype):
+            codes = samples.cat.codes.to_numpy()
+            names = samples.cat.categories
+        else:
+            codes, names = pd.factorize(samples, sort=True)
+
+        # drop categories without cells, keeping category order
+        present = np.bincount(codes, minlength=len(names)) > 0
+        remap = np.cumsum(present) - 1
+        codes = remap[codes]
+        names = pd.Index(names)[present]
+
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes, minlength=len(names))
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        pcs = np.ascontiguousarray(df[pc_cols].to_numpy(dtype=dtype)[order])
+
+        first = order[offsets[:-1]]
+        datasets = df[dataset_col].to_numpy()[first]
+        return cls(pcs, pc_cols, names, offsets, datasets, sample_col, dataset_col)
+
+    def __len__(self):
+        return self.pcs.shape[0]
+
+    @property
+    def n_samples(self):
+        return len(self.samples)
+
+    @property
+    def counts(self):
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return self.pcs.nbytes + self.offsets.nbytes
+
+    def cells(self, sample):
+        i = self.samples.get_loc(sample)
+        return self.pcs[self.offsets[i]:self.offsets[i + 1]]
+
+    def sums(self):
+        """
+        Per-sample PC sums (samples × PCs), accumulated in float64.
+        """
+        # a slice per sample is contiguous; this beats np.add.reduceat on axis 0
+        out = np.empty((self.n_samples, self.pcs.shape[1]))
+        for i in range(self.n_samples):
+            self.pcs[self.offsets[i]:self.offsets[i + 1]].sum(axis=0, dtype=np.float64, out=out[i])
+        return out
+
+    def centroids(self):
+        return pd.DataFrame(self.sums() / self.counts[:, None], index=self.samples, columns=self.pc_cols)
+
+    def sample_to_dataset(self):
+        return pd.Series(self.datasets, index=self.samples, name=self.dataset_col)
+
+    def sample_types(self):
+        return pd.Series(
+            np.where(self.is_cell_line, 'cell_line', 'primary_tumor'), index=self.samples, name='sample_type'
+        )
+
+    def fingerprint(self):
+        """
+        Content hash of PCs, cell-to-sample assignment and dataset labels.
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps(self.pc_cols).encode())
+        h.update(str(self.pcs.dtype).encode())
+        h.update(self.pcs.tobytes())
+        h.update(self.offsets.astype(np.int64).tobytes())
+        for labels in (self.samples, self.datasets):
+            h.update(pd.util.hash_array(np.asarray(labels, dtype=str).astype(object)).tobytes())
+        return h.hexdigest()
+
+    def to_frame(self):
+        """
+        Cell-level DataFrame (cells grouped by sample), for code that needs one.
+        """
+        df = pd.DataFrame(self.pcs, columns=self.pc_cols)
+        codes = np.repeat(np.arange(self.n_samples), self.counts)
+        df[self.sample_col] = pd.Categorical.from_codes(codes, self.samples)
+        df[self.dataset_col] = pd.Categorical(self.datasets[codes])
+        return df
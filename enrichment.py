@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from constants import RESULT_COLUMNS
+
+
+LIBRARY_DIR = os.environ.get('CACAIO_GENE_SETS', 'gene_sets')
+CATALOG = 'catalog.json'
+
+
+def read_gmt(path):
+    """
+    Parse a .gmt file into {term: [genes]}.
+    """
+    gene_sets = {}
+    with open(path) as fh:
+        for line in fh:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) > 2:
+                gene_sets[fields[0]] = [g for g in fields[2:] if g]
+    return gene_sets
+
+
+def library_path(name, root=LIBRARY_DIR):
+    """
+    The file a stored library lives in.
+    """
+    return os.path.join(root, f"{name}.npz")
+
+
+def _load_catalog(root):
+    path = os.path.join(root, CATALOG)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def save_library(name, gene_sets, root=LIBRARY_DIR):
+    """
+    Store one library as a sparse gene × term membership matrix and register it
+    in the catalog.
+    """
+    os.makedirs(root, exist_ok=True)
+    terms = list(gene_sets)
+    genes = sorted({g for members in gene_sets.values() for g in members})
+    gene_idx = {g: i for i, g in enumerate(genes)}
+
+    rows, cols = [], []
+    for j, term in enumerate(terms):
+        members = {gene_idx[g] for g in gene_sets[term]}
+        rows.extend(members)
+        cols.extend([j] * len(members))
+    membership = sparse.csc_matrix(
+        (np.ones(len(rows), dtype=np.int8), (rows, cols)),
+        shape=(len(genes), len(terms))
+    )
+
+    np.savez_compressed(
+        library_path(name, root),
+        data=membership.data,
+        indices=membership.indices,
+        indptr=membership.indptr,
+        shape=np.array(membership.shape),
+        genes=np.array(genes, dtype=str),
+        terms=np.array(terms, dtype=str)
+    )
+
+    catalog = _load_catalog(root)
+    catalog[name] = {'n_genes': len(genes), 'n_terms': len(terms)}
+    tmp = os.path.join(root, f"{CATALOG}.tmp")
+    with open(tmp, 'w') as fh:
+        json.dump(catalog, fh, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(root, CATALOG))
+
+
+_libraries = {}
+
+
+def load_library(name, root=LIBRARY_DIR):
+    """
+    Load (and memoize) a stored library: (membership csc matrix, genes, terms).
+    A library rebuilt since it was memoized is loaded again.
+    """
+    path = library_path(name, root)
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    if key not in _libraries:
+        with np.load(path, allow_pickle=False) as npz:
+            membership = sparse.csc_matrix(
+                (npz['data'], npz['indices'], npz['indptr']),
+                shape=tuple(npz['shape'])
+            )
+            genes = pd.Index(npz['genes'])
+            terms = npz['terms']
+        for stale in [k for k in _libraries if k[0] == key[0]]:
+            del _libraries[stale]
+        _libraries[key] = (membership, genes, terms)
+    return _libraries[key]
+
+
+def list_libraries(root=LIBRARY_DIR):
+    """
+    Names of the libraries available offline (empty if none were built).
+    """
+    return sorted(_load_catalog(root))
+
+
+def has_libraries(libraries, root=LIBRARY_DIR):
+    catalog = _load_catalog(root)
+    return all(lib in catalog for lib in libraries)
+
+
+def _benjamini_hochberg(pvals):
+    n = len(pvals)
+    if n == 0:
+        return pvals
+    order = np.argsort(pvals)
+    ranked = pvals[order] * n / np.arange(1, n + 1)
+    adjusted = np.minimum.accumulate(ranked[::-1])[::-1]
+    out = np.empty(n)
+    out[order] = np.minimum(adjusted, 1.0)
+    return out
+
+
+def enrich(gene_list, libraries, root=LIBRARY_DIR):
+    """
+    Hypergeometric enrichment of gene_list against locally stored libraries.
+
+    Follows gseapy's offline Enrichr mode: the background is every gene in the
+    library, the odds ratio uses the Haldane-Anscombe correction, the combined
+    score is -log(p) * odds ratio and p-values are BH-adjusted per library.
+    All terms of a library are scored in one sparse matrix-vector product.
+
+    Returns:
+        DataFrame with Term, Overlap, P-value, Combined Score, Adjusted P-value,
+        sorted by adjusted p-value.
+    """
+    from scipy.stats import hypergeom
+
+    if isinstance(libraries, str):
+        libraries = [libraries]
+
+    results = []
+    for name in libraries:
+        membership, genes, terms = load_library(name, root)
+        query = np.zeros(len(genes), dtype=np.int32)
+        hits = genes.get_indexer(pd.unique(pd.Series(gene_list, dtype=str)))
+        query[hits[hits >= 0]] = 1
+
+        overlap = np.asarray(membership.T @ query).ravel()
+        set_size = np.diff(membership.indptr)
+        keep = overlap > 0
+        x, m = overlap[keep], set_size[keep]
+        bg, k = len(genes), int(query.sum())
+
+        pvals = hypergeom.sf(x - 1, bg, m, k)
+        odds = ((x + 0.5) * (bg - m - k + x + 0.5)) / ((m - x + 0.5) * (k - x + 0.5))
+
+        results.append(pd.DataFrame({
+            'Term': terms[keep],
+            'Overlap': [f"{a}/{b}" for a, b in zip(x, m)],
+            'P-value': pvals,
+            'Combined Score': -np.log(pvals) * odds,
+            'Adjusted P-value': _benjamini_hochberg(pvals)
+        }))
+
+    res = pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=RESULT_COLUMNS)
+    return res.sort_values('Adjusted P-value', kind='stable').reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the offline gene-set library store.")
+    parser.add_argument('--root', default=LIBRARY_DIR)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gmt_cmd = sub.add_parser('gmt', help="import local .gmt files (library name = file name)")
+    gmt_cmd.add_argument('files', nargs='+')
+
+    fetch_cmd = sub.add_parser('fetch', help="download Enrichr libraries once through gseapy")
+    fetch_cmd.add_argument('names', nargs='*', help="library names (default: all Human libraries)")
+
+    args = parser.parse_args()
+    if args.command == 'gmt':
+        for path in args.files:
+            name = os.path.basename(path).split('.gmt')[0]
+            save_library(name, read_gmt(path), args.root)
+            print(f"stored {name}")
+    else:
+        import gseapy as gp
+        for name in args.names or gp.get_library_name(organism="Human"):
+            save_library(name, gp.get_library(name, organism="Human", max_size=100000), args.root)
+            print(f"stored {name}")
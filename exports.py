@@ -0,0 +1,97 @@
+import zlib
+
+import pandas as pd
+
+from constants import EXPORT_FORMATS
+
+
+CHUNK_ROWS = 50_000
+
+
+def export_filename(stem, fmt):
+    return f"{stem}{EXPORT_FORMATS[fmt][1]}"
+
+
+def export_media_type(fmt):
+    return EXPORT_FORMATS[fmt][2]
+
+
+def _chunks(frame, chunk_rows):
+    for start in range(0, len(frame), chunk_rows):
+        yield frame.iloc[start:start + chunk_rows]
+
+
+def iter_csv(frame: pd.DataFrame, chunk_rows=CHUNK_ROWS):
+    yield frame.iloc[:0].to_csv(index=False).encode()
+    for chunk in _chunks(frame, chunk_rows):
+        yield chunk.to_csv(index=False, header=False).encode()
+
+
+def iter_csv_gz(frame: pd.DataFrame, chunk_rows=CHUNK_ROWS):
+    gz = zlib.compressobj(wbits=31)
+    for part in iter_csv(frame, chunk_rows):
+        out = gz.compress(part)
+        if out:
+            yield out
+    yield gz.flush()
+
+
+class _Sink:
+    """
+    Minimal writable file that hands its buffered bytes back on take().
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def iter_parquet(frame: pd.DataFrame, chunk_rows=CHUNK_ROWS):
+    """
+    One row group per chunk, yielded as soon as it is written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _Sink()
+    schema = pa.Schema.from_pandas(frame.iloc[:0], preserve_index=False)
+    with pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for chunk in _chunks(frame, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            data = sink.take()
+            if data:
+                yield data
+    yield sink.take()
+
+
+def iter_export(frame: pd.DataFrame, fmt='csv', chunk_rows=CHUNK_ROWS):
+    """
+    Stream `frame` as bytes in the given export format, chunk_rows rows at a
+    time, without building the whole file in memory.
+    """
+    if fmt == 'csv':
+        return iter_csv(frame, chunk_rows)
+    if fmt == 'csv.gz':
+        return iter_csv_gz(frame, chunk_rows)
+    if fmt == 'parquet':
+        return iter_parquet(frame, chunk_rows)
+    raise ValueError(f"Unknown export format: {fmt}")
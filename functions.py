@@ -1,18 +1,31 @@
+import os
 import numpy as np
 import pandas as pd
-import dcor
-from tqdm import tqdm
-import seaborn as sns
-import matplotlib.pyplot as plt
-import gseapy as gp
 import textwrap
-import harmonypy as hm
+from constants import RESULT_COLUMNS
+from cache import ResultCache, enrichment_key
+from instrumentation import stage
+from centroids import CentroidStore
+from embedding import Embedding
+from similarity import (
+    DTYPE,
+    METRICS,
+    _distance_correlation_from_centered,
+    _double_centered_distances,
+    similarity_matrix,
+)
+
+
+enrichment_cache = ResultCache('enrichment', max_items=int(os.environ.get('CACAIO_ENRICHMENT_CACHE_SIZE', 256)))
 
 
 def compare_centroids_distance_correlation_from_df(
     df: pd.DataFrame,
     sample_col: str = 'sample',
-    dataset_col: str = 'dataset'
+    dataset_col: str = 'dataset',
+    progress=None,
+    metric: str = 'distance_correlation',
+    dtype=None
 ):
     """
     Compute distance correlation between sample centroids in a PCA/Harmony space
@@ -21,67 +34,112 @@ def compare_centroids_distance_correlation_from_df(
     Rule: dataset == 'CCLE' is cell line; else tumor.
 
     Args:
-        df: DataFrame with columns for PCs (pc_cols), plus sample_col and dataset_col.
+        df: DataFrame with columns for PCs (pc_cols), plus sample_col and dataset_col,
+            or an embedding.Embedding (sample_col/dataset_col are then ignored).
         sample_col: name of the column with sample IDs.
         dataset_col: name of the column with dataset labels (e.g. 'CCLE' or other).
+        progress: optional callback receiving stage events (see instrumentation.stage).
+        metric: any similarity.METRICS kernel instead of distance correlation
+            (e.g. 'pearson' for a quick screen).
+        dtype: kernel precision, np.float32 or np.float64 (default
+            similarity.DTYPE).
 
     Returns:
         centroid_df: DataFrame with distance correlation matrix
                      (CCLE samples × Tumor samples).
         best_match: dict with keys 'CCLE', 'Tumor', 'Correlation' for the best pair.
     """
-    pc_cols = [c for c in df.columns if c.startswith('PC')]
-    emb = df[pc_cols + [sample_col, dataset_col]].copy()
-    centroids = (
-        emb
-        .groupby(sample_col, observed=True)[pc_cols]
-        .mean()
-    )
+    with stage(progress, 'centroids'):
+        if isinstance(df, Embedding):
+            store = CentroidStore.from_embedding(df)
+        else:
+            store = CentroidStore.from_frame(df, sample_col, dataset_col)
 
-    sample_to_ds = (
-        emb
-        .drop_duplicates(sample_col)
-        .set_index(sample_col)[dataset_col]
-    )
+    return compare_centroids_distance_correlation_from_store(store, progress=progress, metric=metric, dtype=dtype)
 
-    ccle_centroids  = centroids.loc[sample_to_ds == 'CCLE']
-    tumor_centroids = centroids.loc[sample_to_ds != 'CCLE']
 
-    if ccle_centroids.empty or tumor_centroids.empty:
+def _similarity_stage(metric):
+    return 'distance_correlation' if metric.startswith('distance_correlation') else 'similarity'
+
+
+def compare_centroids_distance_correlation_from_store(store: CentroidStore, progress=None,
+                                                      metric='distance_correlation', dtype=None):
+    """
+    Same as compare_centroids_distance_correlation_from_df, starting from a
+    CentroidStore so no cell-level grouping is needed.
+    """
+    ccle, tumor = store.split()
+    if not ccle or not tumor:
         raise ValueError("No CCLE or Tumor samples found with given criteria.")
 
-    centroid_df = pd.DataFrame(
-        index=ccle_centroids.index,
-        columns=tumor_centroids.index,
-        dtype=float
-    )
+    ccle_centroids = store.centroids(ccle)
+    tumor_centroids = store.centroids(tumor)
+
+    with stage(progress, _similarity_stage(metric)):
+        centroid_df = pd.DataFrame(
+            similarity_matrix(ccle_centroids.values, tumor_centroids.values, metric, dtype),
+            index=ccle_centroids.index,
+            columns=tumor_centroids.index,
+            dtype=float
+        )
+
+    return centroid_df, _best_pair(centroid_df, ascending=METRICS[metric][2])
+
+
+def update_centroid_similarity(centroid_df: pd.DataFrame, store: CentroidStore, changed, progress=None,
+                               metric='distance_correlation', dtype=None):
+    """
+    Refresh a CCLE × tumor matrix after store.append(): only the rows/columns of
+    the samples in `changed` are recomputed, new samples are added. metric
+    and dtype must be the ones centroid_df was computed with.
+
+    Returns:
+        (centroid_df, best_match) like compare_centroids_distance_correlation_from_df.
+    """
+    ccle_all, tumor_all = store.split()
+    ccle_changed, tumor_changed = store.split(changed)
+    out = centroid_df.reindex(index=pd.Index(ccle_all, name=store.sample_col),
+                              columns=pd.Index(tumor_all, name=store.sample_col))
 
-    for ccle_s in tqdm(ccle_centroids.index, desc="Calculating distance correlations"):
-        v1 = ccle_centroids.loc[ccle_s].values
-        for tum_s in tumor_centroids.index:
-            v2 = tumor_centroids.loc[tum_s].values
-            try:
-                centroid_df.at[ccle_s, tum_s] = dcor.distance_correlation(v1, v2)
-            except Exception:
-                centroid_df.at[ccle_s, tum_s] = np.nan
+    with stage(progress, _similarity_stage(metric)):
+        if ccle_changed:
+            out.loc[ccle_changed, :] = similarity_matrix(
+                store.centroids(ccle_changed).values, store.centroids(tumor_all).values, metric, dtype
+            )
+        if tumor_changed:
+            out.loc[:, tumor_changed] = similarity_matrix(
+                store.centroids(ccle_all).values, store.centroids(tumor_changed).values, metric, dtype
+            )
 
+    return out, _best_pair(out, ascending=METRICS[metric][2])
+
+
+def _best_pair(centroid_df, ascending=False):
     clean = centroid_df.dropna(how='all', axis=0).dropna(how='all', axis=1)
     if clean.empty:
         raise ValueError("Distance correlation matrix is empty after cleaning.")
 
-    max_idx = clean.stack().idxmax()
-    best_match = {
+    stacked = clean.stack()
+    max_idx = stacked.idxmin() if ascending else stacked.idxmax()
+    return {
         'CCLE':       max_idx[0],
         'Tumor':      max_idx[1],
         'Correlation': clean.loc[max_idx]
     }
 
-    return centroid_df, best_match
+def _melted(matrix, like):
+    """
+    Values of `matrix` in the row order of like.reset_index().melt(...).
+    """
+    return matrix.reindex(index=like.index, columns=like.columns).to_numpy(dtype=np.float64).ravel(order='F')
+
 
-def convert_to_long_format(centroid_df):
+def convert_to_long_format(centroid_df, pvalues=None, fdr=None, extra=None):
     """
     Converte o DataFrame wide para formato longo com colunas:
     CCLE, Primary Tumor, Distance Correlation
+    (e P-value, FDR quando as matrizes de significância são fornecidas, e uma
+    coluna por matriz de `extra`, e.g. bootstrap.summarize)
     """
     long_df = centroid_df.reset_index()
     
@@ -94,11 +152,17 @@ def convert_to_long_format(centroid_df):
     )
     
     long_df = long_df.rename(columns={index_col_name: 'CCLE'})
+    if pvalues is not None:
+        long_df['P-value'] = _melted(pvalues, centroid_df)
+    if fdr is not None:
+        long_df['FDR'] = _melted(fdr, centroid_df)
+    for name, matrix in (extra or {}).items():
+        long_df[name] = _melted(matrix, centroid_df)
     
     long_df = long_df.dropna(subset=['Distance Correlation'])
     return long_df.sort_values('Distance Correlation', ascending=False)
 
-def plot_correlation_heatmap(centroid_matrix):
+def plot_correlation_heatmap(centroid_matrix, progress=None):
     """
     Plot a correlation heatmap.
     
@@ -107,63 +171,100 @@ def plot_correlation_heatmap(centroid_matrix):
     centroid_matrix : array-like
         Matrix data for the heatmap
     """
-    plt.figure(figsize=(10, 8))
-    ax = sns.heatmap(
-        centroid_matrix,
-        cmap='rocket',
-        linecolor="lightgray",
-        cbar_kws={"label": "Distance Correlation"},
-        xticklabels=True,
-        yticklabels=True
-    )
-
-    plt.xlabel("Tumor Samples", fontdict={'weight': 'bold'}, fontsize=10)
-    plt.ylabel("CCLE Samples", fontdict={'weight': 'bold'}, fontsize=10)
-    plt.xticks(fontsize=8, ha='right')
-    plt.yticks(fontsize=8)
-
-    cbar = ax.collections[0].colorbar
-    cbar.ax.tick_params(labelsize=14)
-    cbar.set_label('Distance Correlation', fontsize=10, weight='bold')
-
-    plt.tight_layout()
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    with stage(progress, 'heatmap_plot'):
+        plt.figure(figsize=(10, 8))
+        ax = sns.heatmap(
+            centroid_matrix,
+            cmap='rocket',
+            linecolor="lightgray",
+            cbar_kws={"label": "Distance Correlation"},
+            xticklabels=True,
+            yticklabels=True
+        )
+
+        plt.xlabel("Tumor Samples", fontdict={'weight': 'bold'}, fontsize=10)
+        plt.ylabel("CCLE Samples", fontdict={'weight': 'bold'}, fontsize=10)
+        plt.xticks(fontsize=8, ha='right')
+        plt.yticks(fontsize=8)
+
+        cbar = ax.collections[0].colorbar
+        cbar.ax.tick_params(labelsize=14)
+        cbar.set_label('Distance Correlation', fontsize=10, weight='bold')
+
+        plt.tight_layout()
     
-def run_enrichment_analysis(gene_list, libraries, organism='human'):
-    """
-    Run enrichment analysis using Enrichr
+def run_enrichment_analysis(gene_list, libraries, organism='human', cache=enrichment_cache, progress=None):
     """
-    enr = gp.enrichr(
-        gene_list=gene_list, 
-        gene_sets=libraries,
-        organism=organism, 
-        outdir=None
-    )
-    return enr.results[['Term', 'Overlap', 'P-value', 'Combined Score', 'Adjusted P-value']]
+    Run enrichment analysis, locally when every library is in the offline
+    gene-set store and through the Enrichr API otherwise.
 
-def create_horizontal_barplot(df):
+    Results are looked up in `cache` (keyed by the sorted gene list, the
+    libraries and their files, and the engine) before any work is done;
+    pass cache=None to bypass it.
+    """
+    from enrichment import enrich, has_libraries, library_path
+
+    libs = [libraries] if isinstance(libraries, str) else list(libraries)
+    local = has_libraries(libs)
+    key = None
+    if cache is not None:
+        key = enrichment_key(
+            gene_list, libs, engine='local' if local else 'enrichr',
+            sources=[library_path(lib) for lib in libs] if local else (), organism=organism
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    with stage(progress, 'enrichment'):
+        if local:
+            results = enrich(gene_list, libs)[RESULT_COLUMNS]
+        else:
+            import gseapy as gp
+
+            enr = gp.enrichr(
+                gene_list=gene_list, 
+                gene_sets=libraries,
+                organism=organism, 
+                outdir=None
+            )
+            results = enr.results[RESULT_COLUMNS]
+
+    if key is not None:
+        cache.put(key, results)
+    return results
+
+def create_horizontal_barplot(df, progress=None):
     """
     Create horizontal bar plot for enrichment results
     """
-    top = df.sort_values('Adjusted P-value', ascending=True).head(10).copy()
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    with stage(progress, 'enrichment_plot'):
+        top = df.sort_values('Adjusted P-value', ascending=True).head(10).copy()
     
-    top['-log10(Adjusted P-value)'] = -np.log10(top['Adjusted P-value'])
+        top['-log10(Adjusted P-value)'] = -np.log10(top['Adjusted P-value'])
     
-    top['Term_wrapped'] = top['Term'].apply(lambda x: '\n'.join(textwrap.wrap(x, width=25)))
+        top['Term_wrapped'] = top['Term'].apply(lambda x: '\n'.join(textwrap.wrap(x, width=25)))
     
-    plt.figure(figsize=(8, 6))
-    sns.barplot(
-        data=top,
-        x='-log10(Adjusted P-value)',
-        y='Term_wrapped',
-        dodge=False,
-        hue="Combined Score",
-        palette="rocket"
-    )
-    plt.xlabel(r'$-\log_{10}$ (Adjusted P-value)', fontsize=6, fontweight='bold')
-    plt.yticks(fontsize=8, fontweight='bold', rotation=0)
-    plt.ylabel('')
-    plt.tight_layout()
-    return plt.gcf()
+        plt.figure(figsize=(8, 6))
+        sns.barplot(
+            data=top,
+            x='-log10(Adjusted P-value)',
+            y='Term_wrapped',
+            dodge=False,
+            hue="Combined Score",
+            palette="rocket"
+        )
+        plt.xlabel(r'$-\log_{10}$ (Adjusted P-value)', fontsize=6, fontweight='bold')
+        plt.yticks(fontsize=8, fontweight='bold', rotation=0)
+        plt.ylabel('')
+        plt.tight_layout()
+        return plt.gcf()
 
 
 def cross_modal_harmony_embeddings_from_df(
@@ -175,14 +276,53 @@ def cross_modal_harmony_embeddings_from_df(
     sample_col: str = 'sample',
     theta: float = 0.0,
     sigma: float = 0.2,
-    n_pcs: int = 50
+    n_pcs: int = 50,
+    progress=None,
+    pseudo_centroids: pd.DataFrame = None,
+    bulk_pca: pd.DataFrame = None,
+    reference=None
 ):
-    pc_cols = [f"PC{i+1}" for i in range(n_pcs)]
-    pseudo_centroids = df_pca.groupby(sample_col, observed=True)[pc_cols].mean()
+    """
+    Harmony-integrate bulk samples with the pseudo-bulk centroids of df_pca.
+
+    df_pca may be an embedding.Embedding. pseudo_centroids may be passed
+    precomputed (e.g. from a CentroidStore) to skip grouping the cells of
+    df_pca, and bulk_pca (samples × PCs, e.g. from
+    bulk.project_bulk_file) to skip projecting bulk_df, which may then be None.
 
-    bulk_mat = bulk_df.reindex(columns=hvg_genes, fill_value=0).values
-    bulk_pca = pca.transform(scaler.transform(bulk_mat))
-    bulk_pca_df = pd.DataFrame(bulk_pca, index=bulk_df.index, columns=pc_cols)
+    With a frozen reference (reference.HarmonyReference) the centroids keep
+    their reference embedding and only the bulk samples are mapped into it;
+    Harmony is not rerun.
+    """
+    pc_cols = [f"PC{i+1}" for i in range(n_pcs)]
+    harmony_cols = [f"HarmonyPC{i+1}" for i in range(n_pcs)]
+    if reference is not None:
+        if bulk_pca is None:
+            with stage(progress, 'projection'):
+                bulk_mat = bulk_df.reindex(columns=hvg_genes, fill_value=0).values
+                bulk_pca = pd.DataFrame(pca.transform(scaler.transform(bulk_mat))[:, :n_pcs],
+                                        index=bulk_df.index, columns=pc_cols)
+        with stage(progress, 'harmony'):
+            pseudo_h = reference.reference_embedding(harmony_cols)
+            bulk_h = pd.DataFrame(reference.map(bulk_pca[pc_cols].values), index=bulk_pca.index, columns=harmony_cols)
+        return pseudo_h, bulk_h
+
+    if pseudo_centroids is None:
+        with stage(progress, 'centroids'):
+            if isinstance(df_pca, Embedding):
+                pseudo_centroids = df_pca.centroids()[pc_cols]
+            else:
+                pseudo_centroids = df_pca.groupby(sample_col, observed=True)[pc_cols].mean()
+    else:
+        pseudo_centroids = pseudo_centroids[pc_cols]
+
+    if bulk_pca is None:
+        with stage(progress, 'projection'):
+            bulk_mat = bulk_df.reindex(columns=hvg_genes, fill_value=0).values
+            bulk_pca = pca.transform(scaler.transform(bulk_mat))
+            bulk_pca_df = pd.DataFrame(bulk_pca, index=bulk_df.index, columns=pc_cols)
+    else:
+        bulk_pca_df = bulk_pca[pc_cols]
 
     comb = pd.concat([pseudo_centroids, bulk_pca_df], axis=0)
     batch = ['scRNA'] * len(pseudo_centroids) + ['bulk'] * len(bulk_pca_df)
@@ -192,18 +332,20 @@ def cross_modal_harmony_embeddings_from_df(
 
     sigma_arr = np.full((n_clusters,), sigma)
 
-    ho = hm.run_harmony(
-        comb.values,
-        meta,
-        vars_use='batch',
-        theta=theta,
-        sigma=sigma_arr,
-        nclust=n_clusters,
-        verbose=False
-    )
+    with stage(progress, 'harmony'):
+        import harmonypy as hm
+
+        ho = hm.run_harmony(
+            comb.values,
+            meta,
+            vars_use='batch',
+            theta=theta,
+            sigma=sigma_arr,
+            nclust=n_clusters,
+            verbose=False
+        )
 
     Z = ho.Z_corr.T
-    harmony_cols = [f"HarmonyPC{i+1}" for i in range(n_pcs)]
     emb_h = pd.DataFrame(Z, index=comb.index, columns=harmony_cols)
 
     pseudo_h = emb_h.loc[pseudo_centroids.index]
@@ -211,36 +353,103 @@ def cross_modal_harmony_embeddings_from_df(
 
     return pseudo_h, bulk_h
 
-def compute_distance_correlation_matrix(pseudo_h: pd.DataFrame, bulk_h: pd.DataFrame):
+def compute_distance_correlation_matrix(pseudo_h: pd.DataFrame, bulk_h: pd.DataFrame, progress=None,
+                                        metric='distance_correlation', dtype=None):
     """
     Compute distance correlation between each bulk sample and each pseudo-bulk centroid
+    (or another similarity.METRICS metric, in dtype precision)
     """
-    dcorr_df = pd.DataFrame(
-        index=bulk_h.index,
-        columns=pseudo_h.index,
-        dtype=float
-    )
-
-    for b in tqdm(bulk_h.index, desc="Calculating distance correlations"):
-        v_bulk = bulk_h.loc[b].values.astype(np.float64)
-        for p in pseudo_h.index:
-            v_pseudo = pseudo_h.loc[p].values.astype(np.float64)
-            try:
-                dc = dcor.distance_correlation(v_bulk, v_pseudo)
-            except Exception:
-                dc = np.nan
-            dcorr_df.at[b, p] = dc
-
+    with stage(progress, _similarity_stage(metric)):
+        dcorr_df = pd.DataFrame(
+            similarity_matrix(bulk_h.values, pseudo_h.values, metric, dtype),
+            index=bulk_h.index,
+            columns=pseudo_h.index,
+            dtype=float
+        )
+
+    best = dcorr_df.idxmin(axis=1) if METRICS[metric][2] else dcorr_df.idxmax(axis=1)
     best_match = {
-        b: (dcorr_df.loc[b].idxmax(), dcorr_df.loc[b].max())
+        b: (best[b], dcorr_df.loc[b, best[b]])
         for b in dcorr_df.index
     }
 
     return dcorr_df, best_match
 
-def convert_cross_modal_to_long(correlation_matrix):
+def iter_top_distance_correlations(
+    pseudo_h: pd.DataFrame,
+    bulk_h: pd.DataFrame,
+    k: int = 5,
+    bulk_chunk_size: int = 256,
+    pseudo_chunk_size: int = 512,
+    metric: str = 'distance_correlation',
+    dtype=None
+):
     """
-    Converts the cross-modal correlation matrix to long format
+    Stream the k best pseudo-bulk centroids for each bulk sample.
+
+    Bulk samples are processed in chunks of bulk_chunk_size and pseudo-centroids
+    in blocks of pseudo_chunk_size, keeping only a running top-k per bulk sample,
+    so memory grows with k and the chunk sizes, not with the number of
+    pseudo-centroids. metric is any similarity.METRICS kernel ("best" is the
+    lowest value for distances such as euclidean).
+
+    Yields:
+        One long-format DataFrame per bulk chunk with columns
+        Bulk_Sample, Pseudo_Centroid, <metric label> (e.g. Distance_Correlation), Rank
+        (rank 1 is the best match).
+    """
+    _, label, ascending = METRICS[metric]
+    value_col = label.replace(' ', '_')
+    # rank by sign * value so the best match is always the largest
+    sign = -1.0 if ascending else 1.0
+    dtype = DTYPE if dtype is None else dtype
+    pseudo = pseudo_h.values
+    bulk = bulk_h.values
+    k = min(k, pseudo.shape[0])
+
+    for start in range(0, bulk.shape[0], bulk_chunk_size):
+        bulk_chunk = bulk[start:start + bulk_chunk_size]
+        # the default kernel reuses each bulk sample's centered distances across blocks
+        bulk_centered = _double_centered_distances(bulk_chunk, dtype) if metric == 'distance_correlation' else None
+        n_rows = bulk_chunk.shape[0]
+        top_val = np.full((n_rows, k), -np.inf)
+        top_idx = np.full((n_rows, k), -1)
+
+        for p_start in range(0, pseudo.shape[0], pseudo_chunk_size):
+            pseudo_block = pseudo[p_start:p_start + pseudo_chunk_size]
+            if bulk_centered is not None:
+                block = _distance_correlation_from_centered(
+                    bulk_centered, _double_centered_distances(pseudo_block, dtype)
+                )
+            else:
+                block = similarity_matrix(bulk_chunk, pseudo_block, metric, dtype)
+            block = np.nan_to_num(sign * block.astype(np.float64), nan=-np.inf)
+            vals = np.concatenate([top_val, block], axis=1)
+            idx = np.concatenate(
+                [top_idx, np.broadcast_to(np.arange(p_start, p_start + block.shape[1]), block.shape)],
+                axis=1
+            )
+            keep = np.argpartition(-vals, k - 1, axis=1)[:, :k]
+            top_val = np.take_along_axis(vals, keep, axis=1)
+            top_idx = np.take_along_axis(idx, keep, axis=1)
+
+        order = np.argsort(-top_val, axis=1, kind='stable')
+        top_val = np.take_along_axis(top_val, order, axis=1)
+        top_idx = np.take_along_axis(top_idx, order, axis=1)
+
+        chunk = pd.DataFrame({
+            'Bulk_Sample': np.repeat(bulk_h.index[start:start + n_rows], k),
+            'Pseudo_Centroid': pseudo_h.index[top_idx.ravel()],
+            value_col: sign * top_val.ravel(),
+            'Rank': np.tile(np.arange(1, k + 1), n_rows)
+        })
+        yield chunk[np.isfinite(chunk[value_col])].reset_index(drop=True)
+
+def convert_cross_modal_to_long(correlation_matrix, pvalues=None, fdr=None, value_name='Distance_Correlation',
+                                ascending=False):
+    """
+    Converts the cross-modal correlation matrix to long format, with P_value
+    and FDR columns when the significance matrices are given
     """
     long_df = correlation_matrix.reset_index()
     index_col_name = long_df.columns[0]
@@ -248,65 +457,86 @@ def convert_cross_modal_to_long(correlation_matrix):
     long_df = long_df.melt(
         id_vars=index_col_name,
         var_name='Pseudo_Centroid',
-        value_name='Distance_Correlation'
+        value_name=value_name
     )
     
     long_df = long_df.rename(columns={index_col_name: 'Bulk_Sample'})
-    long_df = long_df.dropna(subset=['Distance_Correlation'])
-    return long_df.sort_values('Distance_Correlation', ascending=False)
+    if pvalues is not None:
+        long_df['P_value'] = _melted(pvalues, correlation_matrix)
+    if fdr is not None:
+        long_df['FDR'] = _melted(fdr, correlation_matrix)
+    long_df = long_df.dropna(subset=[value_name])
+    return long_df.sort_values(value_name, ascending=ascending)
+
+def plot_top_combinations(correlation_matrix, filter_type, sample_types, top_n=5, progress=None,
+                          metric='distance_correlation', top=None):
+    """
+    Bar plot of the top_n bulk × pseudo-centroid matches. For top-k results
+    (no correlation_matrix), pass their long-format table as top.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    _, label, ascending = METRICS[metric]
+    value_col = label.replace(' ', '_')
 
-def plot_top_combinations(correlation_matrix, filter_type, sample_types, top_n=5):
-    long_data = convert_cross_modal_to_long(correlation_matrix)
+    with stage(progress, 'cross_modal_plot'):
+        if correlation_matrix is None:
+            long_data = top.sort_values(value_col, ascending=ascending)
+        else:
+            long_data = convert_cross_modal_to_long(correlation_matrix, value_name=value_col, ascending=ascending)
     
-    long_data['sample_type'] = long_data['Pseudo_Centroid'].map(sample_types)
+        long_data['sample_type'] = long_data['Pseudo_Centroid'].map(sample_types)
     
-    if filter_type == "primary_tumor":
-        long_data = long_data[long_data['sample_type'] == 'primary_tumor']
-    elif filter_type == "cell_line":
-        long_data = long_data[long_data['sample_type'] == 'cell_line']
+        if filter_type == "primary_tumor":
+            long_data = long_data[long_data['sample_type'] == 'primary_tumor']
+        elif filter_type == "cell_line":
+            long_data = long_data[long_data['sample_type'] == 'cell_line']
     
-    top_combinations = long_data.nlargest(top_n, 'Distance_Correlation')
+        top_combinations = long_data.head(top_n)
     
-    labels = []
-    for _, row in top_combinations.iterrows():
-        bulk = row['Bulk_Sample']
-        pseudo = row['Pseudo_Centroid']
-        labels.append(f"{bulk}\nvs\n{pseudo}")
+        labels = []
+        for _, row in top_combinations.iterrows():
+            bulk = row['Bulk_Sample']
+            pseudo = row['Pseudo_Centroid']
+            labels.append(f"{bulk}\nvs\n{pseudo}")
     
-    plt.figure(figsize=(10, 8))
+        plt.figure(figsize=(10, 8))
     
-    colors = sns.color_palette("rocket", len(top_combinations))
+        colors = sns.color_palette("rocket", len(top_combinations))
     
-    bars = plt.barh(
-        labels,
-        top_combinations['Distance_Correlation'],
-        color=colors,
-        edgecolor='black',
-        linewidth=0.5,
-        alpha=0.9
-    )
+        bars = plt.barh(
+            labels,
+            top_combinations[value_col],
+            color=colors,
+            edgecolor='black',
+            linewidth=0.5,
+            alpha=0.9
+        )
     
-    for i, (bar, value) in enumerate(zip(bars, top_combinations['Distance_Correlation'])):
-        width = bar.get_width()
-        plt.text(width + 0.005, bar.get_y() + bar.get_height()/2, 
-                f'{value:.4f}', 
-                ha='left', va='center', 
-                fontweight='bold', 
-                fontsize=6,
-                bbox=dict(boxstyle="round,pad=0.3", facecolor='white', alpha=0.9))
+        for i, (bar, value) in enumerate(zip(bars, top_combinations[value_col])):
+            width = bar.get_width()
+            plt.text(width + 0.005, bar.get_y() + bar.get_height()/2, 
+                    f'{value:.4f}', 
+                    ha='left', va='center', 
+                    fontweight='bold', 
+                    fontsize=6,
+                    bbox=dict(boxstyle="round,pad=0.3", facecolor='white', alpha=0.9))
     
-    plt.xlabel('Distance Correlation', fontsize=8, fontweight='bold')
-    plt.ylabel('Sample Combinations', fontsize=8, fontweight='bold')
-    plt.title(f'Top {top_n} Cross-Modal Correlations\n(Bulk Samples vs Pseudo Centroids)', 
-              fontsize=10, fontweight='bold')
-    plt.yticks(fontsize=6)
+        plt.xlabel(label, fontsize=8, fontweight='bold')
+        plt.ylabel('Sample Combinations', fontsize=8, fontweight='bold')
+        plt.title(f'Top {top_n} Cross-Modal Matches by {label}\n(Bulk Samples vs Pseudo Centroids)', 
+                  fontsize=10, fontweight='bold')
+        plt.yticks(fontsize=6)
     
-    plt.axvline(x=0, color='grey', linewidth=0.8)
-    plt.grid(axis='x', alpha=0.3, linestyle='--')
+        plt.axvline(x=0, color='grey', linewidth=0.8)
+        plt.grid(axis='x', alpha=0.3, linestyle='--')
     
-    plt.xlim(0, min(1.0, top_combinations['Distance_Correlation'].max() * 1.15))
-    plt.gca().invert_yaxis()
+        values = top_combinations[value_col]
+        upper = values.max() * 1.15 if ascending else min(1.0, values.max() * 1.15)
+        plt.xlim(min(0, values.min() * 1.15), upper)
+        plt.gca().invert_yaxis()
     
-    plt.tight_layout()
+        plt.tight_layout()
     
-    return plt.gcf()
\ No newline at end of file
+        return plt.gcf()
\ No newline at end of file
@@ -0,0 +1,158 @@
+import base64
+import functools
+import hashlib
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache import ResultCache
+
+
+MAX_CELLS_PER_AXIS = int(os.environ.get('CACAIO_HEATMAP_MAX', 200))
+MAX_LABELS = 60
+
+heatmap_cache = ResultCache('heatmaps', max_items=int(os.environ.get('CACAIO_HEATMAP_CACHE_SIZE', 64)))
+
+
+def leaf_order(values):
+    """
+    Row order from average-linkage clustering on correlation distance.
+    """
+    from scipy.cluster.hierarchy import leaves_list, linkage
+
+    if len(values) < 3:
+        return np.arange(len(values))
+    values = np.nan_to_num(values)
+    if np.ptp(values, axis=1).min() == 0:
+        # correlation distance is undefined for constant rows
+        return leaves_list(linkage(values, method='average', metric='euclidean'))
+    return leaves_list(linkage(values, method='average', metric='correlation'))
+
+
+def block_means(values, n_blocks, axis):
+    """
+    Mean of `values` over n_blocks contiguous, near-equal blocks along axis.
+    """
+    starts = np.array([len(b) for b in np.array_split(np.arange(values.shape[axis]), n_blocks)])
+    starts = np.concatenate([[0], np.cumsum(starts)[:-1]])
+    counts = np.diff(np.append(starts, values.shape[axis]))
+    sums = np.add.reduceat(values, starts, axis=axis)
+    shape = [1, 1]
+    shape[axis] = -1
+    return sums / counts.reshape(shape)
+
+
+def prepare(matrix: pd.DataFrame, cluster=False, max_cells=MAX_CELLS_PER_AXIS):
+    """
+    Reorder and shrink a matrix for display.
+
+    With cluster=True rows and columns follow hierarchical clustering leaf
+    order. Axes longer than max_cells are averaged over contiguous blocks (of
+    the ordered axis) down to max_cells; their labels are dropped.
+
+    Returns:
+        (values, row_labels, col_labels); a label list is None when the axis
+        was aggregated.
+    """
+    values = matrix.to_numpy(dtype=np.float64)
+    rows, cols = list(matrix.index), list(matrix.columns)
+    if cluster:
+        r, c = leaf_order(values), leaf_order(values.T)
+        values = values[np.ix_(r, c)]
+        rows, cols = [rows[i] for i in r], [cols[i] for i in c]
+    if values.shape[0] > max_cells:
+        values, rows = block_means(values, max_cells, axis=0), None
+    if values.shape[1] > max_cells:
+        values, cols = block_means(values, max_cells, axis=1), None
+    return values, rows, cols
+
+
+def render_heatmap(matrix: pd.DataFrame, cluster=False, max_cells=MAX_CELLS_PER_AXIS,
+                   width=10, height=8, dpi=100, label='Distance Correlation', cmap='rocket'):
+    """
+    Render a CCLE × tumor matrix to PNG bytes.
+
+    Uses an explicit Figure (no pyplot state, safe across sessions and
+    threads) and a single rasterized image instead of one patch per cell.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    import seaborn as sns
+
+    values, rows, cols = prepare(matrix, cluster, max_cells)
+    n_rows, n_cols = matrix.shape
+
+    fig = Figure(figsize=(width, height), dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    im = ax.imshow(
+        np.ma.masked_invalid(values), cmap=sns.color_palette(cmap, as_cmap=True),
+        aspect='auto', interpolation='nearest', rasterized=True
+    )
+
+    for axis, labels, n, name in (
+        (ax.xaxis, cols, n_cols, "Tumor Samples"),
+        (ax.yaxis, rows, n_rows, "CCLE Samples"),
+    ):
+        if labels is not None and len(labels) <= MAX_LABELS:
+            axis.set_ticks(np.arange(len(labels)), labels, fontsize=8)
+        else:
+            axis.set_ticks([])
+            name = f"{name} ({n}, averaged into {max_cells} bins)" if labels is None else f"{name} ({n})"
+        axis.set_label_text(name, fontdict={'weight': 'bold'}, fontsize=10)
+    ax.tick_params(axis='x', labelrotation=90)
+
+    cbar = fig.colorbar(im, ax=ax)
+    cbar.ax.tick_params(labelsize=14)
+    cbar.set_label(label, fontsize=10, weight='bold')
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def heatmap_key(matrix: pd.DataFrame, **options):
+    """
+    Hash of the matrix contents, its labels and the view options.
+    """
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(matrix.to_numpy(dtype=np.float64)).tobytes())
+    for labels in (matrix.index, matrix.columns):
+        h.update(pd.util.hash_array(np.asarray(labels.astype(str), dtype=object)).tobytes())
+    h.update(repr(sorted(options.items())).encode())
+    return h.hexdigest()
+
+
+def cached_heatmap(matrix: pd.DataFrame, cache=heatmap_cache, **options):
+    """
+    PNG bytes of render_heatmap(matrix, **options), rendered only on a cache miss.
+    """
+    key = heatmap_key(matrix, **options)
+    png = cache.get(key) if cache is not None else None
+    if png is None:
+        png = render_heatmap(matrix, **options)
+        if cache is not None:
+            cache.put(key, png)
+    return png
+
+
+async def cached_heatmap_async(run, matrix: pd.DataFrame, cache=heatmap_cache, **options):
+    """
+    cached_heatmap for the event loop: on a cache miss the render is awaited
+    through run(fn, *args, key=...), e.g. tasks.shared.run, instead of
+    blocking every session while matplotlib draws.
+    """
+    key = heatmap_key(matrix, **options)
+    png = cache.get(key) if cache is not None else None
+    if png is None:
+        png = await run(functools.partial(render_heatmap, **options), matrix, key=key)
+        if cache is not None:
+            cache.put(key, png)
+    return png
+
+
+def data_uri(png):
+    return "data:image/png;base64," + base64.b64encode(png).decode('ascii')
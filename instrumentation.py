@@ -0,0 +1,78 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger('cacaio.timing')
+
+
+@contextmanager
+def stage(progress, name):
+    """
+    Time one stage of an analysis and report it through the `progress` callback.
+
+    The callback receives dicts like
+        {'stage': 'harmony', 'status': 'start', 'elapsed': None}
+        {'stage': 'harmony', 'status': 'end', 'elapsed': 1.83}
+    ('error' instead of 'end' if the stage raised). With progress=None this is
+    a no-op, so engines can be called without any instrumentation.
+    """
+    if progress is None:
+        yield
+        return
+    progress({'stage': name, 'status': 'start', 'elapsed': None})
+    start = time.perf_counter()
+    status = 'error'
+    try:
+        yield
+        status = 'end'
+    finally:
+        progress({'stage': name, 'status': status, 'elapsed': time.perf_counter() - start})
+
+
+class StageMetrics:
+    """
+    Per-stage timing aggregates, exported as Prometheus text and logged as
+    one JSON line per finished stage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = {}
+        self._sum = {}
+        self._errors = {}
+        self.gauges = {}
+
+    def record(self, event):
+        if event['status'] == 'start':
+            return
+        name = event['stage']
+        with self._lock:
+            self._count[name] = self._count.get(name, 0) + 1
+            self._sum[name] = self._sum.get(name, 0.0) + event['elapsed']
+            if event['status'] == 'error':
+                self._errors[name] = self._errors.get(name, 0) + 1
+        logger.info(json.dumps(event))
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP cacaio_stage_seconds Time spent per analysis stage.",
+            "# TYPE cacaio_stage_seconds summary",
+        ]
+        with self._lock:
+            for name in sorted(self._count):
+                lines.append(f'cacaio_stage_seconds_count{{stage="{name}"}} {self._count[name]}')
+                lines.append(f'cacaio_stage_seconds_sum{{stage="{name}"}} {self._sum[name]:.6f}')
+            lines.append("# HELP cacaio_stage_errors_total Stages that raised.")
+            lines.append("# TYPE cacaio_stage_errors_total counter")
+            for name in sorted(self._errors):
+                lines.append(f'cacaio_stage_errors_total{{stage="{name}"}} {self._errors[name]}')
+        for name, fn in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {fn()}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = StageMetrics()
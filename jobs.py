@@ -0,0 +1,451 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from cache import SIMILARITY_VERSION, source_signature
+from instrumentation import metrics
+
+
+JOBS_DIR = os.environ.get('CACAIO_JOBS_DIR', 'jobs')
+JOB_TTL = float(os.environ.get('CACAIO_JOB_TTL', 7 * 24 * 3600))
+# a running job whose owner has not renewed its lease for this long is taken over
+JOB_LEASE = float(os.environ.get('CACAIO_JOB_LEASE', 60))
+ARTIFACT = 'result.npz'
+
+# job kind -> job function in tasks.py, called with the job's stored kwargs
+JOB_KINDS = {'cross_modal': 'cross_modal_job'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    kwargs TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    error TEXT,
+    nbytes INTEGER,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    owner TEXT,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, finished);
+"""
+
+
+class JobNotFound(LookupError):
+    """Raised for job IDs that do not exist (or were cleaned up)."""
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(chunk_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _column(values):
+    """
+    A column or index as an array np.load reads without pickles, and the
+    dtype to cast it back to (None when it is stored as is).
+    """
+    if isinstance(values.dtype, np.dtype) and values.dtype != object:
+        return values.to_numpy(), None
+    return np.asarray(values.astype(str), dtype=str), str(values.dtype)
+
+
+def _restore(array, dtype):
+    return array if dtype is None else pd.Series(array).astype(dtype).array
+
+
+def _flatten(name, value, arrays, meta):
+    if isinstance(value, pd.DataFrame):
+        arrays[f"{name}.index"], index_dtype = _column(value.index)
+        arrays[f"{name}.columns"] = np.asarray(value.columns.astype(str), dtype=str)
+        meta[name] = {'type': 'frame', 'index': value.index.name, 'columns': value.columns.name,
+                      'index_dtype': index_dtype}
+        dtypes = value.dtypes.unique()
+        if len(dtypes) == 1 and isinstance(dtypes[0], np.dtype) and dtypes[0] != object:
+            # e.g. the similarity matrix: one block rather than thousands of columns
+            arrays[f"{name}.values"] = value.to_numpy()
+        else:
+            # mixed frames (e.g. the top-k table) keep each column's dtype
+            meta[name]['dtypes'] = []
+            for i, (_, column) in enumerate(value.items()):
+                arrays[f"{name}.{i}"], dtype = _column(column)
+                meta[name]['dtypes'].append(dtype)
+    elif isinstance(value, pd.Series):
+        arrays[f"{name}.values"], dtype = _column(value)
+        arrays[f"{name}.index"], index_dtype = _column(value.index)
+        meta[name] = {'type': 'series', 'name': value.name, 'index': value.index.name,
+                      'dtype': dtype, 'index_dtype': index_dtype}
+    elif isinstance(value, dict) and any(isinstance(v, (pd.DataFrame, pd.Series, dict)) for v in value.values()):
+        meta[name] = {'type': 'dict', 'keys': list(value)}
+        for i, v in enumerate(value.values()):
+            _flatten(f"{name}.{i}", v, arrays, meta)
+    else:
+        meta[name] = {'type': 'json', 'value': value}
+
+
+def _unflatten(name, npz, meta):
+    spec = meta[name]
+    if spec['type'] == 'frame':
+        index = pd.Index(_restore(npz[f"{name}.index"], spec.get('index_dtype')), name=spec['index'])
+        columns = pd.Index(npz[f"{name}.columns"], name=spec['columns'])
+        if 'dtypes' not in spec:
+            return pd.DataFrame(npz[f"{name}.values"], index=index, columns=columns)
+        frame = pd.DataFrame(
+            {i: _restore(npz[f"{name}.{i}"], dtype) for i, dtype in enumerate(spec['dtypes'])}, index=index
+        )
+        frame.columns = columns
+        return frame
+    if spec['type'] == 'series':
+        index = pd.Index(_restore(npz[f"{name}.index"], spec.get('index_dtype')), name=spec['index'])
+        return pd.Series(_restore(npz[f"{name}.values"], spec.get('dtype')), index=index, name=spec['name'])
+    if spec['type'] == 'dict':
+        return {k: _unflatten(f"{name}.{i}", npz, meta) for i, k in enumerate(spec['keys'])}
+    return spec['value']
+
+
+def save_artifact(path, result):
+    """
+    Write a job result (dicts of DataFrames, Series and JSON-able values) as
+    one compressed .npz, without pickles. Returns its size in bytes.
+    """
+    arrays, meta = {}, {}
+    _flatten('result', result, arrays, meta)
+    arrays['meta'] = np.array(json.dumps(meta, default=lambda o: o.item() if hasattr(o, 'item') else str(o)))
+    tmp = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+def load_artifact(path):
+    with np.load(path, allow_pickle=False) as npz:
+        return _unflatten('result', npz, json.loads(str(npz['meta'])))
+
+
+def run_job(job_dir, kind, kwargs, progress=None):
+    """
+    Worker: run one job and store its result in job_dir. Returns the
+    artifact size, so the result itself never travels back to the server.
+    """
+    import tasks
+
+    result = getattr(tasks, JOB_KINDS[kind])(**kwargs, progress=progress)
+    return save_artifact(os.path.join(job_dir, ARTIFACT), result)
+
+
+class JobQueue:
+    """
+    Durable queue of long analyses on this machine.
+
+    Jobs are rows of a SQLite database (jobs.sqlite in root) and run on a
+    tasks.TaskPool, at most pool.max_workers at a time; the rest wait in the
+    database. Each job has its own directory holding copies of its input
+    files and its result artifact, so neither depends on the session that
+    submitted it: a user can reload a job by ID after a refresh, and jobs
+    interrupted by a server restart are queued again by start().
+
+    Several server processes can share root. A process runs a job only
+    after claiming it, and renews the claim (owner, heartbeat) every
+    lease / 3 seconds while it runs. Others wait for the job through the
+    database, and take it over only once the lease has expired (its owner
+    died).
+
+    Submitting the same kind and arguments (input files compared by
+    content) against the same source data returns the existing job unless
+    it failed. Finished jobs are deleted ttl seconds after they finish.
+    """
+
+    def __init__(self, pool, root=JOBS_DIR, ttl=JOB_TTL, lease=JOB_LEASE):
+        self.pool = pool
+        self.root = root
+        self.ttl = ttl
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.path = os.path.join(root, 'jobs.sqlite')
+        self._tasks = {}
+        self._events = {}
+        self._listeners = {}
+        self._slots = None
+        os.makedirs(root, exist_ok=True)
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+            # databases created before leases existed
+            columns = {r['name'] for r in db.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (('owner', 'TEXT'), ('heartbeat', 'REAL')):
+                if column not in columns:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            if not db.execute("SELECT 1 FROM sqlite_master WHERE name = 'jobs_live_key'").fetchone():
+                # databases created before keys were unique: only the newest of
+                # each key was reused anyway, the others stay loadable by ID
+                db.execute(
+                    "UPDATE jobs SET key = key || ':' || id WHERE status != 'error' AND created < "
+                    "(SELECT MAX(created) FROM jobs AS newer WHERE newer.key = jobs.key AND newer.status != 'error')"
+                )
+                db.execute("DROP INDEX IF EXISTS jobs_key")
+            # one live (not failed) job per key, so concurrent submits share it
+            db.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_live_key ON jobs (key) WHERE status != 'error'")
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def job_dir(self, job_id):
+        return os.path.join(self.root, job_id)
+
+    def get(self, job_id):
+        """
+        The job's row as a dict (kwargs decoded), or None.
+        """
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['kwargs'] = json.loads(job['kwargs'])
+        return job
+
+    def list(self, limit=50):
+        with self._connect() as db:
+            rows = db.execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(r) for r in rows]
+
+    def counts(self):
+        with self._connect() as db:
+            return dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def _create(self, kind, kwargs, files):
+        from data import SOURCE_PATH
+
+        digests = {name: file_digest(kwargs[name]) for name in files}
+        # like batch.plan: a result is reused only for the same source data and code version
+        inputs = {'source': source_signature(SOURCE_PATH), 'version': SIMILARITY_VERSION}
+        key = hashlib.sha256(
+            json.dumps([kind, {**kwargs, **digests}, inputs], sort_keys=True, default=str).encode()
+        ).hexdigest()
+        live = "SELECT id FROM jobs WHERE key = ? AND status != 'error'"
+        with self._connect() as db:
+            row = db.execute(live, (key,)).fetchone()
+        if row is not None:
+            return row['id']
+
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = self.job_dir(job_id)
+        os.makedirs(job_dir)
+        kwargs = dict(kwargs)
+        for name in files:
+            kwargs[name] = shutil.copy(kwargs[name], os.path.join(job_dir, os.path.basename(kwargs[name])))
+        with self._connect() as db:
+            # another submit of the same job may have got in since the check above
+            db.execute(
+                "INSERT OR IGNORE INTO jobs (id, key, kind, kwargs, status, created) "
+                "VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, key, kind, json.dumps(kwargs), time.time())
+            )
+            existing = db.execute(live, (key,)).fetchone()['id']
+        if existing != job_id:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        return existing
+
+    async def submit(self, kind, kwargs, files=()):
+        """
+        Queue a job: JOB_KINDS[kind](**kwargs). The arguments named in
+        `files` are paths, copied into the job's directory. Returns the job ID.
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind {kind!r}")
+        job_id = await asyncio.to_thread(self._create, kind, kwargs, files)
+        self._schedule(job_id)
+        return job_id
+
+    def _schedule(self, job_id):
+        if job_id not in self._tasks:
+            self._events[job_id] = []
+            self._listeners[job_id] = []
+            self._tasks[job_id] = asyncio.ensure_future(self._run(job_id))
+
+    def _broadcast(self, job_id, event):
+        metrics.record(event)
+        self._events[job_id].append(event)
+        if event['status'] == 'start':
+            self._update(job_id, stage=event['stage'])
+        for listener in list(self._listeners[job_id]):
+            listener(event)
+
+    def _claim(self, job_id):
+        """
+        Take a queued job, or a running one whose lease expired, for this
+        process. Returns whether it is now ours.
+        """
+        now = time.time()
+        with self._connect() as db:
+            claimed = db.execute(
+                "UPDATE jobs SET status = 'running', stage = NULL, owner = ?, heartbeat = ?, started = ? "
+                "WHERE id = ? AND (status = 'queued' OR (status = 'running' AND "
+                "(heartbeat IS NULL OR heartbeat < ?)))",
+                (self.owner, now, now, job_id, now - self.lease)
+            ).rowcount
+        return claimed == 1
+
+    def _claimable(self, job):
+        return job['status'] == 'queued' or (
+            job['heartbeat'] is None or job['heartbeat'] < time.time() - self.lease
+        )
+
+    async def _heartbeat(self, job_id):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            await asyncio.to_thread(self._update, job_id, heartbeat=time.time())
+
+    def _update(self, job_id, **fields):
+        """
+        Update the job's row, as long as this process owns it.
+        """
+        with self._connect() as db:
+            db.execute(
+                f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ? AND owner = ?",
+                (*fields.values(), job_id, self.owner)
+            )
+
+    async def _run(self, job_id):
+        from tasks import QueueFull
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool.max_workers)
+        try:
+            while True:
+                job = self.get(job_id)
+                if job is None or job['status'] not in ('queued', 'running'):
+                    return
+                if not self._claimable(job):
+                    # another process is running it: wait for it through the database
+                    await asyncio.sleep(min(1.0, self.lease / 3))
+                    continue
+                async with self._slots:
+                    if not self._claim(job_id):
+                        continue
+                    heartbeat = asyncio.ensure_future(self._heartbeat(job_id))
+                    try:
+                        while True:
+                            try:
+                                nbytes = await self.pool.run(
+                                    run_job, self.job_dir(job_id), job['kind'], job['kwargs'],
+                                    on_event=lambda event: self._broadcast(job_id, event)
+                                )
+                                break
+                            except QueueFull:
+                                # the pool is busy with interactive work: keep the claim and retry
+                                await asyncio.sleep(1.0)
+                            except Exception as e:
+                                self._update(
+                                    job_id, status='error', error=str(e) or type(e).__name__, finished=time.time()
+                                )
+                                return
+                    finally:
+                        heartbeat.cancel()
+                    self._update(job_id, status='done', stage=None, nbytes=nbytes, finished=time.time())
+                    return
+        finally:
+            del self._tasks[job_id], self._events[job_id], self._listeners[job_id]
+            await asyncio.to_thread(self.cleanup)
+
+    async def wait(self, job_id, on_event=None):
+        """
+        The result of a job, waiting for it if it is queued or running.
+        on_event receives its stage events (replayed from the start).
+        """
+        job = self.get(job_id)
+        if job is None:
+            raise JobNotFound(f"No job {job_id!r} (finished jobs are kept for {self.ttl / 3600:.0f} hours).")
+        if job['status'] in ('queued', 'running'):
+            self._schedule(job_id)
+            if on_event is not None:
+                for event in self._events[job_id]:
+                    on_event(event)
+                self._listeners[job_id].append(on_event)
+            task = self._tasks[job_id]
+            try:
+                # leaving (e.g. the session closed) must not cancel the job
+                await asyncio.shield(task)
+            finally:
+                if on_event is not None and job_id in self._listeners:
+                    self._listeners[job_id].remove(on_event)
+            job = self.get(job_id)
+        if job['status'] == 'error':
+            raise RuntimeError(job['error'])
+        return await asyncio.to_thread(load_artifact, os.path.join(self.job_dir(job_id), ARTIFACT))
+
+    def start(self):
+        """
+        Schedule every queued job and every running job whose owner's lease
+        expired (e.g. left by a previous server), and drop expired jobs.
+        Jobs other live processes are running are left to them. Call from
+        the event loop.
+        """
+        with self._connect() as db:
+            pending = [r['id'] for r in db.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND "
+                "(heartbeat IS NULL OR heartbeat < ?)) ORDER BY created", (time.time() - self.lease,)
+            )]
+        for job_id in pending:
+            self._schedule(job_id)
+        self.cleanup()
+
+    def cleanup(self, max_age=None):
+        """
+        Delete jobs (rows and directories) finished more than max_age
+        (default ttl) seconds ago. Returns how many were deleted.
+        """
+        cutoff = time.time() - (self.ttl if max_age is None else max_age)
+        with self._connect() as db:
+            expired = [r['id'] for r in db.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'error') AND finished < ?", (cutoff,)
+            )]
+            db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+        for job_id in expired:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        return len(expired)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inspect and clean up the local job queue.")
+    parser.add_argument('command', choices=['list', 'show', 'cleanup'])
+    parser.add_argument('job_id', nargs='?')
+    parser.add_argument('--root', default=JOBS_DIR)
+    parser.add_argument('--max-age', type=float, help="cleanup: seconds since finishing (default: CACAIO_JOB_TTL)")
+    args = parser.parse_args()
+
+    queue = JobQueue(pool=None, root=args.root)
+    if args.command == 'list':
+        for job in queue.list():
+            created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job['created']))
+            print(f"{job['id']}  {job['kind']:<12} {job['status']:<8} {created}  {job['stage'] or job['error'] or ''}")
+    elif args.command == 'show':
+        job = queue.get(args.job_id)
+        if job is None:
+            raise SystemExit(f"no job {args.job_id}")
+        print(json.dumps(job, indent=1))
+        path = os.path.join(queue.job_dir(args.job_id), ARTIFACT)
+        if job['status'] == 'done' and os.path.exists(path):
+            for name, value in load_artifact(path).items():
+                print(f"{name}: {getattr(value, 'shape', type(value).__name__)}")
+    else:
+        print(f"deleted {queue.cleanup(args.max_age)} jobs")
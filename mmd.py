@@ -0,0 +1,230 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+
+
+N_FEATURES = int(os.environ.get('CACAIO_MMD_FEATURES', 1024))
+TIME_BUDGET = float(os.environ.get('CACAIO_MMD_BUDGET', 10.0))
+MIN_CELLS = 50
+CHUNK_CELLS = 8192
+
+
+def median_bandwidth(pcs, n=1000, seed=0):
+    """
+    Median pairwise distance between n random cells (the usual kernel
+    bandwidth heuristic).
+    """
+    rng = np.random.default_rng(seed)
+    X = np.asarray(pcs[np.sort(rng.choice(len(pcs), min(n, len(pcs)), replace=False))], dtype=np.float64)
+    sq = np.einsum('ij,ij->i', X, X)
+    d2 = sq[:, None] + sq[None, :] - 2 * X @ X.T
+    d = np.sqrt(np.clip(d2[np.triu_indices(len(X), 1)], 0, None))
+    return float(np.median(d)) if len(d) else 1.0
+
+
+class RandomFourierFeatures:
+    """
+    Random Fourier features of the Gaussian kernel
+    k(x, y) = exp(-|x - y|^2 / (2 bandwidth^2)): feature dot products
+    approximate k, so a sample's mean feature vector approximates its kernel
+    mean embedding.
+    """
+
+    def __init__(self, n_pcs, n_features=N_FEATURES, bandwidth=1.0, seed=0):
+        rng = np.random.default_rng(seed)
+        self.W = rng.normal(scale=1.0 / bandwidth, size=(n_pcs, n_features)).astype(np.float32)
+        self.b = rng.uniform(0, 2 * np.pi, size=n_features).astype(np.float32)
+        self.scale = np.float32(np.sqrt(2.0 / n_features))
+
+    def transform(self, X):
+        Z = np.asarray(X, dtype=np.float32) @ self.W
+        Z += self.b
+        np.cos(Z, out=Z)
+        Z *= self.scale
+        return Z
+
+    def mean(self, X, chunk_cells=CHUNK_CELLS):
+        out = np.zeros(self.W.shape[1])
+        for start in range(0, len(X), chunk_cells):
+            out += self.transform(X[start:start + chunk_cells]).sum(axis=0, dtype=np.float64)
+        return out / max(1, len(X))
+
+
+def stratified_rows(emb, max_cells, seed=0):
+    """
+    At most max_cells random cells of every sample of an embedding.Embedding.
+
+    Returns:
+        (rows, offsets): sorted row positions into emb.pcs, grouped by sample,
+        and the offsets of each sample's rows (like emb.offsets).
+    """
+    rng = np.random.default_rng(seed)
+    parts = []
+    for i, count in enumerate(emb.counts):
+        if count > max_cells:
+            parts.append(emb.offsets[i] + np.sort(rng.choice(count, max_cells, replace=False)))
+        else:
+            parts.append(np.arange(emb.offsets[i], emb.offsets[i + 1]))
+    counts = np.array([len(p) for p in parts])
+    return np.concatenate(parts), np.concatenate([[0], np.cumsum(counts)])
+
+
+def cells_within_budget(emb, n_features=N_FEATURES, budget=TIME_BUDGET, probe=4096):
+    """
+    Largest per-sample cell cap whose sketch fits in `budget` seconds, from
+    a timed probe of the feature map on this machine (at least MIN_CELLS).
+    """
+    features = RandomFourierFeatures(emb.pcs.shape[1], n_features)
+    X = emb.pcs[:min(probe, len(emb))]
+    start = time.perf_counter()
+    features.mean(X)
+    per_cell = (time.perf_counter() - start) / max(1, len(X))
+    affordable = 0.9 * budget / max(per_cell, 1e-12)
+
+    counts = np.sort(emb.counts)
+    if counts.sum() <= affordable:
+        return int(counts[-1]) if len(counts) else MIN_CELLS
+    # water-filling: the cap c with sum(min(count, c)) == affordable
+    below = np.cumsum(counts)
+    for k, count in enumerate(counts):
+        cap = (affordable - (below[k - 1] if k else 0)) / (len(counts) - k)
+        if cap <= count:
+            return max(MIN_CELLS, int(cap))
+    return int(counts[-1])
+
+
+def mean_embeddings(emb, n_features=N_FEATURES, max_cells=None, bandwidth=None, seed=0):
+    """
+    Approximate kernel mean embedding of every sample (samples × n_features)
+    from at most max_cells cells each.
+    """
+    if bandwidth is None:
+        bandwidth = median_bandwidth(emb.pcs, seed=seed)
+    features = RandomFourierFeatures(emb.pcs.shape[1], n_features, bandwidth, seed)
+    rows, offsets = stratified_rows(emb, max_cells or int(emb.counts.max()), seed)
+    pcs = emb.pcs[rows]
+    means = np.vstack([features.mean(pcs[offsets[i]:offsets[i + 1]]) for i in range(emb.n_samples)])
+    return means, bandwidth
+
+
+def mmd_from_means(M_x, M_y):
+    """
+    MMD between every pair of rows of two mean-embedding matrices.
+    """
+    sq = np.einsum('ij,ij->i', M_x, M_x)[:, None] + np.einsum('ij,ij->i', M_y, M_y)[None, :] - 2 * M_x @ M_y.T
+    return np.sqrt(np.clip(sq, 0.0, None))
+
+
+def cell_mmd_matrix(emb, n_features=N_FEATURES, budget=TIME_BUDGET, max_cells=None, bandwidth=None, seed=0,
+                    progress=None):
+    """
+    CCLE × tumor maximum mean discrepancy between the cell distributions of
+    every pair of samples (Gaussian kernel, median-heuristic bandwidth).
+
+    Every sample is sketched once: at most max_cells of its cells (by
+    default the largest cap that fits `budget` seconds on this machine) are
+    mapped to n_features random Fourier features and averaged. All pairs
+    then come out of one matrix product, so the cost is linear in the
+    number of cells kept rather than quadratic in the cells compared.
+
+    Args:
+        emb: embedding.Embedding of the dataset.
+
+    Returns:
+        (mmd_df, info): the matrix (lower is more similar) and the sketch
+        parameters {'bandwidth', 'max_cells', 'n_features'}.
+    """
+    with stage(progress, 'cell_sketch'):
+        if max_cells is None:
+            max_cells = cells_within_budget(emb, n_features, budget)
+        means, bandwidth = mean_embeddings(emb, n_features, max_cells, bandwidth, seed)
+
+    with stage(progress, 'mmd'):
+        ccle = emb.is_cell_line
+        if not ccle.any() or ccle.all():
+            raise ValueError("No CCLE or Tumor samples found with given criteria.")
+        mmd_df = pd.DataFrame(
+            mmd_from_means(means[ccle], means[~ccle]),
+            index=emb.samples[ccle],
+            columns=emb.samples[~ccle],
+            dtype=float
+        )
+    return mmd_df, {'bandwidth': bandwidth, 'max_cells': int(max_cells), 'n_features': n_features}
+
+
+def exact_mmd(X, Y, bandwidth):
+    """
+    Exact (biased, V-statistic) Gaussian-kernel MMD between two cell sets.
+    """
+    def mean_kernel(A, B):
+        sq = np.einsum('ij,ij->i', A, A)[:, None] + np.einsum('ij,ij->i', B, B)[None, :] - 2 * A @ B.T
+        return np.exp(-np.clip(sq, 0, None) / (2 * bandwidth ** 2)).mean()
+
+    X = np.asarray(X, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    return float(np.sqrt(max(0.0, mean_kernel(X, X) + mean_kernel(Y, Y) - 2 * mean_kernel(X, Y))))
+
+
+def approximation_error(emb, mmd_df, bandwidth, n_pairs=20, max_exact_cells=2000, seed=0):
+    """
+    Sketched vs exact MMD on up to n_pairs random CCLE × tumor pairs whose
+    samples both have at most max_exact_cells cells (exact MMD is quadratic).
+
+    Returns:
+        DataFrame with CCLE, Primary Tumor, Exact_MMD, Approx_MMD, Abs_Error
+        and Rel_Error per pair.
+    """
+    small = set(emb.samples[emb.counts <= max_exact_cells])
+    pairs = [(c, t) for c in mmd_df.index if c in small for t in mmd_df.columns if t in small]
+    rng = np.random.default_rng(seed)
+    if len(pairs) > n_pairs:
+        pairs = [pairs[i] for i in np.sort(rng.choice(len(pairs), n_pairs, replace=False))]
+
+    exact = np.array([exact_mmd(emb.cells(c), emb.cells(t), bandwidth) for c, t in pairs])
+    approx = np.array([mmd_df.loc[c, t] for c, t in pairs])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = np.abs(approx - exact) / exact
+    return pd.DataFrame({
+        'CCLE': [c for c, _ in pairs],
+        'Primary Tumor': [t for _, t in pairs],
+        'Exact_MMD': exact,
+        'Approx_MMD': approx,
+        'Abs_Error': np.abs(approx - exact),
+        'Rel_Error': relative
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cell-level MMD of a dataset, with its error against exact MMD.")
+    parser.add_argument('dataset', nargs='?', help="dataset name (default: the first one)")
+    parser.add_argument('--key', default='df_pca_harmony')
+    parser.add_argument('--features', type=int, default=N_FEATURES)
+    parser.add_argument('--budget', type=float, default=TIME_BUDGET, help="seconds for the sketch")
+    parser.add_argument('--max-cells', type=int, help="cells per sample (default: fit the budget)")
+    parser.add_argument('--pairs', type=int, default=20, help="pairs checked against exact MMD")
+    parser.add_argument('--max-exact-cells', type=int, default=2000)
+    args = parser.parse_args()
+
+    from data import sc_samples
+    from embedding import Embedding
+
+    name = args.dataset or next(iter(sc_samples))
+    emb = Embedding.from_frame(sc_samples[name][args.key])
+    start = time.perf_counter()
+    mmd_df, info = cell_mmd_matrix(emb, args.features, args.budget, args.max_cells)
+    print(f"{name}: {mmd_df.shape[0]} × {mmd_df.shape[1]} pairs from {len(emb)} cells in "
+          f"{time.perf_counter() - start:.2f}s (max {info['max_cells']} cells per sample, "
+          f"bandwidth {info['bandwidth']:.3f})")
+
+    report = approximation_error(emb, mmd_df, info['bandwidth'], args.pairs, args.max_exact_cells)
+    if len(report):
+        print(report.to_string(index=False, float_format='%.4f'))
+        print(f"mean absolute error {report['Abs_Error'].mean():.4f}, "
+              f"mean relative error {report['Rel_Error'].mean():.2%}")
+    else:
+        print(f"no pairs with at most {args.max_exact_cells} cells per sample to check")
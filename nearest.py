@@ -0,0 +1,167 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from similarity import _double_centered_distances, _distance_correlation_from_centered
+
+
+class CentroidIndex:
+    """
+    Top-k distance correlation queries between sample centroids.
+
+    The squared distance correlation of two centroids is the cosine between
+    their flattened double-centered distance matrices ("signatures"). The
+    index keeps one unit-length signature per centroid: in full (float32)
+    when n_components is None, otherwise projected onto its leading
+    n_components principal directions. A query ranks every candidate by
+    signature dot product, keeps a shortlist, and runs exact distance
+    correlation on the shortlist only.
+
+    By default a cell line is matched against tumors and a tumor against
+    cell lines, as in the CCLE × tumor matrix.
+    """
+
+    def __init__(self, centroids: pd.DataFrame, groups: pd.Series, n_components=128, seed=0, chunk_size=256):
+        self.centroids = centroids
+        self.values = np.ascontiguousarray(centroids.to_numpy(dtype=np.float64))
+        self.groups = groups.reindex(centroids.index).to_numpy()
+        self._pos = {s: i for i, s in enumerate(centroids.index)}
+
+        signatures = np.vstack([
+            self._signatures(self.values[start:start + chunk_size])
+            for start in range(0, len(self.values), chunk_size)
+        ]) if len(self.values) else np.zeros((0, self.values.shape[1] ** 2), dtype=np.float32)
+
+        self.basis = None
+        if n_components is not None and n_components < min(signatures.shape):
+            from sklearn.utils.extmath import randomized_svd
+
+            _, _, vt = randomized_svd(signatures, n_components, random_state=seed)
+            self.basis = np.ascontiguousarray(vt.T, dtype=np.float32)
+            signatures = signatures @ self.basis
+        self.sketch = np.ascontiguousarray(signatures, dtype=np.float32)
+        self.n_components = self.sketch.shape[1]
+
+    @staticmethod
+    def _signatures(X):
+        A = _double_centered_distances(X)
+        norms = np.linalg.norm(A, axis=1, keepdims=True)
+        np.divide(A, norms, out=A, where=norms > 0)
+        return A.astype(np.float32)
+
+    @classmethod
+    def from_store(cls, store, **kwargs):
+        """
+        Index of a CentroidStore (or embedding.Embedding) of cell lines and tumors.
+        """
+        groups = store.sample_to_dataset().eq('CCLE').map({True: 'cell_line', False: 'primary_tumor'})
+        return cls(store.centroids(), groups, **kwargs)
+
+    def _query_vector(self, sample):
+        if isinstance(sample, str) or np.isscalar(sample):
+            i = self._pos[sample]
+            return self.values[i], self.groups[i], i
+        return np.asarray(sample, dtype=np.float64), None, None
+
+    def _candidates(self, group, against, exclude):
+        if against is None:
+            against = 'primary_tumor' if group == 'cell_line' else 'cell_line' if group else None
+        mask = np.ones(len(self.values), dtype=bool) if against in (None, 'all') else self.groups == against
+        if exclude is not None:
+            mask[exclude] = False
+        return np.flatnonzero(mask)
+
+    def _exact(self, x, rows):
+        return _distance_correlation_from_centered(
+            _double_centered_distances(x[None, :]), _double_centered_distances(self.values[rows])
+        )[0]
+
+    def query(self, sample, k=10, against=None, shortlist=None):
+        """
+        The k centroids with the highest distance correlation to `sample`.
+
+        Args:
+            sample: a sample in the index, or a PC vector.
+            k: number of matches.
+            against: 'cell_line', 'primary_tumor' or 'all' (default: the
+                other group of `sample`; all for a vector).
+            shortlist: candidates scored exactly (default max(4k, 50)).
+
+        Returns:
+            DataFrame with Match, Distance_Correlation and Rank, best first.
+        """
+        x, group, own = self._query_vector(sample)
+        rows = self._candidates(group, against, own)
+
+        shortlist = shortlist or max(4 * k, 50)
+        if shortlist < len(rows):
+            if own is not None:
+                q = self.sketch[own]
+            else:
+                q = self._signatures(x[None, :])[0]
+                q = q @ self.basis if self.basis is not None else q
+            approx = self.sketch[rows] @ q
+            rows = rows[np.argpartition(-approx, shortlist - 1)[:shortlist]]
+
+        scores = self._exact(x, rows)
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k] if k else np.array([], dtype=np.int64)
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return pd.DataFrame({
+            'Match': self.centroids.index[rows[top]],
+            'Distance_Correlation': scores[top],
+            'Rank': np.arange(1, len(top) + 1)
+        })
+
+    def brute_force(self, sample, k=10, against=None):
+        """
+        Same as query() with every candidate scored exactly.
+        """
+        x, group, own = self._query_vector(sample)
+        rows = self._candidates(group, against, own)
+        scores = self._exact(x, rows)
+        top = np.argsort(-scores, kind='stable')[:k]
+        return pd.DataFrame({
+            'Match': self.centroids.index[rows[top]],
+            'Distance_Correlation': scores[top],
+            'Rank': np.arange(1, len(top) + 1)
+        })
+
+    def recall(self, samples=None, k=10, shortlist=None):
+        """
+        Mean recall@k of query() against brute_force() over `samples` (default: all).
+        """
+        samples = self.centroids.index if samples is None else samples
+        hits = []
+        for s in samples:
+            truth = set(self.brute_force(s, k)['Match'])
+            if truth:
+                hits.append(len(truth & set(self.query(s, k, shortlist=shortlist)['Match'])) / len(truth))
+        return float(np.mean(hits)) if hits else 1.0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check top-k recall and latency of the centroid index on a dataset.")
+    parser.add_argument('dataset', nargs='?', help="dataset name (default: the first one)")
+    parser.add_argument('--key', default='df_pca_harmony')
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--components', type=int, default=128, help="sketch size; 0 keeps full signatures")
+    parser.add_argument('--shortlist', type=int)
+    args = parser.parse_args()
+
+    from data import sc_samples
+    from embedding import Embedding
+
+    name = args.dataset or next(iter(sc_samples))
+    emb = Embedding.from_frame(sc_samples[name][args.key])
+    start = time.perf_counter()
+    index = CentroidIndex.from_store(emb, n_components=args.components or None)
+    print(f"{name}: {emb.n_samples} samples indexed in {time.perf_counter() - start:.3f}s")
+
+    start = time.perf_counter()
+    for s in index.centroids.index:
+        index.query(s, args.k, shortlist=args.shortlist)
+    per_query = (time.perf_counter() - start) / max(1, emb.n_samples)
+    print(f"query: {per_query * 1e3:.2f} ms, recall@{args.k}: {index.recall(k=args.k, shortlist=args.shortlist):.3f}")
@@ -0,0 +1,140 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def _cosine_normalize(Z):
+    return Z / np.linalg.norm(Z, axis=1, keepdims=True)
+
+
+class HarmonyReference:
+    """
+    Frozen Harmony reference built from one dataset's pseudo-bulk centroids.
+
+    fit() runs Harmony once on the centroids and keeps what is needed to map
+    new samples without refitting (as in Symphony): the cluster centroids Y,
+    the soft cluster sizes Nr and the per-cluster sums C of the reference
+    embedding. map() assigns query samples to the frozen clusters and removes
+    each sample's offset with the same per-cluster ridge regression Harmony
+    uses, solved in closed form for all clusters and samples at once. The
+    reference itself is never changed, so repeated uploads against it give
+    consistent embeddings and the cost depends only on the number of query
+    samples.
+
+    The reference is a single batch, so Harmony leaves it where it is (Z_ref
+    equals the centroids); what fit() learns are the clusters.
+    """
+
+    def __init__(self, Y, Nr, C, sigma, Z_ref, index, lamb=1.0):
+        self.Y = Y
+        self.Nr = Nr
+        self.C = C
+        self.sigma = sigma
+        self.Z_ref = Z_ref
+        self.index = pd.Index(index)
+        self.lamb = lamb
+
+    @classmethod
+    def fit(cls, pseudo_centroids: pd.DataFrame, sigma=0.2, nclust=None, lamb=1.0):
+        import harmonypy as hm
+
+        nclust = nclust or pseudo_centroids.shape[0]
+        meta = pd.DataFrame({'batch': ['scRNA'] * len(pseudo_centroids)}, index=pseudo_centroids.index)
+        ho = hm.run_harmony(
+            pseudo_centroids.values,
+            meta,
+            vars_use='batch',
+            theta=0.0,
+            lamb=lamb,
+            sigma=np.full((nclust,), sigma),
+            nclust=nclust,
+            verbose=False
+        )
+        Z_ref = np.asarray(ho.Z_corr.T)
+        R = np.asarray(ho.R)
+        return cls(
+            Y=np.asarray(ho.Y),
+            Nr=R.sum(axis=1),
+            C=R @ Z_ref,
+            sigma=np.full((nclust,), float(sigma)),
+            Z_ref=Z_ref,
+            index=pseudo_centroids.index,
+            lamb=lamb
+        )
+
+    def soft_clusters(self, Z):
+        """
+        Soft assignment (clusters × samples) of Z to the frozen cluster centroids.
+        """
+        dist = 2 * (1 - self.Y.T @ _cosine_normalize(Z).T)
+        R = -dist / self.sigma[:, None]
+        R -= R.max(axis=0, keepdims=True)
+        R = np.exp(R)
+        return R / R.sum(axis=0, keepdims=True)
+
+    def map(self, Z):
+        """
+        Correct query samples Z (samples × PCs) into the reference space.
+
+        Each sample is its own query batch, so a sample maps to the same
+        place whether it is uploaded alone or with others.
+        """
+        Z = np.asarray(Z, dtype=np.float64)
+        R = self.soft_clusters(Z)
+
+        # Per cluster and sample: design [intercept, sample], reference in the
+        # intercept only, ridge penalty on the sample term. The 2 × 2 system
+        # solves to a sample coefficient r * (Nr * z - C) / det.
+        Nr = self.Nr[:, None]
+        det = Nr * R + Nr * self.lamb + R * self.lamb
+        coef = R * R / det
+        return Z - (coef.T @ self.Nr)[:, None] * Z + coef.T @ self.C
+
+    def reference_embedding(self, columns=None):
+        return pd.DataFrame(self.Z_ref, index=self.index, columns=columns)
+
+    def save(self, path):
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp, Y=self.Y, Nr=self.Nr, C=self.C, sigma=self.sigma, Z_ref=self.Z_ref,
+            index=np.asarray(self.index.astype(str), dtype=str), lamb=np.array(self.lamb)
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as npz:
+            return cls(
+                Y=npz['Y'], Nr=npz['Nr'], C=npz['C'], sigma=npz['sigma'], Z_ref=npz['Z_ref'],
+                index=npz['index'], lamb=float(npz['lamb'])
+            )
+
+
+def reference_key(pseudo_centroids, sigma, nclust=None):
+    """
+    Content hash of the centroids plus fit parameters.
+    """
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(pseudo_centroids.to_numpy(dtype=np.float64)).tobytes())
+    h.update(pd.util.hash_array(np.asarray(pseudo_centroids.index.astype(str), dtype=object)).tobytes())
+    h.update(repr((float(sigma), nclust)).encode())
+    return h.hexdigest()
+
+
+def load_or_fit(pseudo_centroids, sigma=0.2, nclust=None, root=None):
+    """
+    Frozen reference for these centroids, read from root/<key>.npz if it was
+    fitted before, otherwise fitted now and saved there.
+    """
+    from cache import CACHE_DIR
+
+    root = os.path.join(root or CACHE_DIR, 'references')
+    path = os.path.join(root, f"{reference_key(pseudo_centroids, sigma, nclust)}.npz")
+    if os.path.exists(path):
+        return HarmonyReference.load(path)
+    os.makedirs(root, exist_ok=True)
+    ref = HarmonyReference.fit(pseudo_centroids, sigma=sigma, nclust=nclust)
+    ref.save(path)
+    return ref
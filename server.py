@@ -1,84 +1,299 @@
 from shiny import Inputs, Outputs, Session, reactive, render, ui
 import asyncio
-import pandas as pd
-from io import StringIO
 from functions import (
-    compare_centroids_distance_correlation_from_df,
-    plot_correlation_heatmap,
-    convert_to_long_format,
-    run_enrichment_analysis,
     create_horizontal_barplot,
     plot_top_combinations,
-    compute_distance_correlation_matrix,
-    cross_modal_harmony_embeddings_from_df,
-    convert_cross_modal_to_long,
+)
+from data import load as load_data
+from tasks import shared, similarity_job, enrichment_job, samples_job, matches_job
+from instrumentation import metrics, stage
+from heatmap import cached_heatmap_async, data_uri
+from views import SIMILARITY_METRICS, ResultView
+from exports import export_filename, export_media_type, iter_export
 
 
-)
-from data import sc_samples, degs
+STAGE_LABELS = {
+    'cache_lookup': "Looking up cached results",
+    'centroids': "Computing sample centroids",
+    'distance_correlation': "Calculating distance correlations",
+    'similarity': "Calculating similarities",
+    'enrichment': "Running enrichment analysis",
+    'projection': "Reading and projecting bulk samples",
+    'harmony': "Running Harmony integration",
+    'permutation_test': "Running permutation tests",
+    'cell_sketch': "Sketching cell distributions",
+    'mmd': "Comparing cell distributions",
+    'bootstrap': "Bootstrapping cells within samples",
+}
+
+# Long analyses that should outlive the session (see jobs.py). Built by
+# app.py's lifespan, so importing this module creates no files.
+jobs = None
+
+
+def use_jobs(queue):
+    global jobs
+    jobs = queue
+    metrics.gauges['cacaio_jobs_active'] = lambda: len(queue._tasks)
+
+
+def progress_reporter(p, n_stages):
+    """
+    Turn stage events from a job into progress bar updates. (Timings are
+    recorded once per computation by tasks.SingleFlight.)
+    """
+    finished = []
+
+    def on_event(event):
+        label = STAGE_LABELS.get(event['stage'], event['stage'])
+        if event['status'] == 'start':
+            p.set(min(len(finished), n_stages), message=label, detail="Running...")
+        else:
+            finished.append(event['stage'])
+            p.set(min(len(finished), n_stages), message=label, detail=f"Done in {event['elapsed']:.2f}s")
+
+    return on_event
+
+
+def significance_columns(result, pvalue_col):
+    """
+    Extra ResultView columns for a job result's p-value and FDR matrices and
+    bootstrap statistics, if any.
+    """
+    columns = {}
+    if result.get('pvalues') is not None:
+        columns.update({pvalue_col: result['pvalues'], 'FDR': result['fdr']})
+    columns.update(result.get('bootstrap') or {})
+    return columns or None
+
+
+def serve_table(input, output, id, view, key_cols=(), search=False):
+    """
+    Serve one page of `view()` (a ResultView) to the result_table `id`.
+
+    Filtering, sorting and paging happen here; only the visible rows are
+    sent to the browser.
+    """
+
+    @reactive.Effect
+    def _():
+        v = view()
+        if v is not None:
+            with reactive.isolate():
+                sort = input[f"{id}_sort"]()
+            ui.update_select(f"{id}_sort", choices=v.columns, selected=sort if sort in v.columns else v.sort_col)
+            if sort not in v.columns:
+                ui.update_checkbox(f"{id}_descending", value=not v.ascending)
+        for i, col in enumerate(key_cols):
+            choices = [""] + (v.choices(col) if v is not None else [])
+            ui.update_selectize(f"{id}_filter_{i}", choices=choices, selected="", server=True)
+        ui.update_numeric(f"{id}_page", value=1)
+
+    @reactive.Calc
+    def current_page():
+        v = view()
+        if v is None:
+            return None
+        page_size = int(input[f"{id}_page_size"]())
+        sort = input[f"{id}_sort"]()
+        rows, total = v.page(
+            page=(input[f"{id}_page"]() or 1) - 1,
+            page_size=page_size,
+            filters={col: input[f"{id}_filter_{i}"]() for i, col in enumerate(key_cols)},
+            search=input[f"{id}_search"]() if search else None,
+            # the sort select may still list the previous view's columns
+            sort=sort if sort in v.columns else None,
+            descending=input[f"{id}_descending"]() if sort in v.columns else None
+        )
+        start = min(max(0, (input[f"{id}_page"]() or 1) - 1), max(0, total - 1) // page_size) * page_size
+        return rows, total, start
+
+    @output(id=id)
+    @render.data_frame
+    def _table():
+        page = current_page()
+        if page is None:
+            return None
+        return render.DataTable(page[0].round(5), width="100%", height="400px")
+
+    @output(id=f"{id}_info")
+    @render.text
+    def _info():
+        page = current_page()
+        if page is None:
+            return ""
+        rows, total, start = page
+        if total == 0:
+            return "No matching rows"
+        return f"Rows {start + 1}–{start + len(rows)} of {total}"
 
 
 def server(input, output, session):
-    
-    processed_data = reactive.Value(None)
-    
+
+    @reactive.extended_task
+    async def data_task():
+        # the UI is served before the datasets are loaded (see app.py)
+        return await asyncio.to_thread(load_data)
+
+    data_task()
+
+    @reactive.Effect
+    def _():
+        loaded = data_task.result()
+        datasets = list(loaded['sc_samples'].keys())
+        for id in ("dataset_choice", "cross_modal_cancer"):
+            ui.update_select(id, choices=datasets, selected=datasets[0] if datasets else None)
+        degs = list(loaded['degs'].keys())
+        ui.update_select("degs_choice", choices=degs, selected=degs[0] if degs else None)
+        libraries = list(loaded['libraries'])
+        ui.update_select("library_choice", choices=libraries, selected=libraries[0] if libraries else None)
+
+    @reactive.extended_task
+    async def similarity_task(dataset, significance, metric, bootstrap):
+        centroids = metric.startswith('distance_correlation')
+        n_stages = 3 + (2 if significance and centroids else 0) + (2 if bootstrap and centroids else 0)
+        with ui.Progress(min=0, max=n_stages, session=session) as p:
+            p.set(0, message="Calculation in progress", detail="Waiting for a free worker...")
+            return await shared.run(
+                similarity_job, dataset, significance, metric, bootstrap, on_event=progress_reporter(p, n_stages)
+            )
+
+    @reactive.extended_task
+    async def enrichment_task(gene_list, libraries):
+        with ui.Progress(min=0, max=1, session=session) as p:
+            p.set(0, message="Running enrichment analysis...", detail="Waiting for a free worker...")
+            return await shared.run(enrichment_job, gene_list, libraries, on_event=progress_reporter(p, 1))
+
+    @reactive.extended_task
+    async def cross_modal_task(job_id, submit=None):
+        # runs as a durable job: the user can reload it by ID after a refresh
+        job = jobs.get(job_id) if submit is None else None
+        kwargs = submit if submit is not None else job['kwargs'] if job else {}
+        significance = kwargs.get('significance') and kwargs.get('metric', 'distance_correlation').startswith(
+            'distance_correlation'
+        )
+        n_stages = 5 if significance else 4
+        with ui.Progress(min=0, max=n_stages, session=session) as p:
+            if submit is not None:
+                p.set(0, message="Processing cross-modal integration...", detail="Submitting job...")
+                job_id = await jobs.submit('cross_modal', submit, files=('bulk_path',))
+                ui.update_text("job_id", value=job_id, session=session)
+            p.set(0, message=f"Cross-modal job {job_id}", detail="Waiting for a free worker...")
+            result = await jobs.wait(job_id, on_event=progress_reporter(p, n_stages))
+            return {**result, 'job_id': job_id}
+
+    @reactive.extended_task
+    async def samples_task(dataset):
+        return await shared.run(samples_job, dataset)
+
+    @reactive.extended_task
+    async def matches_task(dataset, sample, k):
+        return await shared.run(matches_job, dataset, sample, k)
+
+    tasks = (data_task, similarity_task, enrichment_task, cross_modal_task, samples_task, matches_task)
+
+    @session.on_ended
+    def _():
+        for task in tasks:
+            task.cancel()
+
+    def notify_errors(task):
+        @reactive.Effect
+        def _():
+            if task.status() == "error":
+                ui.notification_show(str(task.error.get()), type="error", duration=8)
+
+    for task in tasks:
+        notify_errors(task)
+
     @reactive.Effect
     @reactive.event(input.run_analysis)
     def _():
         if not input.dataset_choice():
             return None
-        
-        with ui.Progress(min=1, max=15) as p:
-            p.set(message="Calculation in progress", detail="This may take a while...")
-            
-            for i in range(1, 15):
-                p.set(i, message="Processing...")
-                reactive.flush()
-                
-            selected_data = sc_samples[input.dataset_choice()]['df_pca_harmony']
-            centroid_df, best_match = compare_centroids_distance_correlation_from_df(selected_data)
-            processed_data.set(centroid_df)
+
+        similarity_task.cancel()
+        similarity_task(
+            input.dataset_choice(), input.similarity_pvalues(), input.similarity_metric(), input.similarity_bootstrap()
+        )
+
+    @reactive.Calc
+    def similarity_results():
+        return similarity_task.result()
+
+    @reactive.Effect
+    @reactive.event(input.dataset_choice)
+    def _():
+        if input.dataset_choice():
+            samples_task.cancel()
+            samples_task(input.dataset_choice())
+
+    @reactive.Effect
+    def _():
+        groups = samples_task.result()
+        choices = {"": ""}
+        choices.update({
+            "Cell lines": {s: s for s in groups['cell_line']},
+            "Primary tumors": {s: s for s in groups['primary_tumor']},
+        })
+        ui.update_selectize("match_sample", choices=choices, selected="", server=True)
+
+    @reactive.Effect
+    @reactive.event(input.match_sample, input.match_k)
+    def _():
+        if not input.dataset_choice() or not input.match_sample():
+            return None
+        matches_task.cancel()
+        matches_task(input.dataset_choice(), input.match_sample(), int(input.match_k() or 10))
 
     @output
     @render.data_frame
-    def results_table():
-        data = processed_data()
-        if data is not None:
-            long_data = convert_to_long_format(data)
-            return render.DataTable(
-                long_data.round(5),
-                filters=True,
-                width="100%",
-                height="400px"
-            )
-        return None
+    def matches_table():
+        return render.DataTable(matches_task.result().round(5), width="100%")
+
+    @reactive.Calc
+    def results_view():
+        data = similarity_results()
+        if data is None:
+            return None
+        label, ascending = SIMILARITY_METRICS[data['metric']]
+        return ResultView.from_matrix(
+            data['matrix'], 'CCLE', 'Primary Tumor', label,
+            extra=significance_columns(data, 'P-value'), ascending=ascending
+        )
+
+    serve_table(input, output, "results_table", results_view, key_cols=["CCLE", "Primary Tumor"])
 
     @output
-    @render.plot
-    def heatmap_plot():
-        data = processed_data()
+    @render.ui
+    async def heatmap_plot():
+        data = similarity_results()
         if data is not None:
-            return plot_correlation_heatmap(data)
+            label, ascending = SIMILARITY_METRICS[data['metric']]
+            with stage(metrics.record, 'heatmap_plot'):
+                png = await cached_heatmap_async(
+                    shared.run, data['matrix'], cluster=input.heatmap_cluster(), label=label,
+                    cmap='rocket_r' if ascending else 'rocket'
+                )
+            return ui.img(src=data_uri(png), style="width: 100%; height: 100%; object-fit: contain;")
         return None
 
     @render.download(
-        filename=lambda: f"similarity_analysis_{input.dataset_choice() or 'data'}.csv"
+        filename=lambda: export_filename(
+            f"similarity_analysis_{input.dataset_choice() or 'data'}", input.download_table_format()
+        ),
+        media_type=lambda: export_media_type(input.download_table_format())
     )
     def download_table():
-        data = processed_data()
-        if data is not None:
-            long_data = convert_to_long_format(data)
-            csv_buffer = StringIO()
-            long_data.to_csv(csv_buffer, index=False)
-            csv_buffer.seek(0)
-            
-            yield csv_buffer.getvalue()
-    enrichment_results = reactive.Value(None)
+        view = results_view()
+        if view is not None:
+            yield from iter_export(view.frame, input.download_table_format())
 
     @reactive.Effect
     @reactive.event(input.degs_choice)
     def _():
-        if input.degs_choice() and input.degs_choice() in degs:
+        degs = load_data('degs') if input.degs_choice() else {}
+        if input.degs_choice() in degs:
             contrasts = list(degs[input.degs_choice()].keys())
             ui.update_selectize(
                 "contrast_choice",
@@ -92,111 +307,102 @@ def server(input, output, session):
             not input.contrast_choice() or 
             not input.library_choice()):
             return None
-        
-        with ui.Progress(min=1, max=10) as p:
-            p.set(message="Running enrichment analysis...", detail="This may take a while...")
-            
-            for i in range(1, 10):
-                p.set(i, message="Processing...")
-                reactive.flush()
-            
-            gene_list = degs[input.degs_choice()][input.contrast_choice()]['gene']
-            
-            results = run_enrichment_analysis(
-                gene_list=gene_list,
-                libraries=input.library_choice(),
-                organism='human'
-            )
-            
-            enrichment_results.set(results)
 
-    @output
-    @render.data_frame
-    def enrichment_table():
+        gene_list = list(load_data('degs')[input.degs_choice()][input.contrast_choice()]['gene'])
+
+        enrichment_task.cancel()
+        enrichment_task(gene_list, input.library_choice())
+
+    @reactive.Calc
+    def enrichment_results():
+        return enrichment_task.result()
+
+    @reactive.Calc
+    def enrichment_view():
         data = enrichment_results()
-        if data is not None:
-            return render.DataTable(
-                data.round(5),
-                filters=True,
-                width="100%",
-                height="400px"
-            )
-        return None
+        if data is None:
+            return None
+        return ResultView(data, 'Adjusted P-value', search_cols=['Term'], ascending=True)
+
+    serve_table(input, output, "enrichment_table", enrichment_view, search=True)
 
     @output
     @render.plot
     def enrichment_plot():
         data = enrichment_results()
         if data is not None:
-            return create_horizontal_barplot(data)
+            return create_horizontal_barplot(data, progress=metrics.record)
         return None
 
     @render.download(
-        filename=lambda: f"enrichment_analysis_{input.degs_choice()}_{input.contrast_choice()}.csv"
+        filename=lambda: export_filename(
+            f"enrichment_analysis_{input.degs_choice()}_{input.contrast_choice()}", input.download_enrichment_format()
+        ),
+        media_type=lambda: export_media_type(input.download_enrichment_format())
     )
     def download_enrichment():
         data = enrichment_results()
         if data is not None:
-            csv_buffer = StringIO()
-            data.to_csv(csv_buffer, index=False)
-            csv_buffer.seek(0)
-            yield csv_buffer.getvalue()
+            yield from iter_export(data, input.download_enrichment_format())
     
-    cross_modal_results = reactive.Value(None)
-    sample_types_reactive = reactive.Value(None)
-
     @reactive.Effect
     @reactive.event(input.run_cross_modal)
     def _():
         if not input.cross_modal_cancer() or not input.bulk_upload():
             return None
-        
-        with ui.Progress(min=1, max=15) as p:
-            p.set(message="Processing cross-modal integration...", detail="This may take a while...")
-            
-            for i in range(1, 15):
-                p.set(i, message="Processing...")
-                reactive.flush()
-            
-            bulk_file = input.bulk_upload()[0]
-            bulk_df = pd.read_csv(bulk_file['datapath'], index_col=0)
-            
-            sc_data = sc_samples[input.cross_modal_cancer()]
-            
-            pseudo_h, bulk_h = cross_modal_harmony_embeddings_from_df(
-                df_pca=sc_data['df_pca'],
-                bulk_df=bulk_df,
-                scaler=sc_data['scaler'],  
-                pca=sc_data['pca'],       
-                hvg_genes=sc_data['hv_genes'],
-                sigma=0.1
-            )
-            
-            dc_matrix, best_match = compute_distance_correlation_matrix(pseudo_h, bulk_h)
-            
-            sample_to_ds = sc_data['df_pca'].drop_duplicates('sample').set_index('sample')['dataset']
-            sample_types = sample_to_ds.apply(lambda x: 'cell_line' if x == 'CCLE' else 'primary_tumor')
-            
-            cross_modal_results.set({
-                'matrix': dc_matrix,
-                'best_match': best_match
-            })
-            sample_types_reactive.set(sample_types)
+
+        bulk_file = input.bulk_upload()[0]
+
+        cross_modal_task.cancel()
+        cross_modal_task(None, submit={
+            'cancer': input.cross_modal_cancer(), 'bulk_path': bulk_file['datapath'], 'sigma': 0.1,
+            'bulk_name': bulk_file['name'], 'frozen': input.frozen_reference(),
+            'significance': input.cross_modal_pvalues(),
+            'metric': input.cross_modal_metric(), 'top_k': int(input.cross_modal_top_k() or 0) or None
+        })
+
+    @reactive.Effect
+    @reactive.event(input.load_job)
+    def _():
+        if input.job_id().strip():
+            cross_modal_task.cancel()
+            cross_modal_task(input.job_id().strip())
 
     @output
-    @render.data_frame
-    def cross_modal_table():
+    @render.text
+    def job_info():
         data = cross_modal_results()
-        if data is not None:
-            matrix = data['matrix']
-            long_data = convert_cross_modal_to_long(matrix)
-            return render.DataTable(
-                long_data.round(5),
-                filters=True,
-                width="100%",
-                height="400px"
+        if data is None:
+            return ""
+        return f"Results of job {data['job_id']}: enter this ID later to reload them."
+
+    @reactive.Calc
+    def cross_modal_results():
+        return cross_modal_task.result()
+
+    @reactive.Calc
+    def sample_types_reactive():
+        return cross_modal_results()['sample_types']
+
+    @reactive.Calc
+    def cross_modal_view():
+        data = cross_modal_results()
+        if data is None:
+            return None
+        label, ascending = SIMILARITY_METRICS[data.get('metric', 'distance_correlation')]
+        if data['matrix'] is None:
+            # a top-k job: only the best matches of each bulk sample were kept
+            return ResultView(
+                data['top'], label.replace(' ', '_'), key_cols=['Bulk_Sample', 'Pseudo_Centroid'], ascending=ascending
             )
-        return None
+        return ResultView.from_matrix(
+            data['matrix'], 'Bulk_Sample', 'Pseudo_Centroid', label.replace(' ', '_'),
+            extra=significance_columns(data, 'P_value'), ascending=ascending
+        )
+
+    serve_table(
+        input, output, "cross_modal_table", cross_modal_view, key_cols=["Bulk_Sample", "Pseudo_Centroid"]
+    )
 
     @output
     @render.plot
@@ -204,19 +410,19 @@ def server(input, output, session):
         data = cross_modal_results()
         sample_types = sample_types_reactive()
         if data is not None and sample_types is not None:
-            matrix = data['matrix']
-            return plot_top_combinations(matrix, input.filter_type(), sample_types, top_n=5)
+            return plot_top_combinations(
+                data['matrix'], input.filter_type(), sample_types, top_n=5, progress=metrics.record,
+                metric=data.get('metric', 'distance_correlation'), top=data.get('top')
+            )
         return None
 
     @render.download(
-        filename=lambda: f"cross_modal_integration_{input.cross_modal_cancer()}.csv"
+        filename=lambda: export_filename(
+            f"cross_modal_integration_{input.cross_modal_cancer()}", input.download_cross_modal_format()
+        ),
+        media_type=lambda: export_media_type(input.download_cross_modal_format())
     )
     def download_cross_modal():
-        data = cross_modal_results()
-        if data is not None:
-            matrix = data['matrix']
-            long_data = convert_cross_modal_to_long(matrix)
-            csv_buffer = StringIO()
-            long_data.to_csv(csv_buffer, index=False)
-            csv_buffer.seek(0)
-            yield csv_buffer.getvalue()
\ No newline at end of file
+        view = cross_modal_view()
+        if view is not None:
+            yield from iter_export(view.frame, input.download_cross_modal_format())
\ No newline at end of file
@@ -0,0 +1,266 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+
+DTYPE = np.dtype(os.environ.get('CACAIO_SIMILARITY_DTYPE', 'float64'))
+
+
+# Every kernel maps X (n_x, p) and Y (n_y, p) to the (n_x, n_y) matrix of
+# one metric between their rows, with dtype float64 or float32. Rows are
+# sample centroids (one value per PC).
+
+def _unit_rows(X, dtype, center):
+    X = np.asarray(X, dtype=dtype)
+    if center:
+        X = X - X.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(X, axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # constant (or zero) rows have no defined correlation / angle
+        return np.where(norm > 0, X / norm, np.nan)
+
+
+def pearson_matrix(X, Y, dtype=DTYPE):
+    return _unit_rows(X, dtype, True) @ _unit_rows(Y, dtype, True).T
+
+
+def spearman_matrix(X, Y, dtype=DTYPE):
+    from scipy.stats import rankdata
+
+    return pearson_matrix(rankdata(X, axis=1), rankdata(Y, axis=1), dtype)
+
+
+def cosine_matrix(X, Y, dtype=DTYPE):
+    return _unit_rows(X, dtype, False) @ _unit_rows(Y, dtype, False).T
+
+
+def euclidean_matrix(X, Y, dtype=DTYPE):
+    X = np.asarray(X, dtype=dtype)
+    Y = np.asarray(Y, dtype=dtype)
+    sq = np.einsum('ij,ij->i', X, X)[:, None] + np.einsum('ij,ij->i', Y, Y)[None, :] - 2 * X @ Y.T
+    return np.sqrt(np.clip(sq, 0, None))
+
+
+def _double_centered_distances(X, dtype=np.float64):
+    """
+    Double-centered distance matrix of every row of X, flattened.
+
+    Each row is treated as a univariate sample of length p (one value per PC),
+    exactly as dcor.distance_correlation does for two 1-D vectors.
+
+    Returns:
+        array of shape (n_rows, p * p)
+    """
+    X = np.asarray(X, dtype=dtype)
+    d = np.abs(X[:, :, None] - X[:, None, :])
+    d -= d.mean(axis=1, keepdims=True)
+    d -= d.mean(axis=2, keepdims=True)
+    return d.reshape(X.shape[0], -1)
+
+
+def distance_correlation_matrix(X, Y, dtype=np.float64):
+    """
+    Distance correlation between every row of X and every row of Y.
+
+    Same (biased) estimator as dcor.distance_correlation, but each row's
+    double-centered distance matrix is built once and all pairs come out of a
+    single matrix product.
+
+    Args:
+        X: array (n_x, p)
+        Y: array (n_y, p)
+        dtype: np.float64, or np.float32 for half the memory and a faster
+            product (at float32 precision).
+
+    Returns:
+        array (n_x, n_y) of distance correlations.
+    """
+    return _distance_correlation_from_centered(
+        _double_centered_distances(X, dtype),
+        _double_centered_distances(Y, dtype)
+    )
+
+
+def _distance_correlation_from_centered(A, B):
+    """
+    Distance correlation between rows of two outputs of _double_centered_distances.
+    """
+    # entries of each p × p distance matrix
+    n_entries = A.shape[1]
+
+    dcov_xy = A @ B.T / n_entries
+    dvar_x = np.einsum('ij,ij->i', A, A) / n_entries
+    dvar_y = np.einsum('ij,ij->i', B, B) / n_entries
+    denom = np.sqrt(np.outer(dvar_x, dvar_y))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dcor_sqr = dcov_xy / denom
+    dcor_sqr[denom == 0] = 0.0
+    return np.sqrt(np.clip(dcor_sqr, 0.0, None))
+
+
+def _row_sums(X):
+    """
+    Row sums of every row's distance matrix, sum_j |x_i - x_j|, from one
+    sort per row (the element k-th in order has k smaller neighbours).
+    """
+    n = X.shape[1]
+    order = np.argsort(X, axis=1, kind='stable')
+    xs = np.take_along_axis(X, order, axis=1)
+    before = np.cumsum(xs, axis=1) - xs
+    k = np.arange(n)
+    sums = np.empty_like(X)
+    np.put_along_axis(sums, order, xs * (2 * k - n + 1) + xs.sum(axis=1, keepdims=True) - 2 * before - xs, axis=1)
+    return order, xs, sums
+
+
+def _cross_sums(xs, order_x, Y, y_ranks, out):
+    """
+    out[i, k] = sum_{a,b} |x_a - x_b| |y_a - y_b| for X row i (sorted: xs,
+    order_x) and Y row k (y_ranks: ranks of its values, 0-based).
+
+    In x order |x_a - x_b| = x_b - x_a for a < b, and the sign of y_b - y_a
+    splits each term into sums over the earlier elements with smaller y
+    (a binary indexed tree over y ranks) and over all earlier elements
+    (running sums): O(p log p) per pair. Compiled with numba on first use.
+    """
+    n_x, n = xs.shape
+    tree = np.zeros((n + 1, 4))
+    for i in range(n_x):
+        for k in range(Y.shape[0]):
+            tree[:] = 0.0
+            p0 = p1 = p2 = p3 = 0.0
+            total = 0.0
+            for j in range(n):
+                x = xs[i, j]
+                y = Y[k, order_x[i, j]]
+                r = y_ranks[k, order_x[i, j]]
+                b0 = b1 = b2 = b3 = 0.0
+                t = r
+                while t > 0:
+                    b0 += tree[t, 0]
+                    b1 += tree[t, 1]
+                    b2 += tree[t, 2]
+                    b3 += tree[t, 3]
+                    t -= t & -t
+                total += x * y * (2 * b0 - p0) - x * (2 * b2 - p2) - y * (2 * b1 - p1) + (2 * b3 - p3)
+                t = r + 1
+                while t <= n:
+                    tree[t, 0] += 1.0
+                    tree[t, 1] += x
+                    tree[t, 2] += y
+                    tree[t, 3] += x * y
+                    t += t & -t
+                p0 += 1.0
+                p1 += x
+                p2 += y
+                p3 += x * y
+            out[i, k] = 2 * total
+
+
+_compiled = {}
+
+
+def _kernel(fn):
+    if fn not in _compiled:
+        import numba
+
+        _compiled[fn] = numba.njit(cache=True, nogil=True)(fn)
+    return _compiled[fn]
+
+
+def fast_distance_correlation_matrix(X, Y, dtype=DTYPE):
+    """
+    Distance correlation between every row of X and every row of Y with the
+    O(p log p) univariate algorithm of Huo & Székely (2016): same (biased)
+    estimator as dcor.distance_correlation, without building any p × p
+    distance matrix. Row sums and variances come from one sort per row;
+    only the cross term needs work per pair (_cross_sums).
+    """
+    X = np.asarray(X, dtype=dtype)
+    Y = np.asarray(Y, dtype=dtype)
+    n = X.shape[1]
+    order_x, xs, a = _row_sums(X)
+    _, _, b = _row_sums(Y)
+    y_ranks = np.argsort(np.argsort(Y, axis=1, kind='stable'), axis=1)
+
+    def dvar(Z, sums):
+        # sum_ab (z_a - z_b)^2 = 2 n sum z^2 - 2 (sum z)^2
+        squares = 2 * n * np.einsum('ij,ij->i', Z, Z) - 2 * Z.sum(axis=1) ** 2
+        return squares / n ** 2 - 2 * np.einsum('ij,ij->i', sums, sums) / n ** 3 + sums.sum(axis=1) ** 2 / n ** 4
+
+    cross = np.empty((len(X), len(Y)), dtype=dtype)
+    _kernel(_cross_sums)(xs, order_x, Y, y_ranks, cross)
+    dcov = cross / n ** 2 - 2 * (a @ b.T) / n ** 3 + np.outer(a.sum(axis=1), b.sum(axis=1)) / n ** 4
+    denom = np.sqrt(np.outer(dvar(X, a), dvar(Y, b)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dcor_sqr = np.where(denom > 0, dcov / denom, 0.0)
+    return np.sqrt(np.clip(dcor_sqr, 0.0, None))
+
+
+# metric -> (kernel, value column label, lower is more similar)
+METRICS = {
+    'distance_correlation': (distance_correlation_matrix, "Distance Correlation", False),
+    'distance_correlation_fast': (fast_distance_correlation_matrix, "Distance Correlation", False),
+    'pearson': (pearson_matrix, "Pearson Correlation", False),
+    'spearman': (spearman_matrix, "Spearman Correlation", False),
+    'cosine': (cosine_matrix, "Cosine Similarity", False),
+    'euclidean': (euclidean_matrix, "Euclidean Distance", True),
+}
+
+
+def similarity_matrix(X, Y, metric='distance_correlation', dtype=None):
+    """
+    METRICS[metric] between every row of X and every row of Y, as float64
+    (computed in dtype, by default DTYPE: $CACAIO_SIMILARITY_DTYPE or float64).
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown similarity metric {metric!r}; choose from {', '.join(METRICS)}")
+    return np.asarray(METRICS[metric][0](X, Y, dtype=DTYPE if dtype is None else dtype), dtype=np.float64)
+
+
+def dcor_loop(X, Y):
+    """
+    Reference: dcor.distance_correlation called for every pair.
+    """
+    import dcor
+
+    return np.array([[dcor.distance_correlation(x, y) for y in Y] for x in X])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time every similarity kernel against the pairwise dcor loop on a dataset's centroids.")
+    parser.add_argument('dataset', nargs='?', help="dataset name (default: the first one)")
+    parser.add_argument('--key', default='df_pca_harmony')
+    parser.add_argument('--loop-pairs', type=int, default=2000, help="pairs timed with the dcor loop")
+    args = parser.parse_args()
+
+    from data import sc_samples
+    from embedding import Embedding
+
+    name = args.dataset or next(iter(sc_samples))
+    emb = Embedding.from_frame(sc_samples[name][args.key])
+    centroids = emb.centroids()
+    X = centroids[emb.is_cell_line].values
+    Y = centroids[~emb.is_cell_line].values
+    n_pairs = X.shape[0] * Y.shape[0]
+
+    rows = max(1, min(X.shape[0], args.loop_pairs // max(1, Y.shape[0])))
+    start = time.perf_counter()
+    reference = dcor_loop(X[:rows], Y)
+    per_pair = (time.perf_counter() - start) / reference.size
+    print(f"{name}: {X.shape[0]} × {Y.shape[0]} pairs; dcor loop {per_pair * 1e6:.1f}µs per pair "
+          f"(~{per_pair * n_pairs:.2f}s for all)")
+
+    for metric in METRICS:
+        for dtype in (np.float64, np.float32):
+            start = time.perf_counter()
+            values = similarity_matrix(X, Y, metric, dtype)
+            elapsed = time.perf_counter() - start
+            check = ""
+            if metric.startswith('distance_correlation'):
+                check = f", max |Δ| vs dcor {np.nanmax(np.abs(values[:rows] - reference)):.1e}"
+            print(f"{metric:<26} {np.dtype(dtype).name:<8} {elapsed:.4f}s "
+                  f"({per_pair * n_pairs / elapsed:,.0f}× the loop){check}")
@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import threading
+from collections.abc import Mapping
+
+import joblib
+import numpy as np
+import pandas as pd
+
+
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+
+
+def _is_pc(col):
+    return isinstance(col, str) and col.startswith('PC')
+
+
+def _write_frame(df, dirpath, prefix):
+    """
+    Write one cell-level frame as .npy columns; returns its manifest entry.
+
+    PCs go into a single C-contiguous matrix, string-like columns into int32
+    codes plus a category list, numeric columns into their own arrays.
+    """
+    pc_cols = [c for c in df.columns if _is_pc(c)]
+    entry = {'pc_cols': pc_cols, 'pcs': f"{prefix}.pcs.npy", 'columns': [], 'n_rows': len(df)}
+
+    np.save(os.path.join(dirpath, entry['pcs']), np.ascontiguousarray(df[pc_cols].to_numpy()))
+
+    for i, col in enumerate(c for c in df.columns if not _is_pc(c)):
+        values = df[col]
+        fname = f"{prefix}.col{i}"
+        if pd.api.types.is_numeric_dtype(values) and not isinstance(values.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(dirpath, f"{fname}.npy"), values.to_numpy())
+            entry['columns'].append({'name': col, 'kind': 'numeric', 'file': f"{fname}.npy"})
+        else:
+            cat = pd.Categorical(values.astype(str))
+            np.save(os.path.join(dirpath, f"{fname}.codes.npy"), cat.codes.astype(np.int32))
+            entry['columns'].append({
+                'name': col,
+                'kind': 'categorical',
+                'file': f"{fname}.codes.npy",
+                'categories': [str(c) for c in cat.categories]
+            })
+
+    if not isinstance(df.index, pd.RangeIndex):
+        np.save(os.path.join(dirpath, f"{prefix}.index.npy"), np.asarray(df.index.astype(str), dtype=str))
+        entry['index'] = f"{prefix}.index.npy"
+    return entry
+
+
+def _read_frame(entry, dirpath):
+    """
+    Rebuild a frame from memory-mapped arrays without copying the PC matrix.
+    """
+    pcs = np.load(os.path.join(dirpath, entry['pcs']), mmap_mode='r')
+    index = None
+    if 'index' in entry:
+        index = pd.Index(np.load(os.path.join(dirpath, entry['index'])))
+    df = pd.DataFrame(pcs, columns=entry['pc_cols'], index=index, copy=False)
+
+    for col in entry['columns']:
+        arr = np.load(os.path.join(dirpath, col['file']), mmap_mode='r')
+        if col['kind'] == 'categorical':
+            values = pd.Categorical.from_codes(np.asarray(arr), categories=col['categories'])
+        else:
+            values = arr
+        df.insert(len(df.columns), col['name'], values)
+    return df
+
+
+def convert(pickle_path, store_path):
+    """
+    One-shot conversion of sc_samples.pkl into a per-dataset columnar store.
+    """
+    sc_samples = joblib.load(pickle_path)
+    os.makedirs(store_path, exist_ok=True)
+    manifest = {'version': FORMAT_VERSION, 'datasets': {}}
+
+    for i, (name, content) in enumerate(sc_samples.items()):
+        dirname = f"ds{i:03d}"
+        dirpath = os.path.join(store_path, dirname)
+        os.makedirs(dirpath, exist_ok=True)
+
+        frames, objects = {}, {}
+        for key, value in content.items():
+            if isinstance(value, pd.DataFrame):
+                frames[key] = _write_frame(value, dirpath, key)
+            else:
+                objects[key] = value
+        joblib.dump(objects, os.path.join(dirpath, 'objects.joblib'))
+
+        manifest['datasets'][name] = {'dir': dirname, 'frames': frames, 'objects': sorted(objects)}
+        print(f"converted {name}")
+
+    tmp = os.path.join(store_path, f"{MANIFEST}.tmp")
+    with open(tmp, 'w') as fh:
+        json.dump(manifest, fh, indent=1)
+    os.replace(tmp, os.path.join(store_path, MANIFEST))
+    return manifest
+
+
+class LazyDataset(Mapping):
+    """
+    One dataset of the store. Frames are memory-mapped on first access and the
+    pickled objects (scaler, pca, hv_genes, ...) are loaded together on first use.
+    """
+
+    def __init__(self, entry, dirpath):
+        self._entry = entry
+        self._dirpath = dirpath
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        if key in self._loaded:
+            return self._loaded[key]
+        with self._lock:
+            if key not in self._loaded:
+                if key in self._entry['frames']:
+                    self._loaded[key] = _read_frame(self._entry['frames'][key], self._dirpath)
+                elif key in self._entry['objects']:
+                    self._loaded.update(joblib.load(os.path.join(self._dirpath, 'objects.joblib')))
+                else:
+                    raise KeyError(key)
+        return self._loaded[key]
+
+    def __iter__(self):
+        return iter(list(self._entry['frames']) + list(self._entry['objects']))
+
+    def __len__(self):
+        return len(self._entry['frames']) + len(self._entry['objects'])
+
+
+class LazyStore(Mapping):
+    """
+    Read-only, dict-like view of a store with the same shape as sc_samples.pkl:
+    store[name]['df_pca_harmony'], store[name]['scaler'], ...
+
+    Only the manifest is read when the store is opened. Arrays are memory-mapped,
+    so workers on the same host share pages through the OS page cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as fh:
+            self.manifest = json.load(fh)
+        self._datasets = {
+            name: LazyDataset(entry, os.path.join(path, entry['dir']))
+            for name, entry in self.manifest['datasets'].items()
+        }
+
+    def __getitem__(self, name):
+        return self._datasets[name]
+
+    def __iter__(self):
+        return iter(self._datasets)
+
+    def __len__(self):
+        return len(self._datasets)
+
+
+def open_store(path):
+    return LazyStore(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert sc_samples.pkl into a memory-mapped per-dataset store.")
+    parser.add_argument('pickle', nargs='?', default='sc_samples.pkl')
+    parser.add_argument('store', nargs='?', default='sc_store')
+    args = parser.parse_args()
+    convert(args.pickle, args.store)
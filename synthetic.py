@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+
+# Synthetic inputs shaped like the real data, shared by benchmark.py and the tests.
+
+def make_embedding(cells, samples, pcs=50, ccle_fraction=0.25, seed=0):
+    """
+    Synthetic frame shaped like sc_samples[...]['df_pca_harmony'] / ['df_pca']:
+    PC1..PCn plus categorical 'sample' and 'dataset' columns. Each sample gets
+    its own offset so centroids differ.
+    """
+    rng = np.random.default_rng(seed)
+    sample_ids = rng.integers(0, samples, size=cells)
+    offsets = rng.normal(scale=2.0, size=(samples, pcs))
+    values = offsets[sample_ids] + rng.normal(size=(cells, pcs))
+
+    df = pd.DataFrame(values, columns=[f"PC{i+1}" for i in range(pcs)])
+    n_ccle = max(1, int(samples * ccle_fraction))
+    names = np.array([f"{'CL' if i < n_ccle else 'TU'}_{i:04d}" for i in range(samples)])
+    df['sample'] = pd.Categorical(names[sample_ids])
+    df['dataset'] = pd.Categorical(np.where(sample_ids < n_ccle, 'CCLE', 'tumor'))
+    return df
+
+
+def make_reference(genes, pcs=50, cells=2_000, seed=0):
+    """
+    Fitted StandardScaler / PCA pair over synthetic expression, plus the HVG list.
+    """
+    from sklearn.decomposition import PCA
+    from sklearn.preprocessing import StandardScaler
+
+    rng = np.random.default_rng(seed)
+    hv_genes = [f"GENE{i}" for i in range(genes)]
+    expr = rng.poisson(2.0, size=(cells, genes)).astype(np.float64)
+    scaler = StandardScaler().fit(expr)
+    pca = PCA(n_components=pcs, random_state=seed).fit(scaler.transform(expr))
+    return scaler, pca, hv_genes
+
+
+def make_bulk(samples, hv_genes, extra_genes=500, seed=0):
+    """
+    Synthetic bulk upload: samples × genes, with some genes outside the HVG set
+    and some HVGs missing, as in real uploads.
+    """
+    rng = np.random.default_rng(seed)
+    genes = list(hv_genes[: int(len(hv_genes) * 0.9)]) + [f"OTHER{i}" for i in range(extra_genes)]
+    values = rng.poisson(2.0, size=(samples, len(genes))).astype(np.float64)
+    return pd.DataFrame(values, index=[f"BULK_{i:04d}" for i in range(samples)], columns=genes)
+
+
+def make_gene_sets(hv_genes, n_terms=300, seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        f"TERM_{j}": list(rng.choice(hv_genes, size=int(rng.integers(10, 200)), replace=False))
+        for j in range(n_terms)
+    }
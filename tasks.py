@@ -0,0 +1,464 @@
+import asyncio
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from instrumentation import metrics
+
+
+MAX_WORKERS = int(os.environ.get('CACAIO_MAX_WORKERS', min(4, os.cpu_count() or 1)))
+MAX_QUEUE = int(os.environ.get('CACAIO_MAX_QUEUE', 16))
+EXECUTOR = os.environ.get('CACAIO_EXECUTOR', 'process')
+SHARED_TTL = float(os.environ.get('CACAIO_SHARED_TTL', 600))
+SHARED_MAX_MB = float(os.environ.get('CACAIO_SHARED_MAX_MB', 256))
+PREWARM = int(os.environ.get('CACAIO_PREWARM', 0))
+
+
+class QueueFull(RuntimeError):
+    """Raised when more tasks are waiting than the pool accepts."""
+
+
+def warm_worker():
+    """
+    Worker initializer used with CACAIO_PREWARM=1: import the analysis
+    libraries and load the datasets before the first job arrives.
+    """
+    import harmonypy  # noqa: F401
+    import functions  # noqa: F401
+    from data import load
+
+    load()
+
+
+class TaskPool:
+    """
+    Bounded pool that runs blocking analyses off the Shiny event loop.
+
+    At most max_workers tasks run at once and at most max_queue more may wait;
+    further submissions raise QueueFull instead of piling up. Cancelling the
+    awaiting coroutine cancels the task if it has not started yet.
+
+    Jobs accept a `progress` callback; when run() is given on_event, the
+    job's stage events are relayed back to the event loop (through a
+    manager queue for process workers) and passed to on_event as they arrive.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_queue=MAX_QUEUE, kind=EXECUTOR, prewarm=PREWARM):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self.initializer = warm_worker if prewarm else None
+        self.in_flight = 0
+        self._executor = None
+        self._manager = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.kind == 'thread':
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, initializer=self.initializer)
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=self.initializer)
+        return self._executor
+
+    def prewarm(self):
+        """
+        Start every worker now instead of on the first jobs (each runs the
+        initializer, if any, as it starts).
+        """
+        for _ in range(self.max_workers):
+            self.executor.submit(time.sleep, 0.1)
+
+    def _event_queue(self):
+        if self.kind == 'thread':
+            return queue.Queue()
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+        return self._manager.Queue()
+
+    async def run(self, fn, *args, on_event=None):
+        if self.in_flight >= self.max_workers + self.max_queue:
+            raise QueueFull("The server is busy, please try again in a moment.")
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            if on_event is None:
+                return await loop.run_in_executor(self.executor, fn, *args)
+
+            events = self._event_queue()
+            fut = loop.run_in_executor(self.executor, functools.partial(fn, *args, progress=events.put))
+            try:
+                while True:
+                    done, _ = await asyncio.wait({fut}, timeout=0.2)
+                    while True:
+                        try:
+                            on_event(events.get_nowait())
+                        except queue.Empty:
+                            break
+                    if done:
+                        return fut.result()
+            except asyncio.CancelledError:
+                fut.cancel()
+                raise
+        finally:
+            self.in_flight -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+
+def result_nbytes(obj):
+    """
+    Approximate memory held by a job result.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(result_nbytes(k) + result_nbytes(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sum(result_nbytes(v) for v in obj)
+    return sys.getsizeof(obj)
+
+
+class _Flight:
+    def __init__(self):
+        self.task = None
+        self.waiters = 0
+        self.listeners = []
+        self.events = []
+
+
+class SingleFlight:
+    """
+    Shares computations between sessions.
+
+    Requests are keyed by a fingerprint of the job and its arguments.
+    Identical requests arriving while one is running wait on that single
+    pool task and all receive its result (and its progress events, replayed
+    from the start for late joiners). Finished results are kept for ttl
+    seconds within max_bytes, least recently used first out; failures are
+    not kept. The pool task is cancelled only when every waiter has gone.
+    """
+
+    def __init__(self, pool, ttl=SHARED_TTL, max_bytes=SHARED_MAX_MB * 2 ** 20):
+        self.pool = pool
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = self.joins = self.misses = 0
+        self._flights = {}
+        self._results = OrderedDict()
+
+    @staticmethod
+    def key(fn, args):
+        payload = json.dumps([fn.__module__, fn.__qualname__, list(args)], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _drop(self, key):
+        _, size, _ = self._results.pop(key)
+        self.bytes -= size
+
+    def _lookup(self, key):
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._drop(key)
+            return None
+        self._results.move_to_end(key)
+        return entry
+
+    def _store(self, key, result):
+        size = result_nbytes(result)
+        if size > self.max_bytes:
+            return
+        if key in self._results:
+            self._drop(key)
+        self._results[key] = (time.monotonic() + self.ttl, size, result)
+        self.bytes += size
+        now = time.monotonic()
+        for k in [k for k, (expires, _, _) in self._results.items() if expires < now]:
+            self._drop(k)
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self._results)))
+
+    async def _fly(self, key, fn, args, flight, progress):
+        def broadcast(event):
+            metrics.record(event)
+            flight.events.append(event)
+            for listener in list(flight.listeners):
+                listener(event)
+
+        try:
+            result = await self.pool.run(fn, *args, on_event=broadcast if progress else None)
+            self._store(key, result)
+            return result
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def run(self, fn, *args, on_event=None, key=None):
+        """
+        pool.run(fn, *args, on_event=on_event), shared with identical requests.
+        key overrides the fingerprint of (fn, args), e.g. to hash an
+        uploaded file's content instead of its path.
+        """
+        key = key or self.key(fn, args)
+        entry = self._lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[2]
+
+        flight = self._flights.get(key)
+        if flight is None:
+            self.misses += 1
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.ensure_future(self._fly(key, fn, args, flight, on_event is not None))
+        else:
+            self.joins += 1
+        if on_event is not None:
+            for event in flight.events:
+                on_event(event)
+            flight.listeners.append(on_event)
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if on_event is not None:
+                flight.listeners.remove(on_event)
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    def clear(self):
+        self._results.clear()
+        self.bytes = 0
+
+
+pool = TaskPool()
+metrics.gauges['cacaio_tasks_in_flight'] = lambda: pool.in_flight
+shared = SingleFlight(pool)
+metrics.gauges['cacaio_shared_in_flight'] = lambda: len(shared._flights)
+metrics.gauges['cacaio_shared_results'] = lambda: len(shared._results)
+metrics.gauges['cacaio_shared_results_bytes'] = lambda: shared.bytes
+metrics.gauges['cacaio_shared_hits'] = lambda: shared.hits
+metrics.gauges['cacaio_shared_joins'] = lambda: shared.joins
+
+
+# Jobs run inside the pool's workers, so they take plain arguments and look
+# datasets up themselves instead of shipping large frames between processes.
+
+_similarity_cache = None
+
+
+def similarity_job(dataset, significance=False, metric='distance_correlation', bootstrap=False, progress=None):
+    """
+    {'matrix': CCLE × tumor similarities, 'metric', 'pvalues', 'fdr', 'bootstrap'}.
+
+    metric is one of similarity.METRICS (centroids) or 'mmd' (cell
+    distributions, see mmd.py). The permutation p-value and FDR matrices
+    are None unless significance is set, and the bootstrap CI / rank
+    probability matrices ({name: DataFrame}) None unless bootstrap is set;
+    both exist for distance correlation only.
+    """
+    global _similarity_cache
+    from data import SOURCE_PATH
+    from cache import SimilarityCache
+
+    if _similarity_cache is None:
+        _similarity_cache = SimilarityCache(source=SOURCE_PATH)
+    emb = embedding(dataset, 'df_pca_harmony')
+    matrix = _similarity_cache.similarity(dataset, emb, metric=metric, progress=progress)
+    pvalues = fdr = stats = None
+    dcor = metric.startswith('distance_correlation')
+    if significance and dcor:
+        pvalues, fdr = _similarity_cache.significance(dataset, emb, matrix, progress=progress)
+    if bootstrap and dcor:
+        stats = _similarity_cache.bootstrap(dataset, emb, progress=progress)
+    return {'matrix': matrix, 'metric': metric, 'pvalues': pvalues, 'fdr': fdr, 'bootstrap': stats}
+
+
+def enrichment_job(gene_list, libraries, progress=None):
+    from functions import run_enrichment_analysis
+
+    return run_enrichment_analysis(gene_list=gene_list, libraries=libraries, organism='human', progress=progress)
+
+
+_embeddings = {}
+_centroid_stores = {}
+
+
+def _reset_embeddings_lock():
+    global _embeddings_lock
+    _embeddings_lock = threading.Lock()
+
+
+_reset_embeddings_lock()
+# a worker forked while a thread builds an embedding must not inherit the held lock
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_embeddings_lock)
+
+
+def embedding(cancer, key='df_pca'):
+    """
+    Per-process compact Embedding of one dataset's frame, built on first use.
+
+    When the datasets come from the pickle (a plain dict), the frame is
+    dropped once converted so the process keeps only the float32 copy; store
+    frames are memory-mapped and left alone. Thread-safe: concurrent callers
+    (CACAIO_EXECUTOR=thread) wait for a single build.
+    """
+    from data import sc_samples
+    from embedding import Embedding
+
+    if (cancer, key) not in _embeddings:
+        with _embeddings_lock:
+            if (cancer, key) not in _embeddings:
+                content = sc_samples[cancer]
+                _embeddings[(cancer, key)] = Embedding.from_frame(content[key])
+                if isinstance(content, dict):
+                    del content[key]
+    return _embeddings[(cancer, key)]
+
+
+def centroid_store(cancer, key='df_pca'):
+    """
+    Per-process CentroidStore of one dataset's embedding, built on first use.
+    """
+    from centroids import CentroidStore
+
+    if (cancer, key) not in _centroid_stores:
+        _centroid_stores[(cancer, key)] = CentroidStore.from_embedding(embedding(cancer, key))
+    return _centroid_stores[(cancer, key)]
+
+
+_indexes = {}
+
+
+def centroid_index(dataset, key='df_pca_harmony'):
+    """
+    Per-process nearest.CentroidIndex of one dataset, built on first use.
+    """
+    from nearest import CentroidIndex
+
+    if (dataset, key) not in _indexes:
+        _indexes[(dataset, key)] = CentroidIndex.from_store(embedding(dataset, key))
+    return _indexes[(dataset, key)]
+
+
+def samples_job(dataset):
+    """
+    {'cell_line': [...], 'primary_tumor': [...]} sample names of a dataset.
+    """
+    types = embedding(dataset, 'df_pca_harmony').sample_types()
+    return {t: list(types.index[types == t]) for t in ('cell_line', 'primary_tumor')}
+
+
+def matches_job(dataset, sample, k=10):
+    return centroid_index(dataset).query(sample, k)
+
+
+_references = {}
+
+
+def harmony_reference(cancer, sigma=0.1):
+    """
+    Per-process frozen Harmony reference of one dataset's centroids, loaded
+    from (or fitted into) the on-disk reference cache on first use.
+    """
+    from reference import load_or_fit
+
+    if (cancer, sigma) not in _references:
+        _references[(cancer, sigma)] = load_or_fit(centroid_store(cancer).centroids(), sigma=sigma)
+    return _references[(cancer, sigma)]
+
+
+def cross_modal_job(cancer, bulk_path, sigma=0.1, bulk_name=None, frozen=False, significance=False,
+                    metric='distance_correlation', top_k=None, progress=None):
+    """
+    Bulk samples × pseudo-bulk centroids similarity of one bulk file.
+
+    With top_k the full matrix is never built: 'top' holds the top_k
+    centroids of every bulk sample (functions.iter_top_distance_correlations)
+    and 'matrix' is None, so memory stays bounded on large cohorts.
+    """
+    from data import sc_samples
+    from bulk import project_bulk_file
+    from functions import (
+        _similarity_stage, compute_distance_correlation_matrix, cross_modal_harmony_embeddings_from_df,
+        iter_top_distance_correlations
+    )
+    from instrumentation import stage
+
+    if top_k and significance:
+        raise ValueError("Permutation p-values need the full matrix; run without top_k.")
+
+    sc_data = sc_samples[cancer]
+    with stage(progress, 'centroids'):
+        store = centroid_store(cancer)
+        reference = harmony_reference(cancer, sigma) if frozen else None
+    with stage(progress, 'projection'):
+        bulk_pca = project_bulk_file(
+            bulk_path, sc_data['scaler'], sc_data['pca'], sc_data['hv_genes'], name=bulk_name
+        )
+
+    pseudo_h, bulk_h = cross_modal_harmony_embeddings_from_df(
+        df_pca=embedding(cancer),
+        bulk_df=None,
+        bulk_pca=bulk_pca,
+        scaler=sc_data['scaler'],
+        pca=sc_data['pca'],
+        hvg_genes=sc_data['hv_genes'],
+        sigma=sigma,
+        progress=progress,
+        pseudo_centroids=store.centroids(),
+        reference=reference
+    )
+    if top_k:
+        import pandas as pd
+
+        with stage(progress, _similarity_stage(metric)):
+            top = pd.concat(iter_top_distance_correlations(pseudo_h, bulk_h, k=top_k, metric=metric),
+                            ignore_index=True)
+        best = top[top['Rank'] == 1]
+        return {
+            'matrix': None, 'top': top, 'sample_types': embedding(cancer).sample_types(),
+            'best_match': dict(zip(best['Bulk_Sample'], zip(best['Pseudo_Centroid'], best.iloc[:, 2]))),
+            'pvalues': None, 'fdr': None, 'metric': metric
+        }
+
+    dc_matrix, best_match = compute_distance_correlation_matrix(pseudo_h, bulk_h, progress=progress, metric=metric)
+
+    pvalues = fdr = None
+    if significance and metric.startswith('distance_correlation'):
+        from significance import significance_matrices
+
+        pvalues, fdr = significance_matrices(dc_matrix, bulk_h.values, pseudo_h.values, progress=progress)
+
+    return {
+        'matrix': dc_matrix, 'best_match': best_match, 'sample_types': embedding(cancer).sample_types(),
+        'pvalues': pvalues, 'fdr': fdr, 'metric': metric
+    }
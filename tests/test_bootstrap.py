@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from bootstrap import bootstrap_replicates, bootstrap_summary
+from embedding import Embedding
+from synthetic import make_embedding
+
+
+@pytest.fixture(scope='module')
+def emb():
+    return Embedding.from_frame(make_embedding(cells=2_000, samples=12, pcs=8, seed=9))
+
+
+def test_replicates_are_reproducible_for_a_seed(emb):
+    first = bootstrap_replicates(emb, n_replicates=24, seed=3, n_jobs=1)
+    again = bootstrap_replicates(emb, n_replicates=24, seed=3, n_jobs=1)
+    other = bootstrap_replicates(emb, n_replicates=24, seed=4, n_jobs=1)
+
+    np.testing.assert_array_equal(first, again)
+    assert not np.allclose(first, other)
+    # replicates differ from each other
+    assert np.ptp(first, axis=0).max() > 0
+
+
+def test_replicates_do_not_depend_on_jobs_or_batches(emb):
+    serial = bootstrap_replicates(emb, n_replicates=24, seed=3, n_jobs=1)
+    np.testing.assert_allclose(bootstrap_replicates(emb, 24, seed=3, n_jobs=1, batch_size=5), serial, atol=1e-6)
+    np.testing.assert_allclose(bootstrap_replicates(emb, 24, seed=3, n_jobs=3), serial, atol=1e-6)
+    # a prefix of the replicates is the same whatever the total
+    np.testing.assert_allclose(bootstrap_replicates(emb, 10, seed=3, n_jobs=1), serial[:10], atol=1e-6)
+
+
+def test_summary_is_reproducible(emb):
+    first = bootstrap_summary(emb, n_replicates=16, seed=1, n_jobs=1)
+    again = bootstrap_summary(emb, n_replicates=16, seed=1, n_jobs=2)
+    for name in first:
+        np.testing.assert_allclose(first[name].to_numpy(), again[name].to_numpy(), atol=1e-6)
+    assert ((first['CI_Low'] <= first['CI_High']).all()).all()
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bulk import iter_bulk_chunks, project_bulk_file
+from synthetic import make_bulk, make_reference
+
+
+@pytest.fixture(scope='module')
+def reference():
+    return make_reference(genes=300, pcs=10, cells=500, seed=3)
+
+
+@pytest.fixture(scope='module')
+def bulk(reference):
+    _, _, hv_genes = reference
+    return make_bulk(samples=40, hv_genes=hv_genes, extra_genes=50, seed=3)
+
+
+def write(bulk, path, name):
+    if name.endswith('.parquet'):
+        bulk.to_parquet(path)
+    else:
+        bulk.to_csv(path, sep='\t' if '.tsv' in name else ',', compression='gzip' if name.endswith('.gz') else None)
+
+
+@pytest.mark.parametrize('name', ['bulk.csv', 'bulk.tsv.gz', 'bulk.parquet'])
+def test_chunked_read_equals_full_read(tmp_path, bulk, reference, name):
+    _, _, hv_genes = reference
+    # uploads are stored under temporary names; the format comes from `name`
+    path = tmp_path / 'upload'
+    write(bulk, path, name)
+
+    chunks = list(iter_bulk_chunks(path, hv_genes, name=name, chunksize=7))
+    expected = bulk.reindex(columns=hv_genes, fill_value=0).astype(np.float32)
+
+    assert len(chunks) == 6
+    pd.testing.assert_frame_equal(pd.concat(chunks), expected, check_names=False)
+
+
+def test_project_bulk_file_equals_in_memory_projection(tmp_path, bulk, reference):
+    scaler, pca, hv_genes = reference
+    path = tmp_path / 'bulk.csv.gz'
+    bulk.to_csv(path)
+
+    projected = project_bulk_file(path, scaler, pca, hv_genes, n_pcs=5, chunksize=16)
+    full = bulk.reindex(columns=hv_genes, fill_value=0).astype(np.float32).to_numpy(dtype=np.float64)
+    expected = pca.transform(scaler.transform(full))[:, :5]
+
+    assert list(projected.index) == list(bulk.index)
+    np.testing.assert_allclose(projected.to_numpy(), expected, atol=1e-10)
@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import functions
+from synthetic import make_embedding
+from cache import ResultCache, SimilarityCache, enrichment_key
+from embedding import Embedding
+
+
+@pytest.fixture
+def versions():
+    """
+    Two versions of a dataset: v2 adds cells to CL_0001 and TU_0012, and a new tumor sample.
+    """
+    cells = make_embedding(cells=3_000, samples=24, pcs=10, seed=4)
+    names = cells['sample'].astype(str)
+    added = names.isin(['CL_0001', 'TU_0012']) & (cells.index % 3 == 0) | (names == 'TU_0023')
+    return cells[~added].reset_index(drop=True), cells
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    shapes = []
+    kernel = functions.similarity_matrix
+
+    def spy(X, Y, *args, **kwargs):
+        shapes.append((len(X), len(Y)))
+        return kernel(X, Y, *args, **kwargs)
+
+    monkeypatch.setattr(functions, 'similarity_matrix', spy)
+    return shapes
+
+
+@pytest.mark.parametrize('metric', ['distance_correlation', 'euclidean'])
+def test_changed_dataset_recomputes_only_changed_samples(tmp_path, versions, calls, metric):
+    v1, v2 = versions
+    source = tmp_path / 'sc_samples.pkl'
+    source.write_bytes(b'v1')
+    SimilarityCache(tmp_path, str(source)).similarity('brain', Embedding.from_frame(v1), metric=metric)
+    assert calls == [(6, 17)]
+
+    # a new source file drops the cached entries, but not the base
+    source.write_bytes(b'v2 changed')
+    calls.clear()
+    cache = SimilarityCache(tmp_path, str(source))
+    matrix = cache.similarity('brain', Embedding.from_frame(v2), metric=metric)
+    assert calls == [(1, 18), (6, 2)]
+
+    expected, _ = functions.compare_centroids_distance_correlation_from_df(
+        Embedding.from_frame(v2), metric=metric
+    )
+    pd.testing.assert_frame_equal(matrix, expected, check_names=False, atol=1e-6)
+
+
+def test_unchanged_dataset_with_new_source_recomputes_nothing(tmp_path, versions, calls):
+    v1, _ = versions
+    source = tmp_path / 'sc_samples.pkl'
+    source.write_bytes(b'v1')
+    first = SimilarityCache(tmp_path, str(source)).similarity('brain', Embedding.from_frame(v1))
+
+    source.write_bytes(b'v1 touched')
+    calls.clear()
+    again = SimilarityCache(tmp_path, str(source)).similarity('brain', Embedding.from_frame(v1))
+    assert calls == []
+    np.testing.assert_array_equal(again.values, first.values)
+
+
+def test_fingerprint_memo_follows_the_frame(tmp_path, versions, monkeypatch):
+    import cache
+
+    v1, v2 = versions
+    hashed = []
+    real = cache.embedding_fingerprint
+    monkeypatch.setattr(cache, 'embedding_fingerprint', lambda df, *args: hashed.append(len(df)) or real(df, *args))
+    store = SimilarityCache(tmp_path, str(tmp_path / 'none.pkl'))
+
+    first = store.fingerprint('brain', v1)
+    assert store.fingerprint('brain', v1) == first and hashed == [len(v1)]
+
+    # frames that come and go under the same name (and may reuse a
+    # collected frame's id()) are hashed again
+    for frame in (v1.copy(), v2.copy(), v2.copy()):
+        assert store.fingerprint('brain', frame) == real(frame)
+    assert len(hashed) == 4
+
+
+def test_source_path_matches_data():
+    import cache
+    import data
+
+    assert cache.SOURCE_PATH == data.SOURCE_PATH
+
+
+def test_enrichment_cache_is_invalidated_by_a_rebuilt_library(tmp_path, monkeypatch):
+    import enrichment
+
+    root = str(tmp_path / 'gene_sets')
+    # run_enrichment_analysis uses the default library root
+    for fn in (enrichment.has_libraries, enrichment.library_path, enrichment.enrich):
+        monkeypatch.setattr(fn, '__defaults__', (root,))
+    cache = ResultCache('enrichment', root=str(tmp_path / 'cache'))
+    genes = ['G1', 'G2', 'G3']
+
+    enrichment.save_library('Lib', {'T1': ['G1', 'G2'], 'T2': ['G4', 'G5']}, root)
+    first = functions.run_enrichment_analysis(genes, 'Lib', cache=cache)
+    enrichment.save_library('Lib', {'T3': ['G1', 'G2', 'G3'], 'T2': ['G4', 'G5']}, root)
+    os.utime(enrichment.library_path('Lib', root), ns=(0, 1))
+    second = functions.run_enrichment_analysis(genes, 'Lib', cache=cache)
+
+    assert 'T1' in set(first['Term']) and 'T3' in set(second['Term'])
+    assert cache.stats()['misses'] == 2
+    assert enrichment_key(genes, 'Lib', engine='local') != enrichment_key(genes, 'Lib', engine='enrichr')
+
+
+def test_result_cache_disk_tier_evicts_least_recently_used(tmp_path):
+    value = np.zeros(1000)
+    cache = ResultCache('results', max_items=1, root=str(tmp_path), max_bytes=None)
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, value)
+        os.utime(cache._path(key), ns=(i, i))
+    # a disk hit makes 'a' the most recently used
+    assert cache.get('a') is not None
+
+    cache.max_bytes = 3 * os.path.getsize(cache._path('a'))
+    cache.put('d', value)
+    assert sorted(os.listdir(cache.root)) == ['a.pkl', 'c.pkl', 'd.pkl']
+    assert cache.stats()['evictions'] == 1
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+import enrichment
+from synthetic import make_gene_sets
+
+
+def write_gmt(path, gene_sets):
+    with open(path, 'w') as fh:
+        for term, genes in gene_sets.items():
+            fh.write('\t'.join([term, ''] + list(genes)) + '\n')
+
+
+@pytest.mark.parametrize('toy', [True, False])
+def test_enrich_matches_gseapy_offline_enrichr(tmp_path, toy):
+    gp = pytest.importorskip('gseapy')
+
+    if toy:
+        gene_sets = {'T1': ['G1', 'G2', 'G3', 'G4'], 'T2': ['G3', 'G5', 'G6'], 'T3': ['G7', 'G8', 'G9'],
+                     'T4': ['G12', 'G1']}
+        gene_list = ['G1', 'G2', 'G3', 'G5', 'G12', 'NOT_IN_LIBRARY']
+    else:
+        hv_genes = [f"GENE{i}" for i in range(2_000)]
+        gene_sets = make_gene_sets(hv_genes, n_terms=60, seed=2)
+        gene_list = list(np.random.default_rng(2).choice(hv_genes, size=150, replace=False))
+    gmt = tmp_path / 'toy.gmt'
+    write_gmt(gmt, gene_sets)
+    enrichment.save_library('toy', enrichment.read_gmt(gmt), str(tmp_path))
+
+    ours = enrichment.enrich(gene_list, 'toy', str(tmp_path)).set_index('Term').sort_index()
+    theirs = gp.enrichr(gene_list=gene_list, gene_sets=str(gmt), outdir=None, no_plot=True).results
+    theirs = theirs.set_index('Term').sort_index()
+
+    assert list(ours.index) == list(theirs.index)
+    assert list(ours['Overlap']) == list(theirs['Overlap'])
+    for col in ('P-value', 'Adjusted P-value', 'Combined Score'):
+        np.testing.assert_allclose(ours[col], theirs[col], rtol=1e-10)
+
+
+def test_enrich_without_overlap_is_empty(tmp_path):
+    enrichment.save_library('toy', {'T1': ['G1', 'G2']}, str(tmp_path))
+    res = enrichment.enrich(['G9'], 'toy', str(tmp_path))
+    assert res.empty and list(res.columns) == enrichment.RESULT_COLUMNS
@@ -0,0 +1,56 @@
+import gzip
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from exports import EXPORT_FORMATS, iter_export
+from views import ResultView
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(8)
+    matrix = pd.DataFrame(rng.random((10, 9)), index=[f"B{i}" for i in range(10)], columns=[f"P,{j}" for j in range(9)])
+    pvalues = matrix.where(matrix > 0.2)
+    return ResultView.from_matrix(matrix, 'Bulk_Sample', 'Pseudo_Centroid', 'Value', extra={'P_value': pvalues}).frame
+
+
+def read(data, fmt):
+    if fmt == 'parquet':
+        return pd.read_parquet(io.BytesIO(data))
+    if fmt == 'csv.gz':
+        data = gzip.decompress(data)
+    return pd.read_csv(io.BytesIO(data))
+
+
+@pytest.mark.parametrize('fmt', list(EXPORT_FORMATS))
+def test_export_round_trips(frame, fmt):
+    parts = list(iter_export(frame, fmt, chunk_rows=7))
+    loaded = read(b''.join(parts), fmt)
+
+    if fmt != 'csv.gz':
+        # streamed chunk by chunk (gzip buffers small chunks itself)
+        assert len(parts) > 2
+    expected = frame.astype({'Bulk_Sample': str, 'Pseudo_Centroid': str})
+    loaded = loaded.astype({'Bulk_Sample': str, 'Pseudo_Centroid': str})
+    pd.testing.assert_frame_equal(loaded, expected, check_dtype=False)
+
+
+def test_parquet_has_one_row_group_per_chunk(frame):
+    import pyarrow.parquet as pq
+
+    data = b''.join(iter_export(frame, 'parquet', chunk_rows=25))
+    assert pq.ParquetFile(io.BytesIO(data)).num_row_groups == -(-len(frame) // 25)
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'csv.gz'])
+def test_empty_export_keeps_the_header(frame, fmt):
+    loaded = read(b''.join(iter_export(frame.iloc[:0], fmt)), fmt)
+    assert loaded.empty and list(loaded.columns) == list(frame.columns)
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        iter_export(pd.DataFrame(), 'xlsx')
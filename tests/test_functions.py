@@ -0,0 +1,104 @@
+import dcor
+import numpy as np
+import pandas as pd
+import pytest
+
+import functions
+from synthetic import make_embedding
+
+
+def dcor_loop(df, sample_col='sample', dataset_col='dataset'):
+    """
+    The per-pair loop distance_correlation_matrix replaced: centroids by
+    groupby mean, then dcor.distance_correlation for every CCLE × tumor pair.
+    """
+    pc_cols = [c for c in df.columns if c.startswith('PC')]
+    centroids = df.groupby(sample_col, observed=True)[pc_cols].mean()
+    datasets = df.groupby(sample_col, observed=True)[dataset_col].first()
+    ccle = datasets.index[datasets == 'CCLE']
+    tumor = datasets.index[datasets != 'CCLE']
+    out = pd.DataFrame(index=ccle, columns=tumor, dtype=float)
+    for c in ccle:
+        for t in tumor:
+            out.at[c, t] = dcor.distance_correlation(centroids.loc[c].values, centroids.loc[t].values)
+    return out
+
+
+@pytest.fixture
+def cells():
+    df = make_embedding(cells=3_000, samples=24, pcs=20, seed=1)
+    # samples with very few cells: one CCLE line with a single cell, one tumor with two
+    first_ccle = df.index[df['sample'] == 'CL_0000']
+    first_tumor = df.index[df['sample'] == 'TU_0010']
+    return df.drop(first_ccle[1:]).drop(first_tumor[2:]).reset_index(drop=True)
+
+
+def test_compare_centroids_matches_dcor_loop(cells):
+    expected = dcor_loop(cells)
+    assert (cells['sample'] == 'CL_0000').sum() == 1
+
+    for df in (cells, functions.Embedding.from_frame(cells, dtype=np.float64)):
+        matrix, best = functions.compare_centroids_distance_correlation_from_df(df)
+        matrix = matrix.loc[expected.index, expected.columns]
+        np.testing.assert_allclose(matrix.values, expected.values, atol=1e-10)
+
+        c, t = np.unravel_index(np.argmax(expected.values), expected.shape)
+        assert (best['CCLE'], best['Tumor']) == (expected.index[c], expected.columns[t])
+
+
+@pytest.mark.parametrize('metric', ['distance_correlation', 'pearson', 'euclidean'])
+def test_update_centroid_similarity_matches_full_recompute(cells, metric):
+    # new cells for one CCLE line and five tumors, plus new tumor samples
+    names = cells['sample'].astype(str)
+    grown = names.isin(['CL_0001'] + [f'TU_{i:04d}' for i in range(15, 20)]) & (cells.index % 2 == 1)
+    added = grown | (names >= 'TU_0020')
+    old, new = cells[~added], cells[added]
+    store = functions.CentroidStore.from_frame(old)
+    matrix, _ = functions.compare_centroids_distance_correlation_from_store(store, metric=metric)
+
+    changed = store.append(new)
+    updated, best = functions.update_centroid_similarity(matrix, store, changed, metric=metric)
+    expected, expected_best = functions.compare_centroids_distance_correlation_from_df(cells, metric=metric)
+
+    updated = updated.loc[expected.index, expected.columns]
+    np.testing.assert_allclose(updated.values, expected.values, atol=1e-10)
+    assert (best['CCLE'], best['Tumor']) == (expected_best['CCLE'], expected_best['Tumor'])
+    assert best['Correlation'] == pytest.approx(expected_best['Correlation'])
+
+
+@pytest.mark.parametrize('metric', ['distance_correlation', 'spearman', 'euclidean'])
+def test_iter_top_distance_correlations_matches_full_matrix(metric):
+    rng = np.random.default_rng(3)
+    pseudo = pd.DataFrame(rng.normal(size=(40, 20)), index=[f"P{i}" for i in range(40)])
+    bulk = pd.DataFrame(rng.normal(size=(9, 20)), index=[f"B{i}" for i in range(9)])
+    full, best_match = functions.compute_distance_correlation_matrix(pseudo, bulk, metric=metric)
+
+    top = pd.concat(functions.iter_top_distance_correlations(
+        pseudo, bulk, k=3, bulk_chunk_size=4, pseudo_chunk_size=7, metric=metric
+    ))
+    value_col = functions.METRICS[metric][1].replace(' ', '_')
+    for b, rows in top.groupby('Bulk_Sample'):
+        expected = full.loc[b].sort_values(ascending=functions.METRICS[metric][2], kind='stable')[:3]
+        assert list(rows['Pseudo_Centroid']) == list(expected.index)
+        np.testing.assert_allclose(rows[value_col], expected.values, atol=1e-10)
+        assert rows['Pseudo_Centroid'].iloc[0] == best_match[b][0]
+
+
+def test_plot_top_combinations_from_top_k():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    rng = np.random.default_rng(4)
+    pseudo = pd.DataFrame(rng.normal(size=(30, 20)), index=[f"P{i}" for i in range(30)])
+    bulk = pd.DataFrame(rng.normal(size=(6, 20)), index=[f"B{i}" for i in range(6)])
+    sample_types = pd.Series('cell_line', index=pseudo.index)
+    full, _ = functions.compute_distance_correlation_matrix(pseudo, bulk)
+    top = pd.concat(functions.iter_top_distance_correlations(pseudo, bulk, k=5))
+
+    widths = []
+    for matrix, top_k in ((full, None), (None, top)):
+        functions.plot_top_combinations(matrix, 'all', sample_types, top_n=5, top=top_k)
+        widths.append([bar.get_width() for bar in plt.gca().patches])
+        plt.close('all')
+    np.testing.assert_allclose(widths[0], widths[1], atol=1e-10)
@@ -0,0 +1,32 @@
+import asyncio
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from cache import ResultCache
+from heatmap import cached_heatmap, cached_heatmap_async
+
+
+def test_async_render_goes_through_run_once(tmp_path):
+    rng = np.random.default_rng(0)
+    matrix = pd.DataFrame(
+        rng.random((8, 5)), index=[f'CL_{i}' for i in range(8)], columns=[f'TU_{j}' for j in range(5)]
+    )
+    cache = ResultCache('heatmaps', root=str(tmp_path))
+    calls = []
+
+    async def run(fn, *args, key=None):
+        # the pool pickles the callable; check it survives that
+        calls.append(key)
+        return pickle.loads(pickle.dumps(fn))(*args)
+
+    async def main():
+        first = await cached_heatmap_async(run, matrix, cache=cache, cluster=True, label='Pearson')
+        second = await cached_heatmap_async(run, matrix, cache=cache, cluster=True, label='Pearson')
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first.startswith(b'\x89PNG') and first == second
+    assert len(calls) == 1 and calls[0] is not None
+    assert cached_heatmap(matrix, cache=cache, cluster=True, label='Pearson') == first
@@ -0,0 +1,160 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data
+import jobs
+import tasks
+from jobs import JobQueue
+from tasks import TaskPool
+
+
+def echo_job(path, progress=None):
+    with open(path) as fh:
+        return {'text': fh.read(), 'runs': 1}
+
+
+@pytest.fixture
+def queue_root(tmp_path, monkeypatch):
+    source = tmp_path / 'sc_samples.pkl'
+    source.write_bytes(b'v1')
+    monkeypatch.setattr(data, 'SOURCE_PATH', str(source))
+    monkeypatch.setitem(jobs.JOB_KINDS, 'echo', 'echo_job')
+    monkeypatch.setattr(tasks, 'echo_job', echo_job, raising=False)
+    (tmp_path / 'input.txt').write_text('hello')
+    return tmp_path
+
+
+def make_queue(root, **kwargs):
+    return JobQueue(TaskPool(max_workers=2, kind='thread', prewarm=0), root=str(root / 'jobs'), **kwargs)
+
+
+def insert_running(queue, root, owner, heartbeat):
+    job_id = queue._create('echo', {'path': str(root / 'input.txt')}, files=('path',))
+    with queue._connect() as db:
+        db.execute("UPDATE jobs SET status = 'running', owner = ?, heartbeat = ? WHERE id = ?",
+                   (owner, heartbeat, job_id))
+    return job_id
+
+
+def test_submit_and_wait(queue_root):
+    async def main():
+        queue = make_queue(queue_root)
+        job_id = await queue.submit('echo', {'path': str(queue_root / 'input.txt')}, files=('path',))
+        return job_id, await queue.wait(job_id), queue.get(job_id)
+
+    job_id, result, job = asyncio.run(main())
+    assert result == {'text': 'hello', 'runs': 1}
+    assert job['status'] == 'done' and job['owner'] is not None
+
+
+def test_start_leaves_jobs_with_a_live_lease(queue_root):
+    async def main():
+        queue = make_queue(queue_root, lease=60)
+        job_id = insert_running(queue, queue_root, 'other-worker', time.time())
+        queue.start()
+        return job_id in queue._tasks, queue.get(job_id)
+
+    scheduled, job = asyncio.run(main())
+    assert not scheduled
+    assert (job['status'], job['owner']) == ('running', 'other-worker')
+
+
+def test_expired_lease_is_taken_over(queue_root):
+    async def main():
+        queue = make_queue(queue_root, lease=60)
+        job_id = insert_running(queue, queue_root, 'dead-worker', time.time() - 120)
+        queue.start()
+        assert job_id in queue._tasks
+        return await queue.wait(job_id), queue.get(job_id), queue.owner
+
+    result, job, owner = asyncio.run(main())
+    assert result['text'] == 'hello'
+    assert (job['status'], job['owner']) == ('done', owner)
+
+
+def test_wait_follows_a_job_another_worker_runs(queue_root):
+    async def main():
+        other = make_queue(queue_root, lease=3)
+        queue = make_queue(queue_root, lease=3)
+        job_id = insert_running(queue, queue_root, other.owner, time.time())
+
+        async def finish():
+            await asyncio.sleep(0.5)
+            path = f"{other.job_dir(job_id)}/{jobs.ARTIFACT}"
+            jobs.save_artifact(path, {'text': 'from other', 'runs': 1})
+            other._update(job_id, status='done', finished=time.time())
+
+        _, result = await asyncio.gather(finish(), queue.wait(job_id))
+        return result, queue.get(job_id)
+
+    result, job = asyncio.run(main())
+    assert result['text'] == 'from other'
+    assert job['status'] == 'done'
+
+
+def test_dedup_depends_on_source_data(queue_root):
+    queue = make_queue(queue_root)
+    kwargs = {'path': str(queue_root / 'input.txt')}
+    first = queue._create('echo', kwargs, files=('path',))
+    assert queue._create('echo', kwargs, files=('path',)) == first
+
+    (queue_root / 'sc_samples.pkl').write_bytes(b'v2, more cells')
+    assert queue._create('echo', kwargs, files=('path',)) != first
+
+
+def test_early_return_still_cleans_up(queue_root):
+    async def main():
+        queue = make_queue(queue_root, ttl=3600)
+        old = queue._create('echo', {'path': str(queue_root / 'input.txt')}, files=('path',))
+        with queue._connect() as db:
+            db.execute("UPDATE jobs SET status = 'done', finished = ? WHERE id = ?", (time.time() - 7200, old))
+        # a job that is already finished: _run returns right away
+        queue._schedule(old)
+        await queue._tasks[old]
+        return queue.get(old)
+
+    assert asyncio.run(main()) is None
+
+
+def test_artifact_keeps_column_dtypes(tmp_path):
+    top = pd.DataFrame({
+        'Bulk_Sample': ['b1', 'b1', 'b2'],
+        'Pseudo_Centroid': pd.Categorical(['CL_1', 'CL_2', 'CL_1']),
+        'Distance_Correlation': [0.9, 0.8, 0.7],
+        'Rank': [1, 2, 1],
+    })
+    matrix = pd.DataFrame(np.eye(2), index=pd.Index(['b1', 'b2'], name='Bulk_Sample'), columns=['CL_1', 'CL_2'])
+    result = {'matrix': matrix, 'top': top, 'sample_types': pd.Series(['Lung'], index=['CL_1']), 'metric': 'pearson'}
+
+    jobs.save_artifact(tmp_path / 'result.npz', result)
+    loaded = jobs.load_artifact(tmp_path / 'result.npz')
+
+    pd.testing.assert_frame_equal(loaded['top'], top)
+    pd.testing.assert_frame_equal(loaded['matrix'], matrix)
+    pd.testing.assert_series_equal(loaded['sample_types'], result['sample_types'])
+    assert loaded['metric'] == 'pearson'
+
+
+def test_concurrent_creates_share_one_job(queue_root):
+    queue = make_queue(queue_root)
+    kwargs = {'path': str(queue_root / 'input.txt')}
+    with ThreadPoolExecutor(8) as executor:
+        ids = set(executor.map(lambda _: queue._create('echo', kwargs, files=('path',)), range(16)))
+
+    assert len(ids) == 1
+    assert len(queue.list()) == 1
+    assert sorted(p.name for p in (queue_root / 'jobs').iterdir() if p.is_dir()) == sorted(ids)
+
+
+def test_failed_job_can_be_resubmitted(queue_root):
+    queue = make_queue(queue_root)
+    kwargs = {'path': str(queue_root / 'input.txt')}
+    failed = queue._create('echo', kwargs, files=('path',))
+    with queue._connect() as db:
+        db.execute("UPDATE jobs SET status = 'error' WHERE id = ?", (failed,))
+    assert queue._create('echo', kwargs, files=('path',)) != failed
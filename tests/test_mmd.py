@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from scipy.stats import spearmanr
+
+import mmd
+from embedding import Embedding
+from synthetic import make_embedding
+
+
+@pytest.fixture(scope='module')
+def emb():
+    return Embedding.from_frame(make_embedding(cells=3_000, samples=16, pcs=10, seed=2))
+
+
+def sketch_error(emb, n_features):
+    # every cell kept, so the only error is the random feature approximation
+    mmd_df, info = mmd.cell_mmd_matrix(emb, n_features=n_features, max_cells=len(emb))
+    return mmd.approximation_error(emb, mmd_df, info['bandwidth'], n_pairs=30)
+
+
+def test_sketched_mmd_is_close_to_exact(emb):
+    report = sketch_error(emb, 4096)
+
+    assert len(report) == 30
+    assert report['Rel_Error'].max() < 0.05
+    assert spearmanr(report['Exact_MMD'], report['Approx_MMD'])[0] > 0.95
+
+
+def test_error_shrinks_with_more_features(emb):
+    assert sketch_error(emb, 4096)['Abs_Error'].mean() < sketch_error(emb, 256)['Abs_Error'].mean()
+
+
+def test_exact_mmd_of_a_sample_with_itself_is_zero(emb):
+    cells = emb.cells(emb.samples[0])
+    assert mmd.exact_mmd(cells, cells, bandwidth=1.0) == pytest.approx(0.0, abs=1e-6)
+    assert mmd.exact_mmd(cells, cells + 1.0, bandwidth=1.0) > 0.1
+
+
+def test_random_features_approximate_the_kernel():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(40, 5))
+    features = mmd.RandomFourierFeatures(5, n_features=8192, bandwidth=2.0)
+    Z = features.transform(X).astype(np.float64)
+
+    sq = ((X[:, None] - X[None]) ** 2).sum(axis=2)
+    np.testing.assert_allclose(Z @ Z.T, np.exp(-sq / (2 * 2.0 ** 2)), atol=0.05)
@@ -0,0 +1,49 @@
+import dcor
+import numpy as np
+import pytest
+
+from synthetic import make_embedding
+from embedding import Embedding
+from nearest import CentroidIndex
+
+
+@pytest.fixture(scope='module')
+def emb():
+    return Embedding.from_frame(make_embedding(cells=6_000, samples=120, pcs=20, seed=2), dtype=np.float64)
+
+
+def test_brute_force_matches_dcor(emb):
+    index = CentroidIndex.from_store(emb)
+    sample = index.centroids.index[0]
+    top = index.brute_force(sample, k=5)
+
+    centroids = emb.centroids()
+    tumors = centroids[~emb.is_cell_line]
+    expected = tumors.apply(lambda row: dcor.distance_correlation(centroids.loc[sample].values, row.values), axis=1)
+    expected = expected.sort_values(ascending=False, kind='stable')[:5]
+    assert list(top['Match']) == list(expected.index)
+    np.testing.assert_allclose(top['Distance_Correlation'], expected.values, atol=1e-10)
+
+
+@pytest.mark.parametrize('n_components', [None, 16])
+def test_query_matches_brute_force(emb, n_components):
+    index = CentroidIndex.from_store(emb, n_components=n_components)
+    for sample in index.centroids.index[::7]:
+        fast = index.query(sample, k=5, shortlist=len(index.centroids))
+        exact = index.brute_force(sample, k=5)
+        assert list(fast['Match']) == list(exact['Match'])
+        np.testing.assert_allclose(fast['Distance_Correlation'], exact['Distance_Correlation'])
+
+
+def test_recall(emb):
+    # full signatures rank candidates by the exact score, so the shortlist never misses
+    assert CentroidIndex.from_store(emb, n_components=None).recall(k=5, shortlist=10) == 1.0
+    assert CentroidIndex.from_store(emb, n_components=16).recall(k=5, shortlist=40) >= 0.9
+
+
+def test_query_by_vector(emb):
+    index = CentroidIndex.from_store(emb)
+    vector = index.values[3]
+    top = index.query(vector, k=1, against='all')
+    assert top['Match'][0] == index.centroids.index[3]
+    assert top['Distance_Correlation'][0] == pytest.approx(1.0)
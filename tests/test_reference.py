@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from reference import HarmonyReference
+from synthetic import make_embedding
+
+
+@pytest.fixture(scope='module')
+def reference():
+    cells = make_embedding(cells=4_000, samples=30, pcs=10, seed=5)
+    pc_cols = [c for c in cells.columns if c.startswith('PC')]
+    centroids = cells.groupby('sample', observed=True)[pc_cols].mean()
+    return HarmonyReference.fit(centroids, sigma=0.2), centroids
+
+
+def test_a_sample_maps_the_same_alone_and_in_a_larger_upload(reference):
+    ref, centroids = reference
+    rng = np.random.default_rng(0)
+    # bulk-like queries: centroids with a shared offset and noise
+    upload = centroids.values[:12] + 0.5 + rng.normal(scale=0.1, size=(12, centroids.shape[1]))
+
+    together = ref.map(upload)
+    for i in (0, 5, 11):
+        np.testing.assert_allclose(ref.map(upload[i:i + 1])[0], together[i], atol=1e-12)
+    np.testing.assert_allclose(ref.map(upload[3:8]), together[3:8], atol=1e-12)
+
+
+def test_map_matches_the_per_sample_ridge_regression(reference):
+    ref, centroids = reference
+    z = centroids.values[:1] + 0.3
+    r = ref.soft_clusters(z)[:, 0]
+
+    corrections = []
+    for k in range(len(r)):
+        E = np.array([[ref.Nr[k] + r[k], r[k]], [r[k], r[k] + ref.lamb]])
+        F = np.vstack([ref.C[k] + r[k] * z[0], r[k] * z[0]])
+        corrections.append(r[k] * np.linalg.solve(E, F)[1])
+    np.testing.assert_allclose(ref.map(z)[0], z[0] - np.sum(corrections, axis=0), atol=1e-10)
+
+
+def test_reference_embedding_is_the_centroids(reference):
+    ref, centroids = reference
+    pd.testing.assert_frame_equal(
+        ref.reference_embedding(centroids.columns), centroids, check_names=False, atol=1e-8
+    )
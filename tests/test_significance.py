@@ -0,0 +1,83 @@
+import dcor
+import numpy as np
+import pandas as pd
+import pytest
+
+from significance import fdr_matrix, permutation_pvalues, significance_matrices
+from similarity import distance_correlation_matrix
+
+
+@pytest.fixture
+def samples():
+    """
+    Rows of X and Y as univariate samples of length 30; (0, 0) and (1, 4) are dependent.
+    """
+    rng = np.random.default_rng(1)
+    p = 30
+    X = rng.normal(size=(4, p))
+    Y = np.vstack([
+        X[0] * 2 + rng.normal(scale=0.2, size=p),
+        rng.normal(size=(3, p)),
+        X[1] ** 2 + rng.normal(scale=0.5, size=p),
+    ])
+    return X, Y
+
+
+def dcor_pvalues(X, Y, n):
+    return np.array([
+        [dcor.independence.distance_covariance_test(x, y, num_resamples=n, random_state=0).pvalue for y in Y]
+        for x in X
+    ])
+
+
+def test_permutation_pvalues_match_dcor(samples):
+    X, Y = samples
+    n = 999
+    # stop_after above n: every pair runs all permutations, as dcor does
+    ours, used = permutation_pvalues(X, Y, max_permutations=n, stop_after=n + 1, seed=0)
+    expected = dcor_pvalues(X, Y, n)
+
+    assert (used == n).all()
+    assert ours[0, 0] == expected[0, 0] == 1 / (n + 1)
+    assert ours[1, 4] < 0.01 and expected[1, 4] < 0.01
+    # two independent Monte Carlo estimates of the same p-value
+    tolerance = 4 * np.sqrt(2 * expected * (1 - expected) / n) + 2 / n
+    assert (np.abs(ours - expected) <= tolerance).all()
+
+
+def test_sequential_stopping_keeps_significant_pairs(samples):
+    X, Y = samples
+    pvalues, used = permutation_pvalues(X, Y, max_permutations=999, stop_after=10, seed=0)
+
+    assert used[0, 0] == 999 and pvalues[0, 0] == 1 / 1000
+    # unrelated pairs stop early
+    assert np.median(used) < 100
+    again, _ = permutation_pvalues(X, Y, max_permutations=999, stop_after=10, seed=0)
+    np.testing.assert_array_equal(pvalues, again)
+
+
+def test_fdr_matrix_is_benjamini_hochberg_over_present_entries():
+    pvalues = pd.DataFrame(
+        [[0.01, 0.04, np.nan], [0.03, 0.5, 0.002]], index=['a', 'b'], columns=['x', 'y', 'z']
+    )
+    fdr = fdr_matrix(pvalues)
+
+    flat = np.array([0.01, 0.04, 0.03, 0.5, 0.002])
+    order = np.argsort(flat)
+    ranked = flat[order] * len(flat) / np.arange(1, len(flat) + 1)
+    expected = np.empty(len(flat))
+    expected[order] = np.minimum.accumulate(ranked[::-1])[::-1]
+
+    assert np.isnan(fdr.loc['a', 'z'])
+    np.testing.assert_allclose(fdr.to_numpy().ravel()[[0, 1, 3, 4, 5]], expected)
+    assert (fdr.index == pvalues.index).all() and (fdr.columns == pvalues.columns).all()
+
+
+def test_significance_matrices_skip_missing_entries(samples):
+    X, Y = samples
+    matrix = pd.DataFrame(distance_correlation_matrix(X, Y))
+    matrix.iloc[2, 3] = np.nan
+    pvalues, fdr = significance_matrices(matrix, X, Y, max_permutations=99)
+
+    assert np.isnan(pvalues.iloc[2, 3]) and np.isnan(fdr.iloc[2, 3])
+    assert pvalues.notna().sum().sum() == matrix.size - 1
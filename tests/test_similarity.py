@@ -0,0 +1,106 @@
+import dcor
+import numpy as np
+import pytest
+from scipy.spatial.distance import cosine, euclidean
+from scipy.stats import pearsonr, spearmanr
+
+import similarity
+from similarity import METRICS, similarity_matrix
+
+
+def pairwise(fn, X, Y):
+    return np.array([[fn(x, y) for y in Y] for x in X])
+
+
+REFERENCE = {
+    'distance_correlation': dcor.distance_correlation,
+    'distance_correlation_fast': dcor.distance_correlation,
+    'pearson': lambda x, y: pearsonr(x, y)[0],
+    'spearman': lambda x, y: spearmanr(x, y)[0],
+    'cosine': lambda x, y: 1 - cosine(x, y),
+    'euclidean': euclidean,
+}
+
+
+@pytest.fixture
+def rows():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(7, 50))
+    Y = np.vstack([rng.normal(size=(5, 50)), 2 * X[:1] + 1, -X[1:2]])
+    return X, Y
+
+
+def test_every_metric_has_a_reference():
+    assert set(REFERENCE) == set(METRICS)
+
+
+@pytest.mark.parametrize('metric', list(METRICS))
+def test_metric_matches_pairwise_reference(metric, rows):
+    X, Y = rows
+    expected = pairwise(REFERENCE[metric], X, Y)
+
+    np.testing.assert_allclose(similarity_matrix(X, Y, metric, np.float64), expected, atol=1e-10)
+    np.testing.assert_allclose(similarity_matrix(X, Y, metric, np.float32), expected, atol=1e-4)
+
+
+@pytest.mark.parametrize('metric', list(METRICS))
+def test_metric_matches_reference_with_ties(metric):
+    # integer PCs give tied values within and across rows
+    rng = np.random.default_rng(1)
+    X = rng.integers(-3, 4, size=(4, 30)).astype(float)
+    Y = rng.integers(-3, 4, size=(3, 30)).astype(float)
+    np.testing.assert_allclose(
+        similarity_matrix(X, Y, metric, np.float64), pairwise(REFERENCE[metric], X, Y), atol=1e-10
+    )
+
+
+@pytest.mark.parametrize('p', [2, 3, 17, 300])
+def test_fast_distance_correlation_matches_dcor(p):
+    rng = np.random.default_rng(p)
+    X = rng.normal(size=(3, p))
+    Y = rng.exponential(size=(4, p))
+    expected = pairwise(dcor.distance_correlation, X, Y)
+
+    np.testing.assert_allclose(similarity.fast_distance_correlation_matrix(X, Y, np.float64), expected, atol=1e-10)
+    np.testing.assert_allclose(similarity_matrix(X, Y, 'distance_correlation', np.float64), expected, atol=1e-10)
+
+
+def test_constant_rows():
+    X = np.ones((2, 10))
+    Y = np.random.default_rng(0).normal(size=(3, 10))
+    for metric in ('distance_correlation', 'distance_correlation_fast'):
+        assert np.array_equal(similarity_matrix(X, Y, metric), np.zeros((2, 3)))
+    for metric in ('pearson', 'spearman'):
+        assert np.isnan(similarity_matrix(X, Y, metric)).all()
+
+
+def test_dcor_loop_is_the_reference(rows):
+    X, Y = rows
+    np.testing.assert_array_equal(similarity.dcor_loop(X, Y), pairwise(dcor.distance_correlation, X, Y))
+
+
+def test_unknown_metric():
+    with pytest.raises(ValueError, match='Unknown similarity metric'):
+        similarity_matrix(np.ones((1, 3)), np.ones((1, 3)), 'manhattan')
+
+
+def test_similarity_matrix_returns_float64(rows):
+    X, Y = rows
+    assert similarity_matrix(X, Y, 'pearson', np.float32).dtype == np.float64
+
+
+@pytest.mark.parametrize('p', [2, 7, 50])
+def test_distance_correlation_matrix_matches_dcor(p):
+    rng = np.random.default_rng(p)
+    X = rng.normal(size=(6, p))
+    Y = np.vstack([rng.normal(size=(4, p)), X[:1] * 3 + 1])
+    expected = np.array([[dcor.distance_correlation(x, y) for y in Y] for x in X])
+
+    np.testing.assert_allclose(similarity.distance_correlation_matrix(X, Y), expected, atol=1e-10)
+    np.testing.assert_allclose(similarity.distance_correlation_matrix(X, Y, np.float32), expected, atol=1e-4)
+
+
+def test_distance_correlation_matrix_constant_rows():
+    X = np.ones((2, 10))
+    Y = np.random.default_rng(0).normal(size=(3, 10))
+    assert np.array_equal(similarity.distance_correlation_matrix(X, Y), np.zeros((2, 3)))
@@ -0,0 +1,29 @@
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from benchmark import STARTUP_BUDGET, measure_startup
+
+pytest.importorskip('shiny')
+pytest.importorskip('uvicorn')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_app_starts_within_budget(tmp_path):
+    # an empty directory: nothing may be loaded before the first page is served
+    timings = measure_startup(str(tmp_path), repeat=2, port=free_port())
+    for name, budget in STARTUP_BUDGET.items():
+        assert timings[name] <= budget, f"{name}: {timings[name]:.2f}s over the {budget:.1f}s budget"
+
+
+def test_ui_imports_no_data_libraries():
+    code = "import sys, ui; print(sorted(m for m in ('pandas', 'scipy.sparse', 'pyarrow') if m in sys.modules))"
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert out.strip() == '[]'
@@ -0,0 +1,119 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from tasks import SingleFlight
+
+
+def make_array(n):
+    return np.zeros(n, dtype=np.uint8)
+
+
+class FakePool:
+    """
+    pool.run stand-in: runs fn inline after `release` is set, emitting one progress event.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def run(self, fn, *args, on_event=None):
+        self.calls += 1
+        if on_event is not None:
+            on_event({'stage': 'similarity', 'status': 'start'})
+        await self.release.wait()
+        return fn(*args)
+
+
+def test_concurrent_callers_share_one_run():
+    async def main():
+        pool = FakePool()
+        shared = SingleFlight(pool)
+        first_events, second_events = [], []
+        first = asyncio.ensure_future(shared.run(make_array, 1000, on_event=first_events.append))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(shared.run(make_array, 1000, on_event=second_events.append))
+        await asyncio.sleep(0)
+        pool.release.set()
+        results = await asyncio.gather(first, second)
+        return pool, shared, results, first_events, second_events
+
+    pool, shared, (a, b), first_events, second_events = asyncio.run(main())
+    assert pool.calls == 1
+    assert (shared.misses, shared.joins, shared.hits) == (1, 1, 0)
+    assert a is b
+    # the late joiner gets the events replayed
+    assert first_events == second_events == [{'stage': 'similarity', 'status': 'start'}]
+
+
+def test_results_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('tasks.time.monotonic', lambda: now[0])
+
+    async def main():
+        pool = FakePool()
+        pool.release.set()
+        shared = SingleFlight(pool, ttl=60)
+        await shared.run(make_array, 10)
+        now[0] += 30
+        await shared.run(make_array, 10)
+        hits_before_expiry = (pool.calls, shared.hits)
+        now[0] += 31
+        await shared.run(make_array, 10)
+        return hits_before_expiry, pool.calls, shared
+
+    (calls, hits), calls_after, shared = asyncio.run(main())
+    assert (calls, hits) == (1, 1)
+    assert calls_after == 2 and shared.misses == 2
+
+
+def test_results_are_evicted_by_bytes():
+    async def main():
+        pool = FakePool()
+        pool.release.set()
+        shared = SingleFlight(pool, max_bytes=2500)
+        for n in (1000, 1001, 1002):
+            await shared.run(make_array, n)
+        await shared.run(make_array, 10_000)
+        return pool, shared
+
+    pool, shared = asyncio.run(main())
+    # least recently used out; results larger than max_bytes are never kept
+    assert [entry[2].size for entry in shared._results.values()] == [1001, 1002]
+    assert shared.bytes == 2003 <= shared.max_bytes
+    assert pool.calls == 4
+
+
+def test_failures_are_not_kept():
+    def fail():
+        raise RuntimeError('boom')
+
+    async def main():
+        pool = FakePool()
+        pool.release.set()
+        shared = SingleFlight(pool)
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await shared.run(fail)
+        return pool
+
+    assert asyncio.run(main()).calls == 2
+
+
+def test_run_is_cancelled_when_every_waiter_leaves():
+    async def main():
+        pool = FakePool()
+        shared = SingleFlight(pool)
+        waiter = asyncio.ensure_future(shared.run(make_array, 5))
+        await asyncio.sleep(0)
+        flight = next(iter(shared._flights.values()))
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        await asyncio.sleep(0)
+        return shared, flight
+
+    shared, flight = asyncio.run(main())
+    assert flight.task.cancelled()
+    assert not shared._flights
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from views import ResultView
+
+
+@pytest.fixture
+def matrix():
+    rng = np.random.default_rng(6)
+    values = pd.DataFrame(
+        rng.random((12, 9)), index=[f"CL_{i}" for i in range(12)], columns=[f"TU_{j}" for j in range(9)]
+    )
+    values.iloc[2, 3] = np.nan
+    return values
+
+
+@pytest.fixture
+def view(matrix):
+    pvalues = pd.DataFrame(np.random.default_rng(7).random(matrix.shape), index=matrix.index, columns=matrix.columns)
+    return ResultView.from_matrix(matrix, 'CCLE', 'Tumor', 'Correlation', extra={'P-value': pvalues})
+
+
+def all_pages(view, page_size, **kwargs):
+    window, total = view.page(0, page_size, **kwargs)
+    pages = [window] + [view.page(page, page_size, **kwargs)[0] for page in range(1, -(-total // page_size))]
+    return pd.concat(pages, ignore_index=True), total
+
+
+def test_pages_cover_the_long_format_in_order(matrix, view):
+    frame, total = all_pages(view, page_size=10)
+
+    expected = matrix.stack().dropna().sort_values(ascending=False)
+    assert total == len(view) == matrix.size - 1
+    np.testing.assert_array_equal(frame['Correlation'], expected.to_numpy())
+    assert list(zip(frame['CCLE'], frame['Tumor'])) == list(expected.index)
+
+
+def test_page_numbers_are_clipped(view):
+    first, _ = view.page(-3, 25)
+    last, total = view.page(100, 25)
+    assert first.equals(view.page(0, 25)[0])
+    assert len(last) == total - 25 * ((total - 1) // 25)
+
+
+@pytest.mark.parametrize('sort, descending', [
+    ('Correlation', False), ('Correlation', True), ('P-value', False), ('P-value', True), ('CCLE', False),
+])
+def test_sorting_matches_pandas(view, sort, descending):
+    frame, _ = all_pages(view, page_size=7, sort=sort, descending=descending)
+    # key columns sort by name
+    expected = view.frame.astype({'CCLE': str, 'Tumor': str}).sort_values(sort, ascending=not descending)
+
+    assert list(frame[sort].astype(str)) == list(expected[sort].astype(str))
+    assert sorted(zip(frame['CCLE'], frame['Tumor'])) == sorted(zip(expected['CCLE'], expected['Tumor']))
+
+
+def test_filters_and_sort_combine(view):
+    frame, total = all_pages(view, page_size=4, filters={'CCLE': 'CL_2', 'Tumor': ''}, sort='P-value')
+
+    assert total == 8 and set(frame['CCLE']) == {'CL_2'}
+    assert frame['P-value'].is_monotonic_decreasing
+    assert view.page(0, 10, filters={'CCLE': 'missing'})[1] == 0
+
+
+def test_search_and_categorical_pages():
+    frame = pd.DataFrame({
+        'Term': ['Apoptosis', 'Cell cycle', 'apoptotic signalling', 'DNA repair'],
+        'Adjusted P-value': [0.01, 0.2, 0.03, 0.5],
+    })
+    view = ResultView(frame, 'Adjusted P-value', search_cols=['Term'], ascending=True)
+
+    window, total = view.page(0, 10, search='APOPT')
+    assert total == 2 and list(window['Term']) == ['Apoptosis', 'apoptotic signalling']
+    window, _ = ResultView.from_matrix(pd.DataFrame([[1.0]], index=['a'], columns=['b']), 'r', 'c', 'v').page()
+    # pages carry plain strings, not the key columns' categoricals
+    assert not isinstance(window['r'].dtype, pd.CategoricalDtype)
@@ -1,11 +1,58 @@
 from shiny import ui
-from data import sc_samples, degs, libraries
+from constants import BULK_EXTENSIONS, EXPORT_FORMATS, PAGE_SIZES, RESULT_COLUMNS
+
+# similarity.METRICS choices
+CENTROID_METRICS = {
+    "distance_correlation": "Distance correlation",
+    "distance_correlation_fast": "Distance correlation (O(p log p), large p)",
+    "pearson": "Pearson correlation",
+    "spearman": "Spearman correlation",
+    "cosine": "Cosine similarity",
+    "euclidean": "Euclidean distance",
+}
 
 gear_fill = ui.HTML(
     '<svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="currentColor" class="bi bi-gear-fill" viewBox="0 0 16 16"><path d="M9.405 1.05c-.413-1.4-2.397-1.4-2.81 0l-.1.34a1.464 1.464 0 0 1-2.105.872l-.31-.17c-1.283-.698-2.686.705-1.987 1.987l.169.311c.446.82.023 1.841-.872 2.105l-.34.1c-1.4.413-1.4 2.397 0 2.81l.34.1a1.464 1.464 0 0 1 .872 2.105l-.17.31c-.698 1.283.705 2.686 1.987 1.987l.311-.169a1.464 1.464 0 0 1 2.105.872l.1.34c.413 1.4 2.397 1.4 2.81 0l.1-.34a1.464 1.464 0 0 1 2.105-.872l.31.17c1.283.698 2.686-.705 1.987-1.987l-.169-.311a1.464 1.464 0 0 1 .872-2.105l.34-.1c1.4-.413 1.4-2.397 0-2.81l-.34-.1a1.464 1.464 0 0 1-.872-2.105l.17-.31c.698-1.283-.705-2.686-1.987-1.987l-.311.169a1.464 1.464 0 0 1-2.105-.872l-.1-.34zM8 10.93a2.929 2.929 0 1 1 0-5.86 2.929 2.929 0 0 1 0 5.858z"/></svg>'
 )
 
 
+def result_table(id, columns, key_cols=(), search=False, descending=True):
+    """
+    Server-paged table: filter/sort/page controls, the data frame output `id`
+    and a row-count line `{id}_info`. See server.serve_table.
+    """
+    controls = [
+        ui.input_selectize(f"{id}_filter_{i}", f"{col}:", choices=[], options={"placeholder": "All"})
+        for i, col in enumerate(key_cols)
+    ]
+    if search:
+        controls.append(ui.input_text(f"{id}_search", "Search:"))
+    controls += [
+        ui.input_select(f"{id}_sort", "Sort by:", choices=columns, selected=columns[-1]),
+        ui.input_checkbox(f"{id}_descending", "Descending", value=descending),
+        ui.input_numeric(f"{id}_page", "Page:", value=1, min=1),
+        ui.input_select(f"{id}_page_size", "Rows:", choices=[str(n) for n in PAGE_SIZES], selected="50"),
+    ]
+    return ui.TagList(
+        ui.layout_columns(*controls),
+        ui.output_data_frame(id),
+        ui.output_text(f"{id}_info")
+    )
+
+
+def download_controls(id, label):
+    """
+    Download button `id` with a file format select `{id}_format`.
+    """
+    return ui.layout_columns(
+        ui.download_button(id, label, class_="btn-primary"),
+        ui.input_select(
+            f"{id}_format", None, choices={fmt: spec[0] for fmt, spec in EXPORT_FORMATS.items()}, selected="csv"
+        ),
+        col_widths=[8, 4]
+    )
+
+
 app_ui = ui.page_fluid(
     ui.tags.style("""
         .btn-custom-height {
@@ -22,22 +69,51 @@ app_ui = ui.page_fluid(
                     ui.input_select(
                         "dataset_choice",
                         "Select Dataset:",
-                        choices=list(sc_samples.keys()),
+                        choices=[],
                         multiple=False
                     ),
+                    ui.input_select(
+                        "similarity_metric",
+                        "Compare:",
+                        choices={
+                            "Sample centroids": CENTROID_METRICS,
+                            "Cell distributions": {"mmd": "MMD"}
+                        },
+                        selected="distance_correlation"
+                    ),
+                    ui.input_checkbox(
+                        "similarity_pvalues", "Permutation p-values and FDR (centroids only, slower)", value=False
+                    ),
+                    ui.input_checkbox(
+                        "similarity_bootstrap", "Bootstrap CIs and rank probabilities (centroids only, slower)",
+                        value=False
+                    ),
                 ),
                 ui.input_action_button("run_analysis", "Run Analysis", width="100%", class_="btn-custom-height"),
                 ui.card(
-                    ui.download_button("download_table", "Download Table", class_="btn-primary"),
-                    ui.output_data_frame("results_table"),
+                    download_controls("download_table", "Download Table"),
+                    result_table(
+                        "results_table", ["CCLE", "Primary Tumor", "Distance Correlation"],
+                        key_cols=["CCLE", "Primary Tumor"]
+                    ),
                     full_screen=True
                 ),
                 ui.card(
                     "Heatmap Visualization",
-                    ui.output_plot("heatmap_plot", height="400px"),
+                    ui.input_checkbox("heatmap_cluster", "Cluster rows and columns", value=False),
+                    ui.output_ui("heatmap_plot", style="height: 400px;"),
                     full_screen=True
                 ),
-                col_widths=[8, 2, 6, 6]
+                ui.card(
+                    "Best Matches for a Sample",
+                    ui.layout_columns(
+                        ui.input_selectize("match_sample", "Sample:", choices=[], options={"placeholder": "Choose a sample"}),
+                        ui.input_numeric("match_k", "Top k:", value=10, min=1, max=100),
+                        col_widths=[8, 4]
+                    ),
+                    ui.output_data_frame("matches_table"),
+                ),
+                col_widths=[8, 2, 6, 6, 12]
             )
         ),
         ui.nav_panel(
@@ -48,7 +124,7 @@ app_ui = ui.page_fluid(
                         ui.input_select(
                             "degs_choice",
                             "DEGs Dataset:",
-                            choices=list(degs.keys()),
+                            choices=[],
                             multiple=False
                         ),
                         ui.input_select(
@@ -60,7 +136,7 @@ app_ui = ui.page_fluid(
                         ui.input_select(
                             "library_choice",
                             "Libraries:",
-                            choices=libraries,
+                            choices=[],
                             multiple=False
                         ),
                         col_widths=[4, 4, 4],
@@ -68,8 +144,8 @@ app_ui = ui.page_fluid(
                 ),
                 ui.input_action_button("run_enrichment", "Run Enrichment", width="100%", class_="btn-custom-height"),
                 ui.card(
-                    ui.download_button("download_enrichment", "Download Results", class_="btn-primary"),
-                    ui.output_data_frame("enrichment_table"),
+                    download_controls("download_enrichment", "Download Results"),
+                    result_table("enrichment_table", RESULT_COLUMNS, search=True, descending=False),
                     full_screen=True
                 ),
                 ui.card(
@@ -87,7 +163,7 @@ app_ui = ui.page_fluid(
                     ui.input_select(
                         "cross_modal_cancer",
                         "Cancer Dataset:",
-                        choices=list(sc_samples.keys()),
+                        choices=[],
                         multiple=False
                     ),
                 ),
@@ -95,12 +171,37 @@ app_ui = ui.page_fluid(
                     ui.input_file(
                         "bulk_upload",
                         "Upload Bulk Data:",
-                        accept=[".csv"]
-                    )),
+                        accept=BULK_EXTENSIONS
+                    ),
+                    ui.input_checkbox(
+                        "frozen_reference",
+                        "Map onto frozen reference (don't refit Harmony)",
+                        value=False
+                    ),
+                    ui.input_select(
+                        "cross_modal_metric", "Similarity:", choices=CENTROID_METRICS, selected="distance_correlation"
+                    ),
+                    ui.input_checkbox(
+                        "cross_modal_pvalues", "Permutation p-values and FDR (distance correlation only, slower)",
+                        value=False
+                    ),
+                    ui.input_numeric(
+                        "cross_modal_top_k", "Keep only the top k matches per bulk sample (0: full matrix):",
+                        value=0, min=0
+                    ),
+                    ui.layout_columns(
+                        ui.input_text("job_id", "Job ID:", placeholder="reload an earlier run"),
+                        ui.input_action_button("load_job", "Load Job"),
+                        col_widths=[8, 4]
+                    ),
+                    ui.output_text("job_info")),
                 ui.input_action_button("run_cross_modal", "Run Integration", width="100%", class_="btn-custom-height"),
                 ui.card(
-                    ui.download_button("download_cross_modal", "Download Matrix", class_="btn-primary"),
-                    ui.output_data_frame("cross_modal_table"),
+                    download_controls("download_cross_modal", "Download Matrix"),
+                    result_table(
+                        "cross_modal_table", ["Bulk_Sample", "Pseudo_Centroid", "Distance_Correlation"],
+                        key_cols=["Bulk_Sample", "Pseudo_Centroid"]
+                    ),
                     full_screen=True
                 ),
                 ui.card(
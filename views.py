@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+from constants import PAGE_SIZES
+from similarity import METRICS
+
+
+# similarity job metric -> (value column label, lower is more similar)
+SIMILARITY_METRICS = {
+    **{name: (label, ascending) for name, (_, label, ascending) in METRICS.items()},
+    'mmd': ("Cell MMD", True),
+}
+
+
+class ResultView:
+    """
+    Sorted, indexed long-format view of one result, for serving tables a
+    page at a time.
+
+    The frame is sorted once by its main column. Per-value position indexes
+    are built for the key columns (e.g. sample names), and argsort orders
+    for other columns are computed on first use and kept, so filtering,
+    sorting and paging only touch the rows being returned.
+    """
+
+    def __init__(self, frame: pd.DataFrame, sort_col, key_cols=(), search_cols=(), ascending=False):
+        self.frame = frame.sort_values(sort_col, ascending=ascending, kind='stable').reset_index(drop=True)
+        self.sort_col = sort_col
+        self.ascending = ascending
+        self.key_cols = list(key_cols)
+        self.search_cols = list(search_cols)
+        self._ranks = {}
+        self.positions = {
+            col: {
+                str(value): np.sort(pos)
+                for value, pos in self.frame.groupby(col, observed=True, sort=False).indices.items()
+            }
+            for col in self.key_cols
+        }
+
+    @classmethod
+    def from_matrix(cls, matrix: pd.DataFrame, row_name, col_name, value_name, extra=None, ascending=False):
+        """
+        View of a wide matrix in long format (row_name, col_name, value_name),
+        dropping missing values, sorted by value (descending unless
+        ascending). Same rows as convert_to_long_format / convert_cross_modal_to_long.
+
+        extra: optional {column name: matrix} of values aligned with `matrix`
+        (e.g. p-values), added as further columns.
+        """
+        values = matrix.to_numpy(dtype=np.float64)
+        rows = np.repeat(np.arange(values.shape[0]), values.shape[1])
+        cols = np.tile(np.arange(values.shape[1]), values.shape[0])
+        flat = values.ravel()
+        keep = ~np.isnan(flat)
+        frame = pd.DataFrame({
+            row_name: pd.Categorical.from_codes(rows[keep], matrix.index),
+            col_name: pd.Categorical.from_codes(cols[keep], matrix.columns),
+            value_name: flat[keep]
+        })
+        for name, values in (extra or {}).items():
+            values = values.reindex(index=matrix.index, columns=matrix.columns)
+            frame[name] = values.to_numpy(dtype=np.float64).ravel()[keep]
+        return cls(frame, value_name, key_cols=(row_name, col_name), ascending=ascending)
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def columns(self):
+        return list(self.frame.columns)
+
+    def choices(self, col):
+        return sorted(self.positions[col])
+
+    def _rank(self, col):
+        """
+        rank[i] = place of row i when sorted ascending by col.
+        """
+        if col not in self._ranks:
+            order = np.argsort(self.frame[col].to_numpy(), kind='stable')
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            self._ranks[col] = rank
+        return self._ranks[col]
+
+    def select(self, filters=None, search=None):
+        """
+        Row positions (in main sort order) matching every key-column filter
+        ({col: value}) and, if given, containing `search` in a search column.
+        """
+        rows = None
+        for col, value in (filters or {}).items():
+            if value in (None, ''):
+                continue
+            pos = self.positions[col].get(str(value), np.array([], dtype=np.int64))
+            rows = pos if rows is None else np.intersect1d(rows, pos, assume_unique=True)
+        if search:
+            subset = self.frame if rows is None else self.frame.iloc[rows]
+            hit = np.zeros(len(subset), dtype=bool)
+            for col in self.search_cols:
+                hit |= subset[col].astype(str).str.contains(search, case=False, regex=False).to_numpy()
+            rows = np.flatnonzero(hit) if rows is None else rows[hit]
+        return np.arange(len(self.frame)) if rows is None else rows
+
+    def page(self, page=0, page_size=50, filters=None, search=None, sort=None, descending=None):
+        """
+        One page of the view.
+
+        Args:
+            page: zero-based page number (clipped to the last page).
+            page_size: rows per page.
+            filters: {key column: value} exact matches.
+            search: case-insensitive substring over the search columns.
+            sort: column to sort by (default: the main sort column).
+            descending: sort direction (default: the main sort direction).
+
+        Returns:
+            (DataFrame of at most page_size rows, number of matching rows).
+        """
+        rows = self.select(filters, search)
+        sort = sort or self.sort_col
+        descending = (not self.ascending) if descending is None else descending
+
+        if sort == self.sort_col and descending != self.ascending:
+            ordered = rows
+        elif sort == self.sort_col:
+            ordered = rows[::-1]
+        else:
+            rank = self._rank(sort)[rows]
+            ordered = rows[np.argsort(-rank if descending else rank, kind='stable')]
+
+        total = len(ordered)
+        last = max(0, (total - 1) // page_size)
+        start = min(max(0, int(page)), last) * page_size
+        window = self.frame.iloc[ordered[start:start + page_size]]
+        # plain strings, so a page does not carry every category with it
+        window = window.astype({c: str for c in window.columns if isinstance(window[c].dtype, pd.CategoricalDtype)})
+        return window, total